@@ -0,0 +1,234 @@
+'''
+The code is used to benchmark each stage of the detection path offline: fetching a camera frame, decoding it,
+preprocessing, the onnx session run, post processing and nms.
+It runs against a directory of sample JPEGs or synthetic frames at given resolutions, and against the real model
+weights or a generated stand-in model with the same inputs and outputs. Latency percentiles and allocations are
+reported for each stage and can be saved as JSON to compare against a later run.
+
+Example:
+    python appdaemon/benchmarks/bench_detection.py --resolution 1920x1080 --resolution 640x480 --output before.json
+    python appdaemon/benchmarks/bench_detection.py --resolution 1920x1080 --resolution 640x480 --compare before.json
+'''
+
+import argparse
+import glob
+import http.server
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+APPS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'conf', 'apps')
+sys.path.insert(0, APPS_DIR)
+
+from lib.detection_model import load_net
+from lib.frame_source import CameraProxyFrameSource
+from lib.onnx import batched_nms, post_processing
+from standin_model import make_standin_model
+
+STAGES = ('fetch', 'decode', 'preprocess', 'session.run', 'post_processing', 'nms_cpu')
+
+def synthetic_frame(width: int, height: int, seed: int) -> np.ndarray:
+    """Generate a camera-like frame: smooth shading with some detail, so it compresses like a real JPEG."""
+    rng = np.random.default_rng(seed)
+    frame = cv2.resize(rng.integers(0, 255, (height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8), (width, height),
+                       interpolation=cv2.INTER_CUBIC)
+    for _ in range(20):
+        p1 = tuple(int(v) for v in rng.integers(0, [width, height]))
+        p2 = tuple(int(v) for v in rng.integers(0, [width, height]))
+        cv2.line(frame, p1, p2, tuple(int(v) for v in rng.integers(0, 255, 3)), int(rng.integers(1, 6)))
+    return frame
+
+def load_frame_sets(image_dir: str, resolutions: List[str]) -> Dict[str, List[bytes]]:
+    """Load the encoded frames to benchmark with, grouped by a label for each set."""
+    frame_sets = {}
+    if image_dir:
+        paths = sorted(glob.glob(os.path.join(image_dir, '*.jpg')) + glob.glob(os.path.join(image_dir, '*.jpeg')))
+        if not paths:
+            raise SystemExit(f"No JPEG images found in {image_dir}")
+        frame_sets[os.path.basename(os.path.normpath(image_dir))] = [open(path, 'rb').read() for path in paths]
+    for resolution in resolutions:
+        width, height = (int(v) for v in resolution.lower().split('x'))
+        frame_sets[resolution] = [cv2.imencode('.jpg', synthetic_frame(width, height, seed))[1].tobytes() for seed in range(4)]
+    return frame_sets
+
+class FrameServer:
+    """A loopback HTTP server standing in for Home Assistant's camera_proxy endpoint, serving the frames in turn."""
+
+    def __init__(self, frames: List[bytes]):
+        state = {'next': 0}
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                frame = frames[state['next'] % len(frames)]
+                state['next'] += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(frame)))
+                self.end_headers()
+                self.wfile.write(frame)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def measure(func: Callable, iterations: int, warmup: int, alloc_iterations: int) -> dict:
+    """
+    Measure a stage. Latency is measured first without tracing, then allocations are traced over separate calls.
+    Allocations only cover memory allocated through Python (including numpy and OpenCV arrays), not the onnxruntime arena.
+    """
+    for _ in range(warmup):
+        func()
+    latencies = np.empty(iterations, dtype=np.float64)
+    for i in range(iterations):
+        start = time.perf_counter()
+        func()
+        latencies[i] = time.perf_counter() - start
+    latencies *= 1000.0
+
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    for _ in range(alloc_iterations):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func()
+        after, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+        retained.append(after - before)
+        del result
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return dict(samples=iterations, mean_ms=float(latencies.mean()), p50_ms=float(p50), p95_ms=float(p95), p99_ms=float(p99),
+                alloc_peak_bytes=int(np.mean(peaks)) if peaks else 0, alloc_retained_bytes=int(np.mean(retained)) if retained else 0)
+
+def benchmark_frame_set(net, frames: List[bytes], args) -> Dict[str, dict]:
+    """Benchmark every stage of the detection path for a set of frames."""
+    counter = {'next': 0}
+
+    def next_frame() -> bytes:
+        counter['next'] += 1
+        return frames[counter['next'] % len(frames)]
+
+    min_size = (net.input_w, net.input_h) if args.reduced_decode else None
+    images = [CameraProxyFrameSource.decode(frame, min_size) for frame in frames]
+    batch = [images[i % len(images)] for i in range(args.batch)]
+    sizes = [image.shape[:2] for image in batch]
+    input_tensor = net.preprocess(batch).copy()
+    outputs = net.infer(input_tensor)
+
+    # candidates for nms are the boxes of the first image above the threshold, as post_processing passes them
+    box_array = outputs[0][0, :, 0]
+    confs = outputs[1][0]
+    max_conf = confs.max(axis=1)
+    candidates = max_conf > args.threshold
+    nms_boxes = box_array[candidates]
+    nms_confs = max_conf[candidates]
+    nms_ids = confs.argmax(axis=1)[candidates]
+
+    stages = {}
+    if args.fetch:
+        server = FrameServer(frames)
+        source = CameraProxyFrameSource(server.url, 'benchmark')
+        try:
+            stages['fetch'] = measure(lambda: source.fetch_jpeg('camera.benchmark'), args.iterations, args.warmup, args.alloc_iterations)
+        finally:
+            source.close()
+            server.close()
+    stages['decode'] = measure(lambda: CameraProxyFrameSource.decode(next_frame(), min_size), args.iterations, args.warmup, args.alloc_iterations)
+    stages['preprocess'] = measure(lambda: net.release_input(net.preprocess(batch)), args.iterations, args.warmup, args.alloc_iterations)
+    stages['session.run'] = measure(lambda: net.infer(input_tensor), args.iterations, args.warmup, args.alloc_iterations)
+    stages['post_processing'] = measure(lambda: post_processing(outputs, [s[1] for s in sizes], [s[0] for s in sizes], args.threshold, args.nms),
+                                        args.iterations, args.warmup, args.alloc_iterations)
+    stages['nms_cpu'] = measure(lambda: batched_nms(nms_boxes, nms_confs, nms_ids, args.nms), args.iterations, args.warmup, args.alloc_iterations)
+    stages['nms_cpu']['candidates'] = int(len(nms_boxes))
+    return stages
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.realpath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def print_results(results: dict, baseline: dict = None) -> None:
+    """Print the results as a table, with the change in p50 and p95 from a baseline run if given."""
+    for label, stages in results['frame_sets'].items():
+        print(f"\n== {label} ==")
+        print(f"{'stage':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'alloc peak':>14}{'retained':>12}" + (f"{'p50 chg':>10}{'p95 chg':>10}" if baseline else ''))
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            result = stages[stage]
+            line = f"{stage:<16}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['alloc_peak_bytes']:>14,}{result['alloc_retained_bytes']:>12,}"
+            base = (baseline or {}).get('frame_sets', {}).get(label, {}).get(stage)
+            if base:
+                for key in ('p50_ms', 'p95_ms'):
+                    line += f"{(result[key] - base[key]) / base[key] * 100 if base[key] else 0.0:>+9.1f}%"
+            print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the detection path.")
+    parser.add_argument('--images', help="Directory of sample JPEG frames to benchmark with")
+    parser.add_argument('--resolution', action='append', default=[], help="Benchmark with synthetic frames at WIDTHxHEIGHT, may be repeated")
+    parser.add_argument('--weights', help="The model onnx file (default: generate a stand-in model)")
+    parser.add_argument('--meta', default=os.path.join(APPS_DIR, '..', 'model', 'model.meta'), help="The model meta file")
+    parser.add_argument('--standin-depth', type=int, default=2, help="Hidden convolutions in the stand-in model, increase to make it slower")
+    parser.add_argument('--batch', type=int, default=1, help="Number of frames per batch, as in fleet mode")
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--nms', type=float, default=0.4)
+    parser.add_argument('--no-reduced-decode', dest='reduced_decode', action='store_false', help="Always decode frames at full resolution")
+    parser.add_argument('--no-fetch', dest='fetch', action='store_false', help="Skip the fetch stage (served from a loopback HTTP server)")
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--alloc-iterations', type=int, default=10)
+    parser.add_argument('--output', help="Save the results as JSON to this file")
+    parser.add_argument('--compare', help="A JSON results file from an earlier run to compare against")
+    args = parser.parse_args()
+
+    if not args.images and not args.resolution:
+        args.resolution = ['1920x1080', '1280x720', '640x480']
+    frame_sets = load_frame_sets(args.images, args.resolution)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        weights = args.weights or make_standin_model(os.path.join(tmp, 'standin.onnx'), depth=args.standin_depth)
+        net = load_net(None, args.meta, weights)
+        results = dict(
+            meta=dict(commit=git_commit(), time=time.strftime('%Y-%m-%dT%H:%M:%S'), python=platform.python_version(),
+                      machine=platform.machine(), processor=platform.processor(), numpy=np.__version__, opencv=cv2.__version__,
+                      onnxruntime=__import__('onnxruntime').__version__, weights='stand-in' if not args.weights else os.path.basename(args.weights),
+                      args={k: v for k, v in vars(args).items() if k not in ('output', 'compare')}),
+            frame_sets={label: benchmark_frame_set(net, frames, args) for label, frames in frame_sets.items()})
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Comparing against {args.compare} (commit {baseline.get('meta', {}).get('commit', 'unknown')})")
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+if __name__ == '__main__':
+    main()
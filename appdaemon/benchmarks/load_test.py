@@ -0,0 +1,681 @@
+'''
+The code is used to load test the whole app end to end, without Home Assistant, a phone or any printers.
+It runs the real PrintDetect app against a mock Home Assistant in a child process, which serves the camera_proxy and
+camera_proxy_stream endpoints of every printer's camera from recorded (or synthetic) frames with a configurable latency,
+error rate and rate of hanging requests, and serves the saved snapshots and evidence under /media/local.
+The AppDaemon API is replaced by a mock that runs the app's callbacks one at a time on a single thread, as AppDaemon does,
+and records the notifications sent and stop buttons pressed.
+
+For each fleet size, every printer starts printing, and part way through the run a fraction of the cameras switch to the
+failure frames. The report covers the end to end detection latency of a cycle (camera fetch to decision), the time from the
+failure frames appearing to the notification, the time from the notification to the stop button being pressed, dropped,
+skipped and failed cycles, and the CPU and memory used per printer as the fleet grows.
+Printers that are stopped start a new print after a while, so the load stays the same for the whole run.
+
+The detection times are only meaningful with the real model weights and recorded frames of good and failed prints,
+with the generated stand-in model the notifications are arbitrary and the run only measures the load.
+
+Requires the onnx package for the stand-in model. appdaemon is not needed: the app imports its adbase module only for the
+ADBase base class, so if appdaemon is not installed a stand-in adbase module is registered before the app is imported.
+
+Example:
+    python appdaemon/benchmarks/load_test.py --printers 1,5,10,20 --duration 120 --output load.json
+    python appdaemon/benchmarks/load_test.py --printers 10 --latency 300 --jitter 150 --error-rate 0.05 --timeout-rate 0.01
+    python appdaemon/benchmarks/load_test.py --weights /conf/model/model-weights-5a6b1be1fa.onnx --images good/ --failure-images spaghetti/
+    python appdaemon/benchmarks/load_test.py --printers 20 --set camera.connection.Mode=stream --set model.workers.Workers=2
+'''
+
+import argparse
+import collections
+import glob
+import heapq
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import types
+from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+import cv2
+import requests
+
+APPS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'conf', 'apps')
+sys.path.insert(0, APPS_DIR)
+
+from bench_detection import synthetic_frame
+from mjpeg_server import BOUNDARY, split_mjpeg
+from standin_model import make_standin_model
+
+class MockHomeAssistant:
+    """
+    A loopback HTTP server standing in for Home Assistant. Each camera serves the frames in turn, or the failure frames once
+    it has been made to fail. Camera requests are delayed by a random latency and fail or hang at the given rates.
+    The harness controls it through the /_load_test endpoints, as it runs in its own process.
+    """
+
+    def __init__(self, frames: List[bytes], failure_frames: List[bytes], media_dir: str, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, timeout_rate: float = 0.0, hang: float = 30.0, stream_fps: float = 5.0, seed: int = 0,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.frames = frames
+        self.failure_frames = failure_frames
+        self.media_dir = media_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.stream_fps = stream_fps
+        self.failing = set() # cameras serving the failure frames
+        self.requests = collections.Counter()
+        self._frame_index = collections.Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def next_frame(self, camera: str) -> bytes:
+        with self._lock:
+            frames = self.failure_frames if camera in self.failing else self.frames
+            index = self._frame_index[camera]
+            self._frame_index[camera] += 1
+        return frames[index % len(frames)]
+
+    def outcome(self) -> Tuple[str, float]:
+        """Draw whether a camera request succeeds, fails or hangs, and how many seconds it takes."""
+        with self._lock:
+            draw = self._rng.random()
+            delay = max(0.0, self._rng.gauss(self.latency, self.jitter))
+        if draw < self.error_rate:
+            return 'error', delay
+        if draw < self.error_rate + self.timeout_rate:
+            return 'timeout', self.hang
+        return 'ok', delay
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.requests[name] += 1
+
+    def save_snapshot(self, camera: str, filename: str) -> None:
+        """Save the camera's next frame into the media directory, as the camera.snapshot service does."""
+        path = os.path.join(self.media_dir, os.path.basename(filename))
+        with open(path, 'wb') as f:
+            f.write(self.next_frame(camera))
+        self.count('snapshot')
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = unquote(self.path.split('?')[0])
+                if path.startswith('/api/camera_proxy_stream/'):
+                    self.stream(path[len('/api/camera_proxy_stream/'):])
+                elif path.startswith('/api/camera_proxy/'):
+                    self.snapshot(path[len('/api/camera_proxy/'):])
+                elif path.startswith('/media/local/'):
+                    self.media(path[len('/media/local/'):])
+                elif path == '/_load_test/stats':
+                    with mock._lock:
+                        self.reply(200, json.dumps(dict(mock.requests)).encode(), 'application/json')
+                else:
+                    self.reply(404, b'Not Found')
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path == '/_load_test/fail':
+                    with mock._lock:
+                        mock.failing.update(body['cameras'])
+                    self.reply(200, b'{}', 'application/json')
+                elif self.path == '/_load_test/snapshot':
+                    mock.save_snapshot(body['camera'], body['filename'])
+                    self.reply(200, b'{}', 'application/json')
+                else:
+                    self.reply(404, b'Not Found')
+
+            def snapshot(self, camera: str):
+                outcome, delay = mock.outcome()
+                mock.count('camera' if outcome == 'ok' else f'camera_{outcome}')
+                time.sleep(delay)
+                if outcome == 'ok':
+                    self.reply(200, mock.next_frame(camera), 'image/jpeg')
+                else:
+                    self.reply(500 if outcome == 'error' else 504, b'Camera unavailable')
+
+            def stream(self, camera: str):
+                outcome, delay = mock.outcome()
+                mock.count('stream' if outcome == 'ok' else f'stream_{outcome}')
+                time.sleep(delay)
+                if outcome != 'ok':
+                    self.reply(500 if outcome == 'error' else 504, b'Camera unavailable')
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+                self.end_headers()
+                while True:
+                    frame = mock.next_frame(camera)
+                    self.wfile.write(f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(frame)}\r\n\r\n'.encode())
+                    self.wfile.write(frame)
+                    self.wfile.write(b'\r\n')
+                    self.wfile.flush()
+                    time.sleep(1.0 / mock.stream_fps)
+
+            def media(self, name: str):
+                path = os.path.realpath(os.path.join(mock.media_dir, name))
+                if not path.startswith(os.path.realpath(mock.media_dir) + os.sep) or not os.path.isfile(path):
+                    mock.count('media_missing')
+                    self.reply(404, b'Not Found')
+                    return
+                mock.count('media')
+                with open(path, 'rb') as f:
+                    self.reply(200, f.read(), 'image/jpeg' if path.endswith('.jpg') else 'application/octet-stream')
+
+            def reply(self, status: int, body: bytes, content_type: str = 'text/plain'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def handle_one_request(self):
+                try:
+                    super().handle_one_request()
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True # the app gave up on the request or closed the stream
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def serve_mock_home_assistant(settings: dict, ready) -> None:
+    """Run a mock Home Assistant until the process is terminated, sending its port to the `ready` pipe."""
+    mock = MockHomeAssistant(**settings)
+    ready.send(mock.port)
+    mock.server.serve_forever()
+
+class MockHomeAssistantProcess:
+    """A mock Home Assistant running in a child process, so its CPU and memory are not counted as the app's."""
+
+    def __init__(self, **settings):
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(duplex=False)
+        self.process = context.Process(target=serve_mock_home_assistant, args=(settings, sender), name='mock-home-assistant', daemon=True)
+        self.process.start()
+        if not receiver.poll(60):
+            self.process.terminate()
+            raise RuntimeError("The mock Home Assistant did not start.")
+        self.url = f"http://127.0.0.1:{receiver.recv()}"
+        self.session = requests.Session()
+
+    def fail(self, cameras: List[str]) -> None:
+        """Make the cameras serve the failure frames from now on."""
+        self.session.post(f"{self.url}/_load_test/fail", json={'cameras': cameras}, timeout=5).raise_for_status()
+
+    def snapshot(self, camera: str, filename: str) -> None:
+        self.session.post(f"{self.url}/_load_test/snapshot", json={'camera': camera, 'filename': filename}, timeout=5).raise_for_status()
+
+    def fetch_media(self, path: str) -> bool:
+        """Fetch a notification image as the companion app would, returning whether it exists."""
+        return self.session.get(f"{self.url}{path}", timeout=5).status_code == 200
+
+    def stats(self) -> Dict[str, int]:
+        return self.session.get(f"{self.url}/_load_test/stats", timeout=5).json()
+
+    def close(self) -> None:
+        self.session.close()
+        self.process.terminate()
+        self.process.join()
+
+class MockEntity:
+    """An entity returned by the mock get_entity, recording the services called on it."""
+
+    def __init__(self, api: 'MockAppDaemon', entity_id: str):
+        self.api = api
+        self.entity_id = entity_id
+
+    def call_service(self, service: str, **kwargs):
+        self.api.entity_service(self.entity_id, service, kwargs)
+
+class MockAppDaemon:
+    """
+    Stands in for the AppDaemon API the app uses. Timer, state and event callbacks run one at a time on a single thread,
+    as AppDaemon runs an app's callbacks, and entity states only change when the harness changes them.
+    Issue notifications and stop button presses are recorded with the monotonic time they happened.
+    If given a user response time, Stop Print is pressed on each issue notification after it, as a user would on their phone.
+    """
+
+    def __init__(self, home_assistant: MockHomeAssistantProcess, user_response: float = -1.0, verbose: bool = False):
+        self.home_assistant = home_assistant
+        self.user_response = user_response # seconds before pressing Stop Print on a notification, negative to never
+        self.verbose = verbose
+        self.states: Dict[str, str] = {}
+        self.notifications: List[Tuple[float, str]] = [] # (time, printer) of each issue notification
+        self.presses: List[Tuple[float, str]] = [] # (time, entity) of each button press
+        self.media = collections.Counter() # notification images found and missing
+        self.errors: List[str] = [] # tracebacks of callbacks that raised
+        self.on_press: Optional[Callable[[str], None]] = None
+        self._state_listeners = collections.defaultdict(list)
+        self._event_listeners = collections.defaultdict(list)
+        self._timers = [] # heap of (due, sequence, handle, callback, args, interval)
+        self._cancelled = set()
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='mock-appdaemon', daemon=True)
+        self._thread.start()
+
+    # the AppDaemon API used by the app
+
+    def log(self, message: str, level: str = "INFO", **kwargs):
+        if self.verbose or level in ("WARNING", "ERROR"):
+            print(f"{time.strftime('%H:%M:%S')} {level} {message}")
+
+    def get_entity(self, entity_id: str) -> MockEntity:
+        return MockEntity(self, entity_id)
+
+    def get_state(self, entity_id: str, **kwargs):
+        return self.states.get(entity_id)
+
+    def set_state(self, entity_id: str, state=None, **kwargs):
+        self.states[entity_id] = state
+
+    def listen_state(self, callback, entity_id: str, **kwargs):
+        self._state_listeners[entity_id].append((callback, kwargs))
+
+    def listen_event(self, callback, event: str, **kwargs):
+        self._event_listeners[event].append((callback, kwargs))
+
+    def run_in(self, callback, delay: float, **kwargs):
+        return self._schedule(time.monotonic() + delay, callback, (kwargs,))
+
+    def run_every(self, callback, start, interval: float, **kwargs):
+        return self._schedule(time.monotonic(), callback, (kwargs,), interval)
+
+    def cancel_timer(self, handle):
+        with self._condition:
+            self._cancelled.add(handle)
+
+    def call_service(self, service: str, **kwargs):
+        data = kwargs.get('data') or {}
+        actions = [action['action'] for action in data.get('actions', [])]
+        if service == 'notify/notify' and any(action.startswith('STOP_PRINT_JOB') for action in actions):
+            printer = next(action for action in actions if action.startswith('STOP_PRINT_JOB')).partition(':')[2]
+            self.notifications.append((time.monotonic(), printer))
+            if self.user_response >= 0:
+                self.fire_event('mobile_app_notification_action', {'action': f"STOP_PRINT_JOB:{printer}"}, delay=self.user_response)
+            if data.get('image'):
+                threading.Thread(target=self._fetch_media, args=(data['image'],), daemon=True).start()
+
+    # harness helpers
+
+    def entity_service(self, entity_id: str, service: str, kwargs: dict):
+        if service == 'press':
+            self.presses.append((time.monotonic(), entity_id))
+            if self.on_press is not None:
+                self.on_press(entity_id)
+        elif service == 'snapshot':
+            self.home_assistant.snapshot(entity_id, kwargs['filename'])
+
+    def change_state(self, entity_id: str, state: str, delay: float = 0.0):
+        """Change an entity's state on the callback thread, calling its state listeners."""
+        def change(kwargs):
+            old, self.states[entity_id] = self.states.get(entity_id), state
+            if old != state:
+                for callback, listener_kwargs in list(self._state_listeners[entity_id]):
+                    callback(entity_id, 'state', old, state, listener_kwargs)
+        self._schedule(time.monotonic() + delay, change, ({},))
+
+    def fire_event(self, event: str, data: dict, delay: float = 0.0):
+        """Fire an event on the callback thread, calling its event listeners."""
+        def fire(kwargs):
+            for callback, listener_kwargs in list(self._event_listeners[event]):
+                callback(event, data, listener_kwargs)
+        self._schedule(time.monotonic() + delay, fire, ({},))
+
+    def call(self, function: Callable, timeout: float = 600.0):
+        """Run a function on the callback thread and wait for it, re-raising its exception."""
+        done, result = threading.Event(), {}
+        def run(kwargs):
+            try:
+                function()
+            except BaseException as e:
+                result['error'] = e
+            finally:
+                done.set()
+        self._schedule(time.monotonic(), run, ({},))
+        if not done.wait(timeout):
+            raise RuntimeError(f"{function.__name__} did not finish within {timeout:g} seconds.")
+        if 'error' in result:
+            raise result['error']
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+
+    def _schedule(self, due: float, callback, args: tuple, interval: Optional[float] = None):
+        with self._condition:
+            handle = next(self._sequence)
+            heapq.heappush(self._timers, (due, handle, callback, args, interval))
+            self._condition.notify()
+        return handle
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and (not self._timers or self._timers[0][0] > time.monotonic()):
+                    self._condition.wait(self._timers[0][0] - time.monotonic() if self._timers else None)
+                if not self._running:
+                    return
+                due, handle, callback, args, interval = heapq.heappop(self._timers)
+                if handle in self._cancelled:
+                    self._cancelled.discard(handle)
+                    continue
+                if interval is not None:
+                    heapq.heappush(self._timers, (due + interval, handle, callback, args, interval))
+            try:
+                callback(*args)
+            except Exception:
+                self.errors.append(traceback.format_exc())
+                print(f"Callback {getattr(callback, '__name__', callback)} raised:\n{self.errors[-1]}")
+
+    def _fetch_media(self, path: str):
+        try:
+            found = self.home_assistant.fetch_media(path)
+        except requests.RequestException:
+            found = False
+        self.media['found' if found else 'missing'] += 1
+
+def install_adbase_shim() -> None:
+    """
+    Register a stand-in for appdaemon's adbase module if appdaemon is not installed. The app only takes its ADBase base class
+    from it, and the load test replaces everything ADBase provides (the constructor and get_ad_api) with the mocks.
+    """
+    try:
+        import adbase
+    except ImportError:
+        adbase = types.ModuleType('adbase')
+        adbase.ADBase = type('ADBase', (), {'__doc__': 'Stand-in for appdaemon.adbase.ADBase, for running the app without appdaemon.'})
+        sys.modules['adbase'] = adbase
+
+def make_app_class():
+    """Import the app, with a stand-in adbase module if appdaemon is not installed, and subclass it to run against the mocks."""
+    install_adbase_shim()
+    from print_detect import PrintDetect
+
+    class LoadTestApp(PrintDetect):
+        """The app, with the mock AppDaemon API, the generated fleet config and the mock Home Assistant's address."""
+
+        def __init__(self, api: MockAppDaemon, hass_url: str, weights: str, meta: str, overrides: Dict[Tuple[str, str], str]):
+            # AppDaemon's own constructor is not called, the app only needs get_ad_api
+            self.api = api
+            self.hass_url = hass_url
+            self.weights = weights
+            self.meta = meta
+            self.overrides = overrides
+
+        def get_ad_api(self):
+            return self.api
+
+        def load_secret_values(self) -> None:
+            self.hass_token = 'load-test'
+            self.hass_hostname = self.hass_url
+
+        def read_config(self) -> ConfigParser:
+            config = super().read_config()
+            for (section, key), value in self.overrides.items():
+                if section != 'DEFAULT' and not config.has_section(section):
+                    config.add_section(section)
+                config[section][key] = value
+                if not value and section != 'DEFAULT':
+                    config['DEFAULT'][key] = value # empty values fall back to the default
+            return config
+
+        def load_config(self):
+            super().load_config()
+            self.model_weights = self.weights
+            self.model_meta = self.meta
+
+    return LoadTestApp
+
+def printer_entities(name: str) -> Dict[str, str]:
+    """The entities of a mock printer, by their config key."""
+    return dict(BinaryIsPrintingSensor=f"binary_sensor.{name}_printing", PrintingOnState='on', PrinterCamera=f"camera.{name}",
+                PrinterStopButton=f"button.{name}_stop", ExtruderTempSensor=f"sensor.{name}_extruder_temp",
+                ExtruderTargetTempSensor=f"sensor.{name}_extruder_target_temp")
+
+def process_usage(exclude: List[int]) -> Tuple[float, int]:
+    """
+    The CPU seconds and resident memory of this process and its live children (the inference workers), other than `exclude`.
+
+    Returns:
+        Tuple[float, int]: The CPU seconds used so far and the resident bytes now.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime
+    pids = [os.getpid()] + [child.pid for child in multiprocessing.active_children() if child.pid not in exclude]
+    rss = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                rss += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+            if pid != os.getpid():
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rpartition(')')[2].split()
+                cpu += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except (FileNotFoundError, ProcessLookupError):
+            pass # the child exited while being read
+    if rss == 0: # no /proc, fall back to the peak
+        rss = usage.ru_maxrss * 1024
+    return cpu, rss
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return dict(count=0)
+    values = sorted(values)
+    return dict(count=len(values), p50=statistics.median(values), p95=values[min(len(values) - 1, int(0.95 * len(values)))],
+                max=values[-1])
+
+def run_level(count: int, args, frames: List[bytes], failure_frames: List[bytes], weights: str, work_dir: str) -> dict:
+    """Run the app with a fleet of `count` printers for the duration of the test and collect its figures."""
+    names = [f"p{index}" for index in range(count)]
+    media_dir = os.path.join(work_dir, f"media-{count}")
+    os.makedirs(media_dir, exist_ok=True)
+    home_assistant = MockHomeAssistantProcess(frames=frames, failure_frames=failure_frames, media_dir=media_dir,
+                                              latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate,
+                                              timeout_rate=args.timeout_rate, hang=args.hang, stream_fps=args.stream_fps, seed=args.seed)
+    api = MockAppDaemon(home_assistant, user_response=args.user_response, verbose=args.verbose)
+    overrides = {('fleet', 'Printers'): ', '.join(names),
+                 ('program.timings', 'TerminationTime'): str(args.termination_time),
+                 ('model.loading', 'LazyLoad'): 'False',
+                 ('model.runtime', 'OptimizedModelCache'): os.path.join(work_dir, 'cache'),
+                 ('evidence', 'Directory'): os.path.join(media_dir, 'print_detect'),
+                 ('evidence', 'MediaPath'): '/media/local/print_detect',
+                 ('history', 'Database'): os.path.join(work_dir, f"history-{count}.db")}
+    for name in names:
+        overrides.update({(f"printer.{name}", key): value for key, value in printer_entities(name).items()})
+        api.states.update({f"binary_sensor.{name}_printing": 'off', f"sensor.{name}_extruder_temp": '210',
+                           f"sensor.{name}_extruder_target_temp": '210'})
+    overrides.update(args.overrides)
+    app = make_app_class()(api, home_assistant.url, weights, args.meta, overrides)
+
+    failing = names[:math.ceil(count * args.failing)]
+    failed_at: Dict[str, float] = {}
+    def pressed(entity: str):
+        name = entity[len('button.'):-len('_stop')]
+        api.change_state(f"binary_sensor.{name}_printing", 'off')
+        if args.restart_after >= 0:
+            api.change_state(f"binary_sensor.{name}_printing", 'on', delay=args.restart_after)
+    api.on_press = pressed
+
+    api.call(app.initialize)
+    try:
+        exclude = [home_assistant.process.pid]
+        cpu_start, rss_start = process_usage(exclude)
+        started = time.monotonic()
+        for name in names:
+            api.change_state(f"binary_sensor.{name}_printing", 'on')
+        peak_rss, stop_sampling = rss_start, threading.Event()
+        def sample():
+            nonlocal peak_rss
+            while not stop_sampling.wait(0.25):
+                peak_rss = max(peak_rss, process_usage(exclude)[1])
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        failure_at = started + (args.failure_at if args.failure_at >= 0 else args.duration / 3)
+        time.sleep(max(0.0, failure_at - time.monotonic()))
+        if failing:
+            home_assistant.fail([f"camera.{name}" for name in failing])
+            failed_at = {name: time.monotonic() for name in failing}
+        time.sleep(max(0.0, started + args.duration - time.monotonic()))
+        cpu_end, rss_end = process_usage(exclude)
+        elapsed = time.monotonic() - started
+        stop_sampling.set()
+        sampler.join()
+        metrics = app.metrics
+        counters = dict(metrics.counters)
+        dropped = app.pipeline.dropped
+    finally:
+        try:
+            api.call(app.terminate)
+        finally:
+            api.close()
+            mock_requests = home_assistant.stats()
+            home_assistant.close()
+
+    # the first notification of each failing printer after its camera failed, and notifications of healthy frames
+    time_to_notify, false_alarms = {}, 0
+    for at, name in api.notifications:
+        if name in failed_at and at >= failed_at[name]:
+            time_to_notify.setdefault(name, at - failed_at[name])
+        else:
+            false_alarms += 1
+    notify_to_stop = []
+    for at, name in api.notifications:
+        press = next((pressed_at for pressed_at, entity in api.presses if entity == f"button.{name}_stop" and pressed_at >= at), None)
+        if press is not None:
+            notify_to_stop.append(press - at)
+    checks = counters.get('frames_inferred', 0) + counters.get('frames_reused', 0)
+    return dict(
+        printers=count,
+        duration_s=elapsed,
+        cycle_ms={f"p{int(q * 100)}": metrics.stages['cycle'].quantile(q) * 1000 for q in (0.5, 0.95, 0.99)},
+        fetch_ms={f"p{int(q * 100)}": metrics.stages['fetch'].quantile(q) * 1000 for q in (0.5, 0.95, 0.99)},
+        inference_ms={f"p{int(q * 100)}": metrics.stages['inference'].quantile(q) * 1000 for q in (0.5, 0.95, 0.99)},
+        checks=checks,
+        checks_per_printer_per_min=checks / count / elapsed * 60,
+        cycles_dropped=dropped,
+        cycles_skipped=counters.get('cycles_skipped', 0),
+        cycles_failed=counters.get('cycles_failed', 0),
+        fetch_failures=counters.get('fetch_failures', 0),
+        failing_printers=len(failing),
+        detected=len(time_to_notify),
+        time_to_notify_s=percentiles(list(time_to_notify.values())),
+        notify_to_stop_s=percentiles(notify_to_stop),
+        notifications=len(api.notifications),
+        false_alarms=false_alarms,
+        stops=len(api.presses),
+        notification_images=dict(api.media),
+        cpu_percent=(cpu_end - cpu_start) / elapsed * 100,
+        cpu_percent_per_printer=(cpu_end - cpu_start) / elapsed * 100 / count,
+        rss_mb=dict(start=rss_start / 2**20, end=rss_end / 2**20, peak=peak_rss / 2**20),
+        rss_mb_per_printer=(peak_rss - rss_start) / 2**20 / count,
+        callback_errors=len(api.errors),
+        mock_requests=mock_requests)
+
+def load_frames(directory: str, resolution: str, seed: int) -> List[bytes]:
+    """Load the JPEGs of a directory or an MJPEG file, or generate synthetic frames if none is given."""
+    if directory and os.path.isdir(directory):
+        paths = sorted(glob.glob(os.path.join(directory, '*.jpg')) + glob.glob(os.path.join(directory, '*.jpeg')))
+        frames = [open(path, 'rb').read() for path in paths]
+    elif directory:
+        frames = split_mjpeg(open(directory, 'rb').read())
+    else:
+        width, height = (int(v) for v in resolution.lower().split('x'))
+        frames = [cv2.imencode('.jpg', synthetic_frame(width, height, seed + index))[1].tobytes() for index in range(8)]
+    if not frames:
+        raise SystemExit(f"No frames found in {directory}")
+    return frames
+
+def print_results(results: List[dict]) -> None:
+    print(f"{'printers':>8} {'cycle p50/p95 ms':>17} {'checks/min':>10} {'dropped':>7} {'skipped':>7} {'failed':>6} "
+          f"{'detected':>8} {'to notify s':>11} {'to stop s':>9} {'false':>5} {'cpu %':>6} {'cpu %/pr':>8} {'MB/pr':>6}")
+    for result in results:
+        print(f"{result['printers']:>8} {result['cycle_ms']['p50']:>8.0f}/{result['cycle_ms']['p95']:<8.0f} "
+              f"{result['checks_per_printer_per_min']:>10.1f} {result['cycles_dropped']:>7} {result['cycles_skipped']:>7} "
+              f"{result['cycles_failed']:>6} {result['detected']:>4}/{result['failing_printers']:<3} "
+              f"{result['time_to_notify_s'].get('p50', float('nan')):>11.1f} {result['notify_to_stop_s'].get('p50', float('nan')):>9.1f} "
+              f"{result['false_alarms']:>5} {result['cpu_percent']:>6.1f} {result['cpu_percent_per_printer']:>8.2f} "
+              f"{result['rss_mb_per_printer']:>6.1f}")
+
+def parse_override(value: str) -> Tuple[Tuple[str, str], str]:
+    target, _, setting = value.partition('=')
+    section, _, key = target.rpartition('.')
+    if not section or not key or not _:
+        raise argparse.ArgumentTypeError(f"{value} is not SECTION.KEY=VALUE")
+    return (section, key), setting
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--printers', default='1,5,10,20', help="Comma separated fleet sizes to run, one after the other")
+    parser.add_argument('--duration', type=float, default=60.0, help="Seconds to run each fleet size for")
+    parser.add_argument('--images', default='', help="Directory of JPEGs or an MJPEG file of a good print (default: synthetic frames)")
+    parser.add_argument('--failure-images', default='', help="Directory of JPEGs or an MJPEG file of a failed print (default: synthetic frames)")
+    parser.add_argument('--resolution', default='1280x720', help="The WIDTHxHEIGHT of synthetic frames")
+    parser.add_argument('--weights', help="The model onnx file (default: generate a stand-in model)")
+    parser.add_argument('--meta', default=os.path.join(APPS_DIR, '..', 'model', 'model.meta'), help="The model meta file")
+    parser.add_argument('--latency', type=float, default=50.0, help="Mean milliseconds a camera request takes")
+    parser.add_argument('--jitter', type=float, default=20.0, help="Standard deviation of the camera latency in milliseconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of camera requests that fail with a server error")
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help="Fraction of camera requests that hang until the app gives up")
+    parser.add_argument('--hang', type=float, default=30.0, help="Seconds a hanging camera request takes")
+    parser.add_argument('--stream-fps', type=float, default=5.0, help="Frame rate of the camera streams in stream mode")
+    parser.add_argument('--failing', type=float, default=0.25, help="Fraction of the printers whose camera switches to the failure frames")
+    parser.add_argument('--failure-at', type=float, default=-1.0, help="Seconds into the run the cameras fail (default: a third of the duration)")
+    parser.add_argument('--termination-time', type=int, default=10, help="TerminationTime of the app, seconds from notification to stop")
+    parser.add_argument('--user-response', type=float, default=-1.0, help="Press Stop Print on notifications after this many seconds, -1 to wait for the countdown")
+    parser.add_argument('--restart-after', type=float, default=10.0, help="Seconds before a stopped printer starts a new print, -1 to leave it stopped")
+    parser.add_argument('--set', dest='overrides', action='append', type=parse_override, default=[],
+                        help="Override an app config value as SECTION.KEY=VALUE, may be repeated")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="Print the app's log")
+    parser.add_argument('--output', help="Save the results as JSON to this file")
+    args = parser.parse_args()
+    args.overrides = dict(args.overrides)
+
+    frames = load_frames(args.images, args.resolution, args.seed)
+    failure_frames = load_frames(args.failure_images, args.resolution, args.seed + 1000)
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        weights = args.weights or make_standin_model(os.path.join(work_dir, 'standin.onnx'))
+        for count in [int(value) for value in args.printers.split(',')]:
+            print(f"Running {count} printers for {args.duration:g} seconds...")
+            results.append(run_level(count, args, frames, failure_frames, weights, work_dir))
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(meta=dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'), weights='stand-in' if not args.weights else os.path.basename(args.weights),
+                                     args={k: v for k, v in vars(args).items() if k not in ('output', 'overrides')},
+                                     overrides={f"{section}.{key}": value for (section, key), value in args.overrides.items()}),
+                           results=results), f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+The code is used to serve a local MJPEG stream for trying out the stream mode of the frame source without a camera.
+It streams the frames of an MJPEG file (such as a timelapse saved by the app), a directory of JPEGs or synthetic frames,
+in a loop at a given frame rate, on every path, so it can stand in for Home Assistant's camera_proxy_stream endpoint
+or a camera's own stream URL. Connections can be dropped every few seconds to exercise reconnecting.
+
+Example:
+    python appdaemon/benchmarks/mjpeg_server.py --source timelapse_printer.mjpeg --fps 10 --port 8081
+    python appdaemon/benchmarks/mjpeg_server.py --resolution 1920x1080 --drop-after 30
+'''
+
+import argparse
+import glob
+import http.server
+import os
+import time
+from typing import List
+
+import cv2
+import numpy as np
+
+BOUNDARY = 'frame'
+
+def split_mjpeg(data: bytes) -> List[bytes]:
+    """Split a file of concatenated JPEGs into its frames, by their start and end markers."""
+    frames = []
+    start = data.find(b'\xff\xd8')
+    while start >= 0:
+        end = data.find(b'\xff\xd9', start + 2)
+        if end < 0:
+            break
+        frames.append(data[start:end + 2])
+        start = data.find(b'\xff\xd8', end + 2)
+    return frames
+
+def load_frames(source: str, resolution: str, count: int) -> List[bytes]:
+    """
+    Load the frames to stream.
+
+    Args:
+        source (str): An MJPEG file, a directory of JPEGs, or empty for synthetic frames.
+        resolution (str): The WIDTHxHEIGHT of synthetic frames.
+        count (int): The number of synthetic frames.
+    """
+    if os.path.isdir(source):
+        paths = sorted(glob.glob(os.path.join(source, '*.jpg')) + glob.glob(os.path.join(source, '*.jpeg')))
+        return [open(path, 'rb').read() for path in paths]
+    if source:
+        return split_mjpeg(open(source, 'rb').read())
+    width, height = (int(value) for value in resolution.split('x'))
+    frames = []
+    for index in range(count):
+        # a moving gradient with the frame number on it, so consecutive frames differ
+        image = np.zeros((height, width, 3), dtype=np.uint8)
+        image[:, :, 1] = (np.arange(width, dtype=np.uint32) * 255 // width + index * 8).astype(np.uint8)
+        cv2.putText(image, str(index), (width // 10, height // 2), cv2.FONT_HERSHEY_SIMPLEX, height / 200, (255, 255, 255), 3)
+        frames.append(cv2.imencode('.jpg', image)[1].tobytes())
+    return frames
+
+def make_handler(frames: List[bytes], fps: float, drop_after: float):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+            self.end_headers()
+            started = time.monotonic()
+            index = 0
+            try:
+                while drop_after <= 0 or time.monotonic() - started < drop_after:
+                    frame = frames[index % len(frames)]
+                    self.wfile.write(f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(frame)}\r\n\r\n'.encode())
+                    self.wfile.write(frame)
+                    self.wfile.write(b'\r\n')
+                    self.wfile.flush()
+                    index += 1
+                    time.sleep(1.0 / fps)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            print(f"{self.client_address[0]} {format % args}")
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default='', help='An MJPEG file or a directory of JPEGs, synthetic frames if not given.')
+    parser.add_argument('--resolution', default='1280x720', help='The WIDTHxHEIGHT of synthetic frames.')
+    parser.add_argument('--frames', type=int, default=50, help='The number of synthetic frames.')
+    parser.add_argument('--fps', type=float, default=5.0, help='The frame rate of the stream.')
+    parser.add_argument('--drop-after', type=float, default=0.0, help='Close each connection after this many seconds, 0 to never.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    frames = load_frames(args.source, args.resolution, args.frames)
+    if not frames:
+        parser.error(f"No frames found in {args.source}")
+    server = http.server.ThreadingHTTPServer((args.host, args.port), make_handler(frames, args.fps, args.drop_after))
+    server.daemon_threads = True
+    print(f"Streaming {len(frames)} frames at {args.fps:g} fps on http://{args.host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
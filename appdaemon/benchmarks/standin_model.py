@@ -0,0 +1,109 @@
+'''
+The code is used to generate a small stand-in for the machine learning model onnx file.
+It has the same inputs and outputs as the real model (a 416x416 image in, 845 boxes and their class confidences out)
+so the detection path can be benchmarked and tested without downloading the model weights.
+
+Requires the onnx package (pip install onnx).
+'''
+
+import argparse
+import numpy as np
+
+def make_standin_model(path: str, input_size: int = 416, grid: int = 13, anchors: int = 5, classes: int = 1,
+                       depth: int = 2, channels: int = 16, batch=None, seed: int = 0) -> str:
+    """
+    Generate and save a stand-in model.
+
+    Args:
+        path (str): Where to save the onnx file.
+        input_size (int): The height and width of the model input.
+        grid (int): The size of the output grid, the model outputs grid * grid * anchors boxes.
+        anchors (int): The number of boxes for each grid cell.
+        classes (int): The number of classes.
+        depth (int): The number of hidden convolutions, increase to make the model more expensive to run.
+        channels (int): The number of channels of the hidden convolutions.
+        batch: The batch dimension of the input, an int for a fixed batch size or None for any batch size.
+        seed (int): The seed for the random weights.
+
+    Returns:
+        str: The path the model was saved to.
+    """
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    rng = np.random.default_rng(seed)
+    batch_dim = 'batch' if batch is None else batch
+    num_boxes = grid * grid * anchors
+    values = 4 + classes
+    initializers = []
+    nodes = []
+
+    def add_conv(name, input_name, in_channels, out_channels, kernel, stride, pad):
+        weights = rng.normal(0, 1.0 / np.sqrt(in_channels * kernel * kernel), (out_channels, in_channels, kernel, kernel)).astype(np.float32)
+        initializers.append(numpy_helper.from_array(weights, f'{name}_w'))
+        initializers.append(numpy_helper.from_array(np.zeros(out_channels, dtype=np.float32), f'{name}_b'))
+        nodes.append(helper.make_node('Conv', [input_name, f'{name}_w', f'{name}_b'], [name], kernel_shape=[kernel, kernel],
+                                      strides=[stride, stride], pads=[pad] * 4))
+        return name
+
+    # stem at half the input resolution, then hidden convolutions, then a head down to the output grid
+    x = add_conv('stem', 'input', 3, channels, 3, 2, 1)
+    nodes.append(helper.make_node('Relu', [x], ['stem_relu']))
+    x = 'stem_relu'
+    for i in range(depth):
+        x = add_conv(f'hidden{i}', x, channels, channels, 3, 1, 1)
+        nodes.append(helper.make_node('Relu', [x], [f'hidden{i}_relu']))
+        x = f'hidden{i}_relu'
+    stride = (input_size // 2) // grid
+    x = add_conv('head', x, channels, anchors * values, stride, stride, 0)
+
+    # [batch, anchors * values, grid, grid] -> [batch, boxes, values]
+    initializers.append(numpy_helper.from_array(np.array([0, anchors, values, grid * grid], dtype=np.int64), 'head_shape'))
+    nodes.append(helper.make_node('Reshape', [x, 'head_shape'], ['head_grid']))
+    nodes.append(helper.make_node('Transpose', ['head_grid'], ['head_boxes'], perm=[0, 3, 1, 2]))
+    initializers.append(numpy_helper.from_array(np.array([0, num_boxes, values], dtype=np.int64), 'flat_shape'))
+    nodes.append(helper.make_node('Reshape', ['head_boxes', 'flat_shape'], ['head_flat']))
+    nodes.append(helper.make_node('Sigmoid', ['head_flat'], ['head_sigmoid']))
+
+    for name, start, end in (('starts_box', 0, 4), ('starts_conf', 4, values)):
+        initializers.append(numpy_helper.from_array(np.array([start], dtype=np.int64), f'{name}_start'))
+        initializers.append(numpy_helper.from_array(np.array([end], dtype=np.int64), f'{name}_end'))
+    initializers.append(numpy_helper.from_array(np.array([2], dtype=np.int64), 'slice_axis'))
+    nodes.append(helper.make_node('Slice', ['head_sigmoid', 'starts_box_start', 'starts_box_end', 'slice_axis'], ['box_xywh']))
+    nodes.append(helper.make_node('Slice', ['head_sigmoid', 'starts_conf_start', 'starts_conf_end', 'slice_axis'], ['confs']))
+
+    # (xc, yc, w, h) -> (x1, y1, x2, y2) with boxes kept small so they do not all overlap
+    initializers.append(numpy_helper.from_array(np.array([0, num_boxes, 2, 2], dtype=np.int64), 'pair_shape'))
+    nodes.append(helper.make_node('Reshape', ['box_xywh', 'pair_shape'], ['box_pairs']))
+    nodes.append(helper.make_node('Split', ['box_pairs'], ['centres', 'sizes'], axis=2, num_outputs=2))
+    initializers.append(numpy_helper.from_array(np.array(0.25, dtype=np.float32), 'half_size_scale'))
+    nodes.append(helper.make_node('Mul', ['sizes', 'half_size_scale'], ['half_sizes']))
+    nodes.append(helper.make_node('Sub', ['centres', 'half_sizes'], ['top_left']))
+    nodes.append(helper.make_node('Add', ['centres', 'half_sizes'], ['bottom_right']))
+    nodes.append(helper.make_node('Concat', ['top_left', 'bottom_right'], ['corners'], axis=2))
+    initializers.append(numpy_helper.from_array(np.array([0, num_boxes, 1, 4], dtype=np.int64), 'boxes_shape'))
+    nodes.append(helper.make_node('Reshape', ['corners', 'boxes_shape'], ['boxes']))
+
+    graph = helper.make_graph(nodes, 'standin',
+                              [helper.make_tensor_value_info('input', TensorProto.FLOAT, [batch_dim, 3, input_size, input_size])],
+                              [helper.make_tensor_value_info('boxes', TensorProto.FLOAT, [batch_dim, num_boxes, 1, 4]),
+                               helper.make_tensor_value_info('confs', TensorProto.FLOAT, [batch_dim, num_boxes, classes])],
+                              initializers)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 18)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a stand-in for the detection model with the same inputs and outputs.")
+    parser.add_argument('path', help="Where to save the onnx file")
+    parser.add_argument('--input-size', type=int, default=416)
+    parser.add_argument('--grid', type=int, default=13)
+    parser.add_argument('--anchors', type=int, default=5)
+    parser.add_argument('--classes', type=int, default=1)
+    parser.add_argument('--depth', type=int, default=2, help="Number of hidden convolutions, increase to make the model slower")
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--batch', type=int, default=None, help="Fix the batch dimension (default: any batch size)")
+    args = parser.parse_args()
+    print(make_standin_model(args.path, args.input_size, args.grid, args.anchors, args.classes, args.depth, args.channels, args.batch))
@@ -0,0 +1,231 @@
+'''
+The code is used to run the machine learning model on one of several inference backends: onnxruntime on the CPU or with an
+optional execution provider (such as OpenVINO or CUDA) when it is installed, or OpenCV's DNN module reading the same onnx file.
+Which backend is fastest depends on the host, so at startup each available backend is timed on a dummy input and the fastest one
+whose outputs match onnxruntime's on the CPU is used.
+'''
+
+from dataclasses import replace
+from typing import List, Optional, Tuple
+import abc
+import statistics
+import threading
+import time
+import cv2
+import numpy as np
+import onnxruntime
+
+from lib.runtime import RuntimeConfig, check_candidates, create_quantized_session, create_session, quantized_difference
+
+# the onnxruntime execution provider of each onnxruntime backend, and whether it needs UseGpu
+ONNXRUNTIME_BACKENDS = {
+    'onnxruntime': ('CPUExecutionProvider', False),
+    'openvino': ('OpenVINOExecutionProvider', False),
+    'xnnpack': ('XnnpackExecutionProvider', False),
+    'coreml': ('CoreMLExecutionProvider', False),
+    'cuda': ('CUDAExecutionProvider', True),
+    'tensorrt': ('TensorrtExecutionProvider', True),
+    'dml': ('DmlExecutionProvider', True),
+}
+
+# whether each OpenCV DNN backend needs UseGpu
+OPENCV_BACKENDS = {
+    'opencv': False,
+    'opencv-cuda': True,
+}
+
+BACKENDS = tuple(ONNXRUNTIME_BACKENDS) + tuple(OPENCV_BACKENDS)
+
+REFERENCE_BACKEND = 'onnxruntime'
+
+def parse_backends(value: str) -> Tuple[str, ...]:
+    """
+    Parse a comma separated list of backend names.
+
+    Raises:
+        ValueError: Raised if a backend is not known.
+
+    Returns:
+        Tuple[str, ...]: The backends, empty for 'auto' (every backend available on the host).
+    """
+    names = tuple(name.strip().lower() for name in value.split(',') if name.strip())
+    if names in ((), ('auto',)):
+        return ()
+    for name in names:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown inference backend {name}, expected auto or any of {', '.join(BACKENDS)}")
+    return names
+
+def needs_gpu(name: str) -> bool:
+    return ONNXRUNTIME_BACKENDS[name][1] if name in ONNXRUNTIME_BACKENDS else OPENCV_BACKENDS[name]
+
+def available_backends(use_gpu: bool) -> List[str]:
+    """The backends that can run on this host: the onnxruntime providers that are installed and OpenCV, GPU ones only if use_gpu."""
+    providers = onnxruntime.get_available_providers()
+    names = [name for name, (provider, _) in ONNXRUNTIME_BACKENDS.items() if provider in providers]
+    names += list(OPENCV_BACKENDS)
+    return [name for name in names if use_gpu or not needs_gpu(name)]
+
+class InferenceBackend(abc.ABC):
+    """Runs the model on an input batch. Backends are safe to run from several threads at once."""
+    name: str
+    input_name: str
+    input_shape: List # the model input shape, with names for its dynamic dimensions
+    output_names: List[str]
+
+    @abc.abstractmethod
+    def run(self, img_in: np.ndarray) -> List[np.ndarray]:
+        """Run the model on an input batch, returning its outputs in the order of output_names."""
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """
+    Runs the model with onnxruntime on one execution provider, falling back to the CPU for any operator the provider does not support.
+    Once load_quantized is called, the int8 quantized model is checked against the original on the first camera frames with a
+    possible detection, and used from then on if it passes. Until then the original model is used.
+    """
+
+    def __init__(self, name: str, onnx_path: str, runtime: RuntimeConfig):
+        provider = ONNXRUNTIME_BACKENDS[name][0]
+        if provider not in onnxruntime.get_available_providers():
+            raise RuntimeError(f"{provider} is not installed")
+        providers = [provider] if provider == 'CPUExecutionProvider' else [provider, 'CPUExecutionProvider']
+        if provider != 'CPUExecutionProvider':
+            # providers that compile the model, such as OpenVINO and TensorRT, cannot save an optimised model to cache
+            runtime = replace(runtime, cache_dir=None)
+        self.name = name
+        self.providers = providers
+        self.session = create_session(onnx_path, providers, runtime)
+        if self.session.get_providers()[0] != provider:
+            raise RuntimeError(f"{provider} failed to start and onnxruntime fell back to {self.session.get_providers()[0]}")
+        self.quantized = False
+        self.quantized_tolerance = runtime.quantized_tolerance
+        self._unchecked: Optional[onnxruntime.InferenceSession] = None
+        self._check_lock = threading.Lock()
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_shape = list(model_input.shape)
+        self.output_names = [output.name for output in self.session.get_outputs()]
+
+    def load_quantized(self, onnx_path: str, runtime: RuntimeConfig) -> None:
+        """Load the int8 quantized model, to be checked on the first camera frames with a possible detection."""
+        self.quantized_tolerance = runtime.quantized_tolerance
+        self._unchecked = create_quantized_session(onnx_path, self.providers, runtime)
+
+    def run(self, img_in: np.ndarray) -> List[np.ndarray]:
+        outputs = self.session.run(self.output_names, {self.input_name: img_in})
+        if self._unchecked is not None and check_candidates(outputs[1]).any():
+            self._check_quantized(img_in, outputs)
+        return outputs
+
+    def _check_quantized(self, img_in: np.ndarray, expected: List[np.ndarray]) -> None:
+        """Compare the quantized model with the original on frames with a possible detection, and swap it in if it passes."""
+        with self._check_lock:
+            session = self._unchecked
+            if session is None: # checked by another thread in the meantime
+                return
+            difference = quantized_difference(expected, session.run(self.output_names, {self.input_name: img_in}))
+            if difference <= self.quantized_tolerance:
+                print(f'Int8 quantized model passed the self-check on a camera frame (max difference {difference:.4f})')
+                self.session, self.quantized = session, True
+            else:
+                print(f'Int8 quantized model failed the self-check on a camera frame (max difference {difference:.4f} > '
+                      f'{self.quantized_tolerance}), using the original model')
+            self._unchecked = None
+
+class OpenCVBackend(InferenceBackend):
+    """
+    Runs the model with OpenCV's DNN module, on the CPU or with CUDA if OpenCV was built with it.
+    An OpenCV net holds its input between setting it and running, so runs are one at a time.
+    """
+
+    def __init__(self, name: str, onnx_path: str, input_name: str, input_shape: List, output_names: List[str]):
+        self.name = name
+        self.net = cv2.dnn.readNetFromONNX(onnx_path)
+        if OPENCV_BACKENDS[name]:
+            if cv2.cuda.getCudaEnabledDeviceCount() == 0:
+                raise RuntimeError("OpenCV was built without CUDA or found no CUDA device")
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+        else:
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.input_name = input_name
+        self.input_shape = input_shape
+        self.output_names = list(output_names)
+        self._lock = threading.Lock()
+
+    def run(self, img_in: np.ndarray) -> List[np.ndarray]:
+        with self._lock:
+            self.net.setInput(img_in)
+            return list(self.net.forward(self.output_names))
+
+def create_backend(name: str, onnx_path: str, runtime: RuntimeConfig, reference: OnnxRuntimeBackend) -> InferenceBackend:
+    """Create a backend by name, reusing the reference backend for onnxruntime on the CPU."""
+    if name == REFERENCE_BACKEND:
+        return reference
+    if name in ONNXRUNTIME_BACKENDS:
+        return OnnxRuntimeBackend(name, onnx_path, runtime)
+    return OpenCVBackend(name, onnx_path, reference.input_name, reference.input_shape, reference.output_names)
+
+def max_difference(expected: List[np.ndarray], actual: List[np.ndarray]) -> float:
+    """The largest absolute difference between two sets of model outputs, infinite if their shapes differ."""
+    if len(expected) != len(actual) or any(a.shape != b.shape for a, b in zip(expected, actual)):
+        return float('inf')
+    return max(float(np.max(np.abs(a - b))) for a, b in zip(expected, actual))
+
+def time_backend(backend: InferenceBackend, img_in: np.ndarray, runs: int) -> float:
+    """The median seconds a backend takes to run the model on an input, after a first run to warm it up."""
+    backend.run(img_in)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.run(img_in)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def select_backend(onnx_path: str, runtime: RuntimeConfig, reference: OnnxRuntimeBackend, img_in: np.ndarray,
+                   use_gpu: bool = False) -> InferenceBackend:
+    """
+    Pick the backend to run a model with. Each candidate backend is run on a dummy input and its outputs compared with the
+    reference's, onnxruntime on the CPU without quantization. Of the backends within the tolerance, the fastest is used.
+    Candidates that cannot be created (e.g. a provider that is not installed) or that give different outputs are skipped.
+
+    Args:
+        onnx_path (str): The model file.
+        runtime (RuntimeConfig): The candidate backends, the tolerance and how many runs to time each over.
+        reference (OnnxRuntimeBackend): onnxruntime on the CPU without quantization, used if no candidate passes.
+        img_in (np.ndarray): A dummy input batch at the size the model will be run at.
+        use_gpu (bool): Whether backends that run on a GPU may be used.
+
+    Returns:
+        InferenceBackend: The backend to use.
+    """
+    names = list(runtime.backends) or available_backends(use_gpu)
+    expected = reference.run(img_in)
+    results: List[Tuple[float, InferenceBackend]] = []
+    for name in names:
+        if needs_gpu(name) and not use_gpu:
+            print(f'Skipping the {name} backend as UseGpu is False')
+            continue
+        try:
+            backend = create_backend(name, onnx_path, runtime, reference)
+            difference = max_difference(expected, backend.run(img_in))
+            if difference > runtime.backend_tolerance:
+                print(f'Skipping the {name} backend as its outputs differ from onnxruntime on the CPU '
+                      f'(max difference {difference:.6f} > {runtime.backend_tolerance})')
+                continue
+            if len(names) == 1: # nothing to compare its speed with
+                print(f'Backend {name} passed the self-check (max output difference {difference:.6f})')
+                return backend
+            seconds = time_backend(backend, img_in, runtime.backend_benchmark_runs)
+        except Exception as e:
+            print(f'Skipping the {name} backend - {e}')
+            continue
+        print(f'Backend {name}: {seconds * 1000:.1f} ms per run (max output difference {difference:.6f})')
+        results.append((seconds, backend))
+    if not results:
+        print(f'No inference backend passed the self-check, using {REFERENCE_BACKEND}')
+        return reference
+    seconds, backend = min(results, key=lambda result: result[0])
+    print(f'Using the {backend.name} inference backend ({seconds * 1000:.1f} ms per run)')
+    return backend
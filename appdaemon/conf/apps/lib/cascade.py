@@ -0,0 +1,92 @@
+'''
+The code is used to run the machine learning model as a cascade: a cheap pre-screen pass over every image,
+escalating to the full model only for the images the pre-screen finds a possible issue in.
+'''
+
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+import numpy as np
+
+from lib.onnx import DETECTION_DTYPE, OnnxNet, detections_to_tuples
+
+@dataclass
+class CascadeInput:
+    """The pre-screen input batch, and the images to prepare for the full model if they are escalated."""
+    prescreen_input: np.ndarray
+    images: List[np.ndarray]
+
+@dataclass
+class CascadeOutputs:
+    """The outputs of a cascade run over a batch of images."""
+    escalated: np.ndarray # whether each image was run through the full model
+    prescreen_confidences: np.ndarray # the highest pre-screen confidence of each image
+    outputs: Optional[List[np.ndarray]] = None # the full model outputs of the escalated images, in order
+
+class CascadeNet:
+    """
+    Runs the pre-screen net over every image and the full net only over the images with a pre-screen confidence of at least
+    the escalation score. It has the same interface as OnnxNet, so detections look the same whether or not the cascade is used.
+    Images that are not escalated have no detections, so the escalation score should be below the detection threshold.
+    The pre-screen net is either a smaller model or the full model run at a reduced input size.
+    """
+
+    def __init__(self, net: OnnxNet, prescreen: OnnxNet, escalation_score: float):
+        self.net = net
+        self.prescreen = prescreen
+        self.escalation_score = escalation_score
+        self.meta = net.meta
+        self.input_w = net.input_w
+        self.input_h = net.input_h
+
+    def detect(self, meta, image, alt_names, thresh=.5, hier_thresh=.5, nms=.45, debug=False) -> List[Tuple[str, float, Tuple[float, float, float, float]]]:
+        return self.detect_batch(meta, [image], alt_names, thresh, hier_thresh, nms, debug)[0]
+
+    def detect_batch(self, meta, images, alt_names, thresh=.5, hier_thresh=.5, nms=.45, debug=False) -> List[List[Tuple[str, float, Tuple[float, float, float, float]]]]:
+        if len(images) == 0:
+            return []
+        cascade_input = self.preprocess(images)
+        try:
+            outputs = self.infer(cascade_input)
+        finally:
+            self.release_input(cascade_input)
+        detections = self.postprocess(outputs, [image.shape[:2] for image in images], thresh, nms)
+        return [detections_to_tuples(image_detections, meta.names) for image_detections in detections]
+
+    def preprocess(self, images) -> CascadeInput:
+        """Prepare images as the pre-screen input batch, keeping the images in case the full model needs them."""
+        return CascadeInput(self.prescreen.preprocess(images), list(images))
+
+    def release_input(self, cascade_input: CascadeInput) -> None:
+        """Hand back the pre-screen input batch once it has been inferred or dropped."""
+        self.prescreen.release_input(cascade_input.prescreen_input)
+
+    def infer(self, cascade_input: CascadeInput) -> CascadeOutputs:
+        """Run the pre-screen on the batch, then the full model on the images it escalates."""
+        confidences = OnnxNet.max_confidences(self.prescreen.infer(cascade_input.prescreen_input))
+        escalated = confidences >= self.escalation_score
+        outputs = CascadeOutputs(escalated, confidences)
+        if escalated.any():
+            images = [image for image, escalate in zip(cascade_input.images, escalated.tolist()) if escalate]
+            img_in = self.net.preprocess(images)
+            try:
+                outputs.outputs = self.net.infer(img_in)
+            finally:
+                self.net.release_input(img_in)
+        return outputs
+
+    def postprocess(self, outputs: CascadeOutputs, image_sizes, thresh, nms) -> List[np.ndarray]:
+        """Turn the outputs of a cascade run into detection arrays of DETECTION_DTYPE, empty for the images that were not escalated."""
+        detections = [np.empty(0, dtype=DETECTION_DTYPE) for _ in image_sizes]
+        if outputs.outputs is not None:
+            indices = np.flatnonzero(outputs.escalated).tolist()
+            escalated = OnnxNet.postprocess(outputs.outputs, [image_sizes[i] for i in indices], thresh, nms)
+            for i, image_detections in zip(indices, escalated):
+                detections[i] = image_detections
+        return detections
+
+    def max_confidences(self, outputs: CascadeOutputs) -> np.ndarray:
+        """The highest confidence of each image, from the full model for escalated images and the pre-screen for the rest."""
+        confidences = outputs.prescreen_confidences.copy()
+        if outputs.outputs is not None:
+            confidences[outputs.escalated] = OnnxNet.max_confidences(outputs.outputs)
+        return confidences
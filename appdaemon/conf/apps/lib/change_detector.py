@@ -0,0 +1,59 @@
+'''
+The code is used to skip running the machine learning model on camera frames that have barely changed since the last frame it was run on.
+'''
+
+import numpy as np
+import cv2
+
+class FrameChangeDetector:
+    """
+    Compares a small grayscale thumbnail of each frame with the thumbnail of the last frame the model was run on.
+    Frames that differ by less than the threshold (the mean absolute difference, 0-1) can reuse the last detection result,
+    except that the model is always run again once `force_every` frames in a row have been skipped.
+    """
+
+    def __init__(self, threshold: float, force_every: int, size: int = 32):
+        self.threshold = threshold
+        self.force_every = force_every
+        self.size = size
+        self._reference = None
+        self._thumbnail = np.empty((size, size, 3), dtype=np.uint8)
+        self._gray = np.empty((size, size), dtype=np.uint8)
+        self._skipped_in_row = 0
+        self.last_change = 1.0
+        self.hits = 0 # frames skipped, reusing the last result
+        self.misses = 0 # frames the model was run on
+
+    def thumbnail(self, image: np.ndarray) -> np.ndarray:
+        """Downscale a BGR image to the small grayscale thumbnail frames are compared with."""
+        cv2.resize(image, (self.size, self.size), dst=self._thumbnail, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self._thumbnail, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        return self._gray
+
+    def should_infer(self, image: np.ndarray, force: bool = False) -> bool:
+        """
+        Check whether the model needs to be run on a frame. When it does, the frame becomes the new reference.
+
+        Args:
+            image (np.ndarray): The BGR frame.
+            force (bool): Run the model regardless of the change, e.g. when there is no result to reuse.
+
+        Returns:
+            bool: True if the model should be run, False if the last detection result can be reused.
+        """
+        gray = self.thumbnail(image)
+        if self._reference is None:
+            self.last_change = 1.0
+        else:
+            self.last_change = float(cv2.absdiff(gray, self._reference).mean()) / 255.0
+        if not force and self._reference is not None and self.last_change < self.threshold and self._skipped_in_row < self.force_every:
+            self._skipped_in_row += 1
+            self.hits += 1
+            return False
+        if self._reference is None:
+            self._reference = np.empty_like(gray)
+        np.copyto(self._reference, gray)
+        self._skipped_in_row = 0
+        self.misses += 1
+        return True
+
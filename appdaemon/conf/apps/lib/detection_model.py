@@ -9,11 +9,12 @@ Link: https://github.com/TheSpaghettiDetective/obico-server/tree/release
 from lib.meta import Meta
 from os import path
 from lib.onnx import OnnxNet
+from lib.cascade import CascadeNet
 
 alt_names = None
 onnx_ready = True
 
-def load_net(config_path, meta_path, weights_path=None):
+def load_net(config_path, meta_path, weights_path=None, runtime=None):
     def try_loading_net(net_config_priority):
         for net_config in net_config_priority:
             weights = net_config['weights_path']
@@ -24,7 +25,7 @@ def load_net(config_path, meta_path, weights_path=None):
                 if weights.endswith(".onnx"):
                     if not onnx_ready:
                         raise Exception('Not loading ONNX net due to previous import failure. Check earlier log for errors.')
-                    net_main = OnnxNet(weights, meta_path, use_gpu)
+                    net_main = OnnxNet(weights, meta_path, use_gpu, runtime)
                 else:
                     raise Exception(f'Can not recognize net from weights file surfix: {weights}')
                 print('Succeeded!')
@@ -37,12 +38,11 @@ def load_net(config_path, meta_path, weights_path=None):
     global alt_names  # pylint: disable=W0603
 
     model_dir = path.join(path.dirname(path.realpath(__file__)), '..', 'model')
-    net_config_priority = [
-            dict(weights_path=path.join(model_dir, 'model-weights.onnx'), use_gpu=True),
-            dict(weights_path=path.join(model_dir, 'model-weights.onnx'), use_gpu=False),
-        ]
+    # OnnxNet picks its own backend, only using a GPU one if use_gpu, so there is a single config to try
+    use_gpu = runtime is not None and runtime.use_gpu
+    net_config_priority = [ dict(weights_path=path.join(model_dir, 'model-weights.onnx'), use_gpu=use_gpu) ]
     if weights_path is not None:
-        net_config_priority = [ dict(weights_path=weights_path, use_gpu=True), dict(weights_path=weights_path, use_gpu=False) ]
+        net_config_priority = [ dict(weights_path=weights_path, use_gpu=use_gpu) ]
 
     net_main = try_loading_net(net_config_priority)
 
@@ -57,5 +57,27 @@ def load_net(config_path, meta_path, weights_path=None):
 
     return net_main
 
+def load_detection_net(config_path, meta_path, weights_path, runtime=None, cascade=False, prescreen_weights=None,
+                       prescreen_size=224, escalation_score=0.1):
+    """
+    Load the net the app runs: the model itself, or the model behind a pre-screen if cascade is enabled.
+    The pre-screen is prescreen_weights if set, otherwise the model itself at prescreen_size if it accepts a dynamic input size.
+    A module level function so an inference worker process can load the same net.
+    """
+    net_main = load_net(config_path, meta_path, weights_path, runtime)
+    if not cascade:
+        return net_main
+    if prescreen_weights:
+        prescreen = OnnxNet(prescreen_weights, meta_path, runtime is not None and runtime.use_gpu, runtime)
+    elif net_main.dynamic_size:
+        prescreen = net_main.resized(prescreen_size, prescreen_size)
+    else:
+        print('Cascade needs a pre-screen model as the model has a fixed input size, running the full model on every frame.')
+        return net_main
+    return CascadeNet(net_main, prescreen, escalation_score)
+
 def detect(net, image, thresh=.5, hier_thresh=.5, nms=.45, debug=False):
     return net.detect(net.meta, image, alt_names, thresh, hier_thresh, nms, debug)
+
+def detect_batch(net, images, thresh=.5, hier_thresh=.5, nms=.45, debug=False):
+    return net.detect_batch(net.meta, images, alt_names, thresh, hier_thresh, nms, debug)
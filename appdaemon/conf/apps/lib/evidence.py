@@ -0,0 +1,117 @@
+'''
+The code is used to write out the evidence of a detected issue from the frame ring buffer: the frame that triggered
+the notification with its detections drawn on, and a short clip of the frames leading up to it.
+It also records an optional low rate timelapse of each print.
+'''
+
+from typing import List, Optional
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+from lib.frame_buffer import BufferedFrame
+
+BOX_COLOUR = (0, 0, 255) # BGR
+
+def annotate(image: np.ndarray, detections: np.ndarray) -> np.ndarray:
+    """Draw the detection boxes and their confidence onto an image, in place."""
+    thickness = max(1, image.shape[1] // 400)
+    for detection in detections:
+        x0 = int(detection['xc'] - detection['w'] / 2)
+        y0 = int(detection['yc'] - detection['h'] / 2)
+        x1 = int(detection['xc'] + detection['w'] / 2)
+        y1 = int(detection['yc'] + detection['h'] / 2)
+        cv2.rectangle(image, (x0, y0), (x1, y1), BOX_COLOUR, thickness)
+        cv2.putText(image, f"{detection['confidence']:.2f}", (x0, max(y0 - 4 * thickness, 10 * thickness)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.4 * thickness, BOX_COLOUR, thickness)
+    return image
+
+def evidence_name(printer_name: str, frame: BufferedFrame) -> str:
+    """The file name, without extension, of the evidence of a frame."""
+    return f"{printer_name}_{time.strftime('%Y%m%d-%H%M%S', time.localtime(frame.timestamp))}"
+
+def write_evidence_image(path: str, frame: BufferedFrame) -> bool:
+    """
+    Write a frame with its detections drawn on as a JPEG.
+
+    Returns:
+        bool: Whether the image was written.
+    """
+    image = cv2.imdecode(np.frombuffer(frame.frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return cv2.imwrite(path, annotate(image, frame.detections))
+
+def write_clip(path: str, frames: List[BufferedFrame], fps: float) -> bool:
+    """
+    Write frames with their detections drawn on as an MP4 clip, scaled to the size of the last frame.
+
+    Returns:
+        bool: Whether the clip was written.
+    """
+    images = [(cv2.imdecode(np.frombuffer(frame.frame, dtype=np.uint8), cv2.IMREAD_COLOR), frame) for frame in frames]
+    images = [(image, frame) for image, frame in images if image is not None]
+    if not images:
+        return False
+    height, width = images[-1][0].shape[:2]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        return False
+    try:
+        for image, frame in images:
+            image = annotate(image, frame.detections)
+            if image.shape[:2] != (height, width):
+                image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+            writer.write(image)
+    finally:
+        writer.release()
+    return True
+
+class Timelapse:
+    """
+    Appends a frame of a print at most every `interval` seconds to an MJPEG file, a plain sequence of the encoded frames.
+    Frames are appended as they arrive without being decoded or re-encoded, and the file can be played or converted with ffmpeg.
+    A new file is started for each print.
+    """
+
+    def __init__(self, directory: str, printer_name: str, interval: float):
+        self.directory = directory
+        self.printer_name = printer_name
+        self.interval = interval
+        self.path: Optional[str] = None
+        self._file = None
+        self._last_frame_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, frame: bytes, now: Optional[float] = None) -> bool:
+        """
+        Append a frame if at least the interval has passed since the last one, starting a new file if none is open.
+
+        Returns:
+            bool: Whether the frame was appended.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._last_frame_at is not None and now - self._last_frame_at < self.interval:
+                return False
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                name = f"timelapse_{self.printer_name}_{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.mjpeg"
+                self.path = os.path.join(self.directory, name)
+                self._file = open(self.path, 'ab')
+            self._file.write(frame)
+            self._file.flush()
+            self._last_frame_at = now
+            return True
+
+    def close(self) -> None:
+        """Close the file of the current print, so the next frame starts a new one."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+            self._last_frame_at = None
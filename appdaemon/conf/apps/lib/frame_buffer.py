@@ -0,0 +1,97 @@
+'''
+The code is used to keep the last few encoded camera frames of a printer in memory together with their detections,
+so the frame that triggered a notification and the frames leading up to it can be saved once an issue is detected,
+instead of writing every frame to disk.
+'''
+
+from dataclasses import dataclass
+from typing import List, Optional
+import threading
+import time
+import numpy as np
+
+from lib.onnx import DETECTION_DTYPE
+
+@dataclass
+class BufferedFrame:
+    """A frame copied out of the ring buffer."""
+    sequence: int # increases by one with every frame added to the buffer
+    timestamp: float # the wall clock time the frame was added
+    frame: bytes # the encoded frame
+    detections: np.ndarray # the DETECTION_DTYPE detections of the frame, in frame pixels
+
+class FrameRingBuffer:
+    """
+    A ring of the last `capacity` encoded frames and their detections, allocated once up front.
+    Adding a frame copies it into the oldest slot, so the buffer never allocates or grows while printing.
+    Frames larger than `max_frame_bytes` and detections beyond the `max_detections` most confident are not kept.
+    """
+
+    def __init__(self, capacity: int = 24, max_frame_bytes: int = 512 * 1024, max_detections: int = 32):
+        self.capacity = capacity
+        self.max_frame_bytes = max_frame_bytes
+        self._frames = np.zeros((capacity, max_frame_bytes), dtype=np.uint8)
+        self._lengths = np.zeros(capacity, dtype=np.int64)
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self._detections = np.zeros((capacity, max_detections), dtype=DETECTION_DTYPE)
+        self._detection_counts = np.zeros(capacity, dtype=np.int64)
+        self._next_sequence = 0
+        self._lock = threading.Lock()
+        self.oversized = 0 # frames not kept as they were larger than max_frame_bytes
+
+    def append(self, frame: bytes, detections: np.ndarray, timestamp: Optional[float] = None) -> Optional[int]:
+        """
+        Add a frame, replacing the oldest one.
+
+        Args:
+            frame (bytes): The encoded frame.
+            detections (np.ndarray): The DETECTION_DTYPE detections of the frame.
+            timestamp (Optional[float]): The wall clock time of the frame, defaults to now.
+
+        Returns:
+            Optional[int]: The sequence number of the frame, or None if it was too large to keep.
+        """
+        if len(frame) > self.max_frame_bytes:
+            self.oversized += 1
+            return None
+        if len(detections) > self._detections.shape[1]:
+            detections = detections[np.argsort(-detections['confidence'])[:self._detections.shape[1]]]
+        with self._lock:
+            sequence = self._next_sequence
+            slot = sequence % self.capacity
+            self._frames[slot, :len(frame)] = np.frombuffer(frame, dtype=np.uint8)
+            self._lengths[slot] = len(frame)
+            self._timestamps[slot] = time.time() if timestamp is None else timestamp
+            self._detections[slot, :len(detections)] = detections
+            self._detection_counts[slot] = len(detections)
+            self._next_sequence = sequence + 1
+        return sequence
+
+    def get(self, sequence: int) -> Optional[BufferedFrame]:
+        """Copy a frame out of the buffer by its sequence number, or None if it has been replaced since."""
+        with self._lock:
+            return self._copy(sequence)
+
+    def last(self, count: int, until: Optional[int] = None) -> List[BufferedFrame]:
+        """
+        Copy up to `count` of the latest frames out of the buffer, oldest first.
+
+        Args:
+            count (int): The number of frames.
+            until (Optional[int]): The sequence number of the last frame to include, defaults to the latest frame.
+        """
+        with self._lock:
+            end = self._next_sequence if until is None else min(until + 1, self._next_sequence)
+            start = max(end - count, self._next_sequence - self.capacity, 0)
+            return [self._copy(sequence) for sequence in range(start, end)]
+
+    def __len__(self) -> int:
+        return min(self._next_sequence, self.capacity)
+
+    def _copy(self, sequence: int) -> Optional[BufferedFrame]:
+        if sequence < 0 or sequence >= self._next_sequence or sequence < self._next_sequence - self.capacity:
+            return None
+        slot = sequence % self.capacity
+        return BufferedFrame(sequence=sequence, timestamp=float(self._timestamps[slot]),
+                             frame=self._frames[slot, :self._lengths[slot]].tobytes(),
+                             detections=self._detections[slot, :self._detection_counts[slot]].copy())
@@ -0,0 +1,361 @@
+'''
+The code is used to fetch camera frames from Home Assistant without writing them to disk first,
+either as a snapshot per frame or from a long-lived MJPEG or RTSP stream of the camera.
+'''
+
+from typing import Callable, Dict, Optional, Tuple
+import abc
+import threading
+import time
+import numpy as np
+import cv2
+import requests
+from requests.adapters import HTTPAdapter
+
+# JPEG start of frame markers, which hold the image dimensions
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# decode flags which have the decoder scale the image down by the given factor while decoding
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+def jpeg_size(jpeg: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Read the dimensions of a JPEG image from its header without decoding it.
+
+    Args:
+        jpeg (bytes): The encoded image.
+
+    Returns:
+        Optional[Tuple[int, int]]: The (width, height) of the image, or None if the header could not be read.
+    """
+    if jpeg[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(jpeg):
+        if jpeg[i] != 0xFF:
+            return None
+        marker = jpeg[i + 1]
+        if marker == 0xFF: # fill byte
+            i += 1
+            continue
+        if marker in SOF_MARKERS:
+            return int.from_bytes(jpeg[i + 7:i + 9], 'big'), int.from_bytes(jpeg[i + 5:i + 7], 'big')
+        i += 2 + int.from_bytes(jpeg[i + 2:i + 4], 'big')
+    return None
+
+class CameraProxyFrameSource:
+    """
+    Fetches JPEG frames straight from Home Assistant's camera_proxy endpoint.
+    Connections are kept alive in a pool and reused between detection cycles, and every request has a strict timeout.
+    """
+    session: requests.Session
+
+    def __init__(self, hass_hostname: str, hass_token: str, pool_size: int = 1, connect_timeout: float = 2.0, read_timeout: float = 5.0):
+        self.hass_hostname = hass_hostname.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update({'Authorization': f'Bearer {hass_token}'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1), max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch_jpeg(self, camera_entity: str) -> bytes:
+        """
+        Fetch the latest frame of a camera as encoded JPEG bytes.
+
+        Args:
+            camera_entity (str): The entity ID of the camera.
+
+        Raises:
+            requests.RequestException: Raised if the frame could not be fetched within the timeout.
+
+        Returns:
+            bytes: The encoded frame.
+        """
+        response = self.session.get(f"{self.hass_hostname}/api/camera_proxy/{camera_entity}", timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    @staticmethod
+    def decode(jpeg: bytes, min_size: Optional[Tuple[int, int]] = None) -> Optional[np.ndarray]:
+        """
+        Decode an encoded frame into a BGR image. The bytes are wrapped rather than copied before decoding.
+        If a minimum size is given and the frame is at least twice as large, it is decoded straight
+        at 1/2, 1/4 or 1/8 scale, the smallest that is still no smaller than the minimum size.
+
+        Args:
+            jpeg (bytes): The encoded frame.
+            min_size (Optional[Tuple[int, int]]): The (width, height) the decoded image needs to be at least.
+
+        Returns:
+            Optional[np.ndarray]: The decoded image, or None if it could not be decoded.
+        """
+        flags = cv2.IMREAD_COLOR
+        size = jpeg_size(jpeg) if min_size is not None else None
+        if size is not None:
+            for factor, reduced_flags in REDUCED_DECODE_FLAGS:
+                if size[0] // factor >= min_size[0] and size[1] // factor >= min_size[1]:
+                    flags = reduced_flags
+                    break
+        return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), flags)
+
+    def release(self, camera_entity: str) -> None:
+        """
+        Release what is held open for a camera until its next frame is fetched. Snapshots hold nothing open.
+        """
+
+    def close(self) -> None:
+        """
+        Close the pooled connections.
+        """
+        self.session.close()
+
+class StreamUnavailable(requests.ConnectionError):
+    """Raised when a stream has not delivered a frame within the read timeout."""
+
+class StreamReader(abc.ABC):
+    """
+    Reads a camera stream on a background thread, keeping only the latest frame.
+    The stream is reconnected whenever it fails or ends, waiting `min_backoff` seconds at first and doubling the wait
+    on every failure in a row up to `max_backoff`.
+    """
+
+    # whether a frame is only produced once it is asked for, otherwise every frame of the stream is kept until the next one
+    on_demand = False
+    # the largest a frame can be, so a stream of garbage does not use up the memory
+    max_frame_bytes = 16 * 1024 * 1024
+
+    def __init__(self, url: str, connect_timeout: float = 2.0, read_timeout: float = 5.0, min_backoff: float = 1.0,
+                 max_backoff: float = 30.0, log: Callable[[str], None] = print):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.log = log
+        self.reconnects = 0
+        self._condition = threading.Condition()
+        self._frame: Optional[bytes] = None
+        self._frame_at = 0.0
+        self._requested = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="print-detect-stream-reader", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def latest(self) -> bytes:
+        """
+        Get the latest frame, waiting for the stream to deliver one if it has none recent enough.
+
+        Raises:
+            StreamUnavailable: Raised if no frame arrived within the connect and read timeouts.
+
+        Returns:
+            bytes: The encoded frame.
+        """
+        requested_at = time.monotonic()
+        max_age = 0.0 if self.on_demand else self.read_timeout
+        with self._condition:
+            self._requested = True
+            if not self._condition.wait_for(lambda: self._frame is not None and self._frame_at >= requested_at - max_age,
+                                            self.connect_timeout + self.read_timeout):
+                raise StreamUnavailable(f"No frame from the stream {self.url} within {self.connect_timeout + self.read_timeout:g} seconds")
+            return self._frame
+
+    @property
+    def requested(self) -> bool:
+        """Whether a frame has been asked for since the last one was published."""
+        return self._requested
+
+    def publish(self, frame: bytes) -> None:
+        """Replace the latest frame, called by the reading thread."""
+        with self._condition:
+            self._frame = frame
+            self._frame_at = time.monotonic()
+            self._requested = False
+            self._condition.notify_all()
+
+    def _run(self) -> None:
+        backoff = self.min_backoff
+        while not self._stopped.is_set():
+            received_at = self._frame_at
+            try:
+                self.read()
+                error = "stream ended"
+            except Exception as e:
+                error = str(e)
+            if self._stopped.is_set():
+                return
+            if self._frame_at > received_at: # the connection delivered frames, so start backing off afresh
+                backoff = self.min_backoff
+            self.log(f"Camera stream {self.url} disconnected ({error}), reconnecting in {backoff:g} seconds.")
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+            self.reconnects += 1
+
+    @abc.abstractmethod
+    def read(self) -> None:
+        """Connect to the stream and read it until it fails, ends or the reader is stopped."""
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+class MjpegStreamReader(StreamReader):
+    """
+    Reads an MJPEG stream over HTTP, such as Home Assistant's camera_proxy_stream. Frames are split out of the stream
+    by their JPEG start and end markers and kept encoded, so only the frames that are used are ever decoded.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, url: str, headers: Optional[Dict[str, str]] = None, **kwargs):
+        super().__init__(url, **kwargs)
+        self.headers = headers or {}
+        self._response = None
+
+    def read(self) -> None:
+        with requests.get(self.url, headers=self.headers, stream=True, timeout=(self.connect_timeout, self.read_timeout)) as response:
+            response.raise_for_status()
+            self._response = response
+            if self.stopped: # stopped while connecting
+                return
+            buffer = bytearray()
+            start = -1 # the start of the frame being received, -1 until its start marker is found
+            # read1 returns what has arrived, up to the chunk size, rather than holding frames back until a whole chunk has
+            chunks = iter(lambda: response.raw.read1(self.chunk_size), b'')
+            for chunk in chunks:
+                if self.stopped:
+                    return
+                searched = max(len(buffer) - 1, 0) # a marker may be split between chunks
+                buffer += chunk
+                while True:
+                    if start < 0:
+                        start = buffer.find(b'\xff\xd8', searched)
+                        if start < 0:
+                            del buffer[:max(len(buffer) - 1, 0)]
+                            break
+                        searched = start + 2
+                    end = buffer.find(b'\xff\xd9', searched)
+                    if end < 0:
+                        if len(buffer) - start > self.max_frame_bytes:
+                            raise ValueError(f"no frame end within {self.max_frame_bytes} bytes")
+                        if start > 0:
+                            del buffer[:start]
+                            start = 0
+                        break
+                    self.publish(bytes(buffer[start:end + 2]))
+                    del buffer[:end + 2]
+                    start, searched = -1, 0
+
+    def stop(self) -> None:
+        super().stop()
+        response = self._response
+        if response is not None:
+            response.close() # unblock the reading thread rather than wait for the read timeout
+
+class RtspStreamReader(StreamReader):
+    """
+    Reads an RTSP (or any other video) stream with OpenCV. Every frame has to be read to follow the stream,
+    but a frame is only converted and encoded as a JPEG when one is asked for.
+    """
+
+    on_demand = True
+
+    def read(self) -> None:
+        capture = cv2.VideoCapture(self.url, cv2.CAP_FFMPEG, [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(self.connect_timeout * 1000),
+                                                              cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(self.read_timeout * 1000)])
+        try:
+            if not capture.isOpened():
+                raise StreamUnavailable("could not open the stream")
+            while not self.stopped:
+                if not capture.grab():
+                    raise StreamUnavailable("could not read a frame")
+                if self.requested:
+                    retrieved, image = capture.retrieve()
+                    encoded, jpeg = cv2.imencode('.jpg', image) if retrieved else (False, None)
+                    if encoded:
+                        self.publish(jpeg.tobytes())
+        finally:
+            capture.release()
+
+class StreamingFrameSource:
+    """
+    Fetches JPEG frames from a long-lived stream of each camera, read in the background, instead of requesting a snapshot
+    per frame. Fetching a frame only hands over the latest frame of the stream, so cameras can be sampled many times a second
+    at no extra cost to Home Assistant. Cameras are streamed through Home Assistant's camera_proxy_stream endpoint unless they
+    have their own stream URL, either MJPEG over HTTP or RTSP. A camera's stream is opened the first time a frame is fetched
+    and kept open until it is released.
+    """
+
+    def __init__(self, hass_hostname: str, hass_token: str, connect_timeout: float = 2.0, read_timeout: float = 5.0,
+                 stream_urls: Optional[Dict[str, str]] = None, log: Callable[[str], None] = print):
+        self.hass_hostname = hass_hostname.rstrip('/')
+        self.hass_token = hass_token
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.stream_urls = stream_urls or {}
+        self.log = log
+        self.reconnects = 0 # reconnects of streams that have since been released
+        self._readers: Dict[str, StreamReader] = {}
+        self._lock = threading.Lock()
+
+    def reader(self, camera_entity: str) -> StreamReader:
+        """Get the reader of a camera's stream, opening the stream if it is not open."""
+        with self._lock:
+            reader = self._readers.get(camera_entity)
+            if reader is None:
+                url = self.stream_urls.get(camera_entity)
+                options = dict(connect_timeout=self.connect_timeout, read_timeout=self.read_timeout, log=self.log)
+                if not url:
+                    # the token is only sent to Home Assistant, never to a camera's own stream URL
+                    reader = MjpegStreamReader(f"{self.hass_hostname}/api/camera_proxy_stream/{camera_entity}",
+                                               headers={'Authorization': f'Bearer {self.hass_token}'}, **options)
+                elif url.startswith(('http://', 'https://')):
+                    reader = MjpegStreamReader(url, **options)
+                else:
+                    reader = RtspStreamReader(url, **options)
+                reader.start()
+                self._readers[camera_entity] = reader
+            return reader
+
+    def fetch_jpeg(self, camera_entity: str) -> bytes:
+        """
+        Get the latest frame of a camera's stream as encoded JPEG bytes.
+
+        Args:
+            camera_entity (str): The entity ID of the camera.
+
+        Raises:
+            StreamUnavailable: Raised if the stream has not delivered a frame within the timeouts.
+
+        Returns:
+            bytes: The encoded frame.
+        """
+        return self.reader(camera_entity).latest()
+
+    def release(self, camera_entity: str) -> None:
+        """
+        Close the stream of a camera until its next frame is fetched.
+        """
+        with self._lock:
+            reader = self._readers.pop(camera_entity, None)
+        if reader is not None:
+            reader.stop()
+            self.reconnects += reader.reconnects
+
+    @property
+    def total_reconnects(self) -> int:
+        """The reconnects of all streams, open or released."""
+        with self._lock:
+            return self.reconnects + sum(reader.reconnects for reader in self._readers.values())
+
+    def close(self) -> None:
+        """
+        Close all streams.
+        """
+        for camera_entity in list(self._readers):
+            self.release(camera_entity)
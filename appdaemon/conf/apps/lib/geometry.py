@@ -5,6 +5,7 @@ Link: https://github.com/TheSpaghettiDetective/obico-server/tree/release
 
 from dataclasses import dataclass
 from typing import List, Tuple
+import numpy as np
 
 @dataclass
 class Box:
@@ -77,4 +78,31 @@ class Detection:
     @classmethod
     def from_tuple(cls, detection: Tuple[str, float, Tuple[float, float, float, float]]) -> 'Detection':
         box = Box.from_tuple(detection[2])
-        return Detection(detection[0], float(detection[1]), box)
\ No newline at end of file
+        return Detection(detection[0], float(detection[1]), box)
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Calculates the intersection over union of every pair of boxes from two arrays of (xc, yc, w, h) boxes.
+
+    Args:
+        boxes_a (np.ndarray): An (n, 4) array of boxes.
+        boxes_b (np.ndarray): An (m, 4) array of boxes.
+
+    Returns:
+        np.ndarray: An (n, m) array of the intersection over union of each pair.
+    """
+    a_l = boxes_a[:, 0] - boxes_a[:, 2] * 0.5
+    a_r = boxes_a[:, 0] + boxes_a[:, 2] * 0.5
+    a_t = boxes_a[:, 1] - boxes_a[:, 3] * 0.5
+    a_b = boxes_a[:, 1] + boxes_a[:, 3] * 0.5
+    b_l = boxes_b[:, 0] - boxes_b[:, 2] * 0.5
+    b_r = boxes_b[:, 0] + boxes_b[:, 2] * 0.5
+    b_t = boxes_b[:, 1] - boxes_b[:, 3] * 0.5
+    b_b = boxes_b[:, 1] + boxes_b[:, 3] * 0.5
+
+    i_w = np.maximum(0.0, np.minimum(a_r[:, None], b_r) - np.maximum(a_l[:, None], b_l))
+    i_h = np.maximum(0.0, np.minimum(a_b[:, None], b_b) - np.maximum(a_t[:, None], b_t))
+    inter = i_w * i_h
+    union = (boxes_a[:, 2] * boxes_a[:, 3])[:, None] + boxes_b[:, 2] * boxes_b[:, 3] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
@@ -0,0 +1,283 @@
+'''
+The code is used to record the result of every detection in an SQLite database, for tuning the detection settings
+and reviewing failed prints. Results are queued in memory and written in batches by a background thread,
+so recording a result never waits on the disk.
+'''
+
+from dataclasses import dataclass
+from contextlib import closing
+from typing import Dict, List, Optional
+import hashlib
+import itertools
+import sqlite3
+import threading
+import time
+import numpy as np
+
+from lib.onnx import DETECTION_DTYPE
+
+TIMED_STAGES = ('fetch', 'decode', 'preprocess', 'inference', 'postprocess', 'cycle')
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS prints (
+    id INTEGER PRIMARY KEY,
+    printer TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    ended_at REAL
+);
+CREATE INDEX IF NOT EXISTS prints_printer_started_at ON prints (printer, started_at);
+CREATE TABLE IF NOT EXISTS frames (
+    id INTEGER PRIMARY KEY,
+    printer TEXT NOT NULL,
+    print_id INTEGER,
+    timestamp REAL NOT NULL,
+    frame_hash INTEGER NOT NULL,
+    reused INTEGER NOT NULL,
+    detection_count INTEGER NOT NULL,
+    max_confidence REAL NOT NULL,
+    failure_score REAL NOT NULL,
+    detections BLOB NOT NULL,
+    {', '.join(f'{stage}_time REAL' for stage in TIMED_STAGES)}
+);
+CREATE INDEX IF NOT EXISTS frames_printer_timestamp ON frames (printer, timestamp);
+CREATE INDEX IF NOT EXISTS frames_timestamp ON frames (timestamp);
+CREATE INDEX IF NOT EXISTS frames_print_id ON frames (print_id);
+"""
+
+INSERT_FRAME = (f"INSERT INTO frames (printer, print_id, timestamp, frame_hash, reused, detection_count, max_confidence, failure_score, "
+                f"detections, {', '.join(f'{stage}_time' for stage in TIMED_STAGES)}) "
+                f"VALUES ({', '.join('?' * (9 + len(TIMED_STAGES)))})")
+
+def frame_hash(frame: bytes) -> int:
+    """A 64 bit hash of an encoded frame, to find repeated frames (e.g. a frozen camera)."""
+    return int.from_bytes(hashlib.blake2b(frame, digest_size=8).digest(), 'little', signed=True)
+
+@dataclass
+class HistoryFrame:
+    """A detection result read back from the history."""
+    printer: str
+    print_id: Optional[int]
+    timestamp: float
+    frame_hash: int
+    reused: bool
+    max_confidence: float
+    failure_score: float
+    detections: np.ndarray # DETECTION_DTYPE detections, in frame pixels
+    timings: Dict[str, Optional[float]] # seconds taken by each stage of the cycle the frame was in
+
+@dataclass
+class PrintSummary:
+    """The highest failure score and confidence of a print job."""
+    print_id: int
+    printer: str
+    started_at: float
+    ended_at: Optional[float]
+    frames: int
+    max_failure_score: float
+    max_confidence: float
+
+class DetectionHistory:
+    """
+    The detection history database. Recording methods other than start_print only queue rows, which are written by a background
+    thread every `flush_interval` seconds or once `batch_size` rows are queued, in one transaction per batch.
+    Rows older than `retention_days` are deleted by the writer thread (0 keeps everything).
+    Queries open their own connection, and can run while rows are written as the database is in WAL mode.
+    """
+
+    def __init__(self, path: str, batch_size: int = 100, flush_interval: float = 10.0, retention_days: float = 0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+        self._pending: List[tuple] = [] # (statement, row) in the order they were recorded
+        self._condition = threading.Condition() # signals both the writer thread and threads waiting in flush
+        self._written = 0 # rows written so far, compared with _queued by flush
+        self._queued = 0
+        self._closed = False
+        self._last_pruned = 0.0
+        self.failed_writes = 0
+        self._writer = threading.Thread(target=self._write_loop, name="print-detect-history", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def start_print(self, printer: str, started_at: Optional[float] = None) -> Optional[int]:
+        """
+        Record the start of a print job. Unlike the other recording methods the row is written straight away,
+        so SQLite assigns the id and several apps can share one database without their ids clashing.
+
+        Returns:
+            Optional[int]: The id of the print job, to record its frames and end with, or None if it could not be written.
+        """
+        try:
+            with closing(self._connect()) as connection, connection:
+                return connection.execute("INSERT INTO prints (printer, started_at) VALUES (?, ?)",
+                                          (printer, time.time() if started_at is None else started_at)).lastrowid
+        except sqlite3.Error as e:
+            self.failed_writes += 1
+            print(f"Failed to write the start of a print job to the detection history: {e}")
+            return None
+
+    def end_print(self, print_id: int, ended_at: Optional[float] = None) -> None:
+        """Record the end of a print job."""
+        self._queue("UPDATE prints SET ended_at = ? WHERE id = ?", (time.time() if ended_at is None else ended_at, print_id))
+
+    def record_frame(self, printer: str, print_id: Optional[int], frame: bytes, detections: np.ndarray, failure_score: float,
+                     reused: bool = False, timings: Optional[Dict[str, float]] = None, timestamp: Optional[float] = None) -> None:
+        """
+        Record the detection result of a frame.
+
+        Args:
+            printer (str): The printer the frame is of.
+            print_id (Optional[int]): The print job the frame is of.
+            frame (bytes): The encoded frame, which is hashed rather than stored.
+            detections (np.ndarray): The DETECTION_DTYPE detections of the frame.
+            failure_score (float): The failure score of the print job after the frame.
+            reused (bool): Whether the frame barely changed and reused the last detections.
+            timings (Optional[Dict[str, float]]): The seconds taken by each stage of the cycle.
+            timestamp (Optional[float]): The wall clock time of the frame, defaults to now.
+        """
+        timings = timings or {}
+        detections = np.ascontiguousarray(detections, dtype=DETECTION_DTYPE)
+        row = (printer, print_id, time.time() if timestamp is None else timestamp, frame_hash(frame), int(reused), len(detections),
+               float(detections['confidence'].max()) if len(detections) else 0.0, float(failure_score), detections.tobytes(),
+               *[timings.get(stage) for stage in TIMED_STAGES])
+        self._queue(INSERT_FRAME, row)
+
+    def _queue(self, statement: str, row: tuple) -> None:
+        with self._condition:
+            self._pending.append((statement, row))
+            self._queued += 1
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+
+    def _write_loop(self) -> None:
+        connection = self._connect()
+        try:
+            while True:
+                with self._condition:
+                    if not self._closed and len(self._pending) < self.batch_size:
+                        self._condition.wait(self.flush_interval)
+                    batch, self._pending = self._pending, []
+                    closed = self._closed
+                if batch:
+                    self._write(connection, batch)
+                if self.retention_days > 0 and time.monotonic() - self._last_pruned > 3600:
+                    self._prune(connection)
+                with self._condition:
+                    self._written += len(batch)
+                    self._condition.notify_all()
+                if closed:
+                    return
+        finally:
+            connection.close()
+
+    def _write(self, connection: sqlite3.Connection, batch: List[tuple]) -> None:
+        try:
+            with connection:
+                # consecutive rows with the same statement are inserted together
+                for statement, rows in itertools.groupby(batch, key=lambda item: item[0]):
+                    connection.executemany(statement, [row for _, row in rows])
+        except sqlite3.Error as e:
+            self.failed_writes += len(batch)
+            print(f"Failed to write {len(batch)} rows to the detection history: {e}")
+
+    def _prune(self, connection: sqlite3.Connection) -> None:
+        self._last_pruned = time.monotonic()
+        cutoff = time.time() - self.retention_days * 86400
+        try:
+            with connection:
+                connection.execute("DELETE FROM frames WHERE timestamp < ?", (cutoff,))
+                connection.execute("DELETE FROM prints WHERE started_at < ? AND id NOT IN (SELECT DISTINCT print_id FROM frames "
+                                   "WHERE print_id IS NOT NULL)", (cutoff,))
+        except sqlite3.Error as e:
+            print(f"Failed to delete old rows from the detection history: {e}")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the rows recorded so far to be written.
+
+        Returns:
+            bool: Whether they were written within the timeout.
+        """
+        with self._condition:
+            target = self._queued
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: self._written >= target or not self._writer.is_alive(), timeout)
+
+    def close(self) -> None:
+        """Write the queued rows and stop the writer thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._writer.join()
+
+    def max_failure_scores(self, printer: Optional[str] = None, since: Optional[float] = None,
+                           until: Optional[float] = None) -> List[PrintSummary]:
+        """
+        The highest failure score and confidence of each print job, most recent first.
+
+        Args:
+            printer (Optional[str]): Only print jobs of this printer.
+            since (Optional[float]): Only print jobs started at or after this time.
+            until (Optional[float]): Only print jobs started before this time.
+        """
+        conditions, parameters = DetectionHistory._conditions(printer, since, until, prefix="p.", time_column="started_at")
+        query = ("SELECT p.id, p.printer, p.started_at, p.ended_at, COUNT(f.id), COALESCE(MAX(f.failure_score), 0), "
+                 "COALESCE(MAX(f.max_confidence), 0) FROM prints p LEFT JOIN frames f ON f.print_id = p.id"
+                 f"{conditions} GROUP BY p.id ORDER BY p.started_at DESC")
+        with closing(self._connect()) as connection:
+            return [PrintSummary(*row) for row in connection.execute(query, parameters)]
+
+    def frames(self, printer: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None,
+               min_confidence: Optional[float] = None, print_id: Optional[int] = None, limit: Optional[int] = None) -> List[HistoryFrame]:
+        """
+        The recorded frames matching all the given filters, oldest first.
+
+        Args:
+            printer (Optional[str]): Only frames of this printer.
+            since (Optional[float]): Only frames at or after this time.
+            until (Optional[float]): Only frames before this time.
+            min_confidence (Optional[float]): Only frames with a detection at least this confident.
+            print_id (Optional[int]): Only frames of this print job.
+            limit (Optional[int]): The most frames to return.
+        """
+        conditions, parameters = DetectionHistory._conditions(printer, since, until)
+        if min_confidence is not None:
+            conditions += (" AND" if conditions else " WHERE") + " max_confidence >= ?"
+            parameters.append(min_confidence)
+        if print_id is not None:
+            conditions += (" AND" if conditions else " WHERE") + " print_id = ?"
+            parameters.append(print_id)
+        query = (f"SELECT printer, print_id, timestamp, frame_hash, reused, max_confidence, failure_score, detections, "
+                 f"{', '.join(f'{stage}_time' for stage in TIMED_STAGES)} FROM frames{conditions} ORDER BY timestamp")
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        with closing(self._connect()) as connection:
+            return [HistoryFrame(printer=row[0], print_id=row[1], timestamp=row[2], frame_hash=row[3], reused=bool(row[4]),
+                                 max_confidence=row[5], failure_score=row[6],
+                                 detections=np.frombuffer(row[7], dtype=DETECTION_DTYPE).copy(),
+                                 timings=dict(zip(TIMED_STAGES, row[8:])))
+                    for row in connection.execute(query, parameters)]
+
+    @staticmethod
+    def _conditions(printer: Optional[str], since: Optional[float], until: Optional[float],
+                    prefix: str = "", time_column: str = "timestamp"):
+        conditions, parameters = [], []
+        if printer is not None:
+            conditions.append(f"{prefix}printer = ?")
+            parameters.append(printer)
+        if since is not None:
+            conditions.append(f"{prefix}{time_column} >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append(f"{prefix}{time_column} < ?")
+            parameters.append(until)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
@@ -0,0 +1,307 @@
+'''
+The code is used to run the machine learning model in worker processes, so inference does not compete with AppDaemon for the GIL
+and a crash in onnxruntime only takes down a worker, which is restarted. Decoded frames are handed to the workers through
+shared memory rather than pickled, and the workers send back only the detections.
+'''
+
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import multiprocessing
+import queue
+import threading
+import time
+import numpy as np
+
+ALIGNMENT = 64 # each image in a shared memory segment starts on a cache line
+
+@dataclass
+class RemoteInput:
+    """A batch of images written to a shared memory segment, as (offset, height, width) of each image."""
+    segment: str
+    layout: List[Tuple[int, int, int]]
+
+@dataclass
+class RemoteOutputs:
+    """The results of a batch run by the workers."""
+    detections: List[np.ndarray] # DETECTION_DTYPE detections of each image, with boxes as fractions of the image
+    confidences: np.ndarray # the highest confidence of each image
+    escalated: Optional[np.ndarray] = None # whether each image was escalated, if the workers run a cascade
+
+def _worker_main(conn, loader: Callable[[], Any]) -> None:
+    """The main function of a worker process: load the net, then run the batches it is sent until told to stop."""
+    try:
+        net = loader()
+    except Exception as e:
+        conn.send(('failed', repr(e)))
+        return
+    conn.send(('ready', net.input_w, net.input_h))
+    segments = {} # attached segments by name, oldest first
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+        name, layout, thresh, nms = message
+        buffer = images = None
+        try:
+            # a batch whose segment cannot be opened fails on its own, rather than taking the worker down
+            if name not in segments:
+                segments[name] = shared_memory.SharedMemory(name=name)
+                while len(segments) > 8: # segments are replaced as they grow, let go of old ones
+                    segments.pop(next(iter(segments))).close()
+            buffer = segments[name].buf
+            images = [np.ndarray((h, w, 3), dtype=np.uint8, buffer=buffer, offset=offset) for offset, h, w in layout]
+            img_in = net.preprocess(images)
+            try:
+                outputs = net.infer(img_in)
+            finally:
+                net.release_input(img_in)
+            # boxes are returned as fractions of each image, the app scales them to its image sizes
+            detections = net.postprocess(outputs, [(1, 1)] * len(images), thresh, nms)
+            conn.send(('done', detections, net.max_confidences(outputs), getattr(outputs, 'escalated', None)))
+        except Exception as e:
+            conn.send(('error', repr(e)))
+        finally:
+            buffer = images = None
+
+class _Worker:
+    """A worker process and the pipe to it."""
+
+    def __init__(self, context, loader: Callable[[], Any], index: int):
+        self.context = context
+        self.loader = loader
+        self.index = index
+        self.process = None
+        self.conn = None
+
+    def start(self) -> None:
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=_worker_main, args=(child_conn, self.loader),
+                                            name=f"print-detect-inference-{self.index}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def wait_ready(self, timeout: float) -> Tuple[int, int]:
+        """
+        Wait for the worker to load the net.
+
+        Raises:
+            RuntimeError: Raised if the net failed to load or did not load within the timeout.
+
+        Returns:
+            Tuple[int, int]: The (width, height) of the model input.
+        """
+        try:
+            if not self.conn.poll(timeout):
+                raise RuntimeError(f"Inference worker {self.index} did not load the model within {timeout:g} seconds")
+            message = self.conn.recv()
+        except (EOFError, OSError):
+            raise RuntimeError(f"Inference worker {self.index} exited while loading the model (exit code {self.process.exitcode})")
+        if message[0] != 'ready':
+            raise RuntimeError(f"Inference worker {self.index} failed to load the model: {message[1]}")
+        return message[1], message[2]
+
+    def stop(self) -> None:
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(1.0)
+        self.conn.close()
+        self.process = None
+
+class InferenceWorkerPool:
+    """
+    Runs a net in a pool of worker processes, each loading its own copy with the loader (which must be picklable).
+    It has the same preprocess, release_input, infer, postprocess and max_confidences interface as OnnxNet for the detection pipeline:
+    preprocess copies the images into a shared memory segment, and infer splits the batch between the idle workers.
+    The detection threshold and NMS are fixed when the pool is created, as the workers apply them.
+    Workers that crash, hang past the timeout or lose their pipe are restarted by a supervisor thread.
+    """
+
+    # released segments kept for reuse: enough for one being written, one waiting for inference and one being inferred,
+    # as with OnnxNet.input_buffers
+    input_slots = 3
+
+    def __init__(self, loader: Callable[[], Any], workers: int = 1, thresh: float = 0.25, nms: float = 0.4,
+                 timeout: float = 30.0, start_timeout: float = 300.0, restart_backoff: float = 5.0):
+        self.thresh = thresh
+        self.nms = nms
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.restart_backoff = restart_backoff
+        self.restarts = 0
+        self._closed = False
+        self._idle = queue.Queue()
+        self._broken = queue.Queue()
+        self._segments_lock = threading.Lock()
+        self._segments: Dict[str, shared_memory.SharedMemory] = {} # every segment by name, freed on close
+        self._free: List[shared_memory.SharedMemory] = [] # released segments, named by no queued or running input
+
+        # spawn rather than fork, as forking a process running threads (AppDaemon) is unsafe
+        context = multiprocessing.get_context('spawn')
+        self.workers = [_Worker(context, loader, index) for index in range(max(workers, 1))]
+        try:
+            for worker in self.workers:
+                worker.start()
+            for worker in self.workers:
+                self.input_w, self.input_h = worker.wait_ready(start_timeout)
+                self._idle.put(worker)
+        except Exception:
+            self.close()
+            raise
+        self._supervisor = threading.Thread(target=self._supervise, name="print-detect-inference-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def preprocess(self, images: List[np.ndarray]) -> RemoteInput:
+        """
+        Copy images into a released shared memory segment, or a new one if none is free or large enough for the batch.
+        The segment belongs to the returned input until it is handed back with release_input.
+        """
+        sizes = [-(-image.shape[0] * image.shape[1] * 3 // ALIGNMENT) * ALIGNMENT for image in images]
+        size = max(sum(sizes), ALIGNMENT)
+        with self._segments_lock:
+            index = next((i for i, free in enumerate(self._free) if free.size >= size), None)
+            segment = self._free.pop(index) if index is not None else None
+            # too small for the batch, and free so no input names it, replaced by a larger one
+            smaller = self._free.pop() if segment is None and self._free else None
+        if smaller is not None:
+            self._release_segment(smaller)
+        if segment is None:
+            segment = shared_memory.SharedMemory(create=True, size=size)
+            with self._segments_lock:
+                self._segments[segment.name] = segment
+
+        layout = []
+        offset = 0
+        for image, size in zip(images, sizes):
+            target = np.ndarray((image.shape[0], image.shape[1], 3), dtype=np.uint8, buffer=segment.buf, offset=offset)
+            np.copyto(target, image)
+            del target
+            layout.append((offset, image.shape[0], image.shape[1]))
+            offset += size
+        return RemoteInput(segment.name, layout)
+
+    def release_input(self, remote_input: RemoteInput) -> None:
+        """Hand back the segment of an input from preprocess once it has been inferred or dropped, so it can be reused or freed."""
+        with self._segments_lock:
+            segment = self._segments.get(remote_input.segment)
+            if segment is None or any(free is segment for free in self._free):
+                return
+            if len(self._free) < InferenceWorkerPool.input_slots:
+                self._free.append(segment)
+                return
+        self._release_segment(segment)
+
+    def infer(self, remote_input: RemoteInput) -> RemoteOutputs:
+        """
+        Run a batch on the workers, splitting it between as many idle workers as there are images.
+
+        Raises:
+            RuntimeError: Raised if no worker became idle within the timeout, or a worker failed on the batch.
+        """
+        try:
+            workers = [self._idle.get(timeout=self.timeout)]
+        except queue.Empty:
+            raise RuntimeError(f"No inference worker became available within {self.timeout:g} seconds")
+        while len(workers) < len(remote_input.layout):
+            try:
+                workers.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        chunks = [chunk.tolist() for chunk in np.array_split(np.arange(len(remote_input.layout)), len(workers))]
+
+        failed = {}
+        for worker, chunk in zip(workers, chunks):
+            try:
+                worker.conn.send((remote_input.segment, [remote_input.layout[i] for i in chunk], self.thresh, self.nms))
+            except (OSError, ValueError) as e:
+                failed[worker.index] = f"pipe closed ({e})"
+        results = []
+        error = None
+        for worker in workers:
+            message = None
+            if worker.index not in failed:
+                try:
+                    if worker.conn.poll(self.timeout):
+                        message = worker.conn.recv()
+                    else:
+                        failed[worker.index] = f"no result within {self.timeout:g} seconds"
+                except (EOFError, OSError) as e:
+                    failed[worker.index] = f"process exited ({e})"
+            if worker.index in failed:
+                error = error or RuntimeError(f"Inference worker {worker.index} failed: {failed[worker.index]}, restarting it")
+                self._broken.put(worker)
+                continue
+            if message[0] == 'error':
+                error = error or RuntimeError(f"Inference worker {worker.index} failed on the batch: {message[1]}")
+            results.append(message)
+            self._idle.put(worker)
+        if error is not None:
+            raise error
+
+        escalated = [message[3] for message in results]
+        return RemoteOutputs(detections=[detections for message in results for detections in message[1]],
+                             confidences=np.concatenate([message[2] for message in results]),
+                             escalated=np.concatenate(escalated) if all(e is not None for e in escalated) else None)
+
+    def postprocess(self, outputs: RemoteOutputs, image_sizes, thresh=None, nms=None) -> List[np.ndarray]:
+        """Scale the detections of each image to its (height, width). The threshold and NMS were applied by the workers."""
+        detections = []
+        for image_detections, (height, width) in zip(outputs.detections, image_sizes):
+            image_detections = image_detections.copy()
+            image_detections['xc'] *= width
+            image_detections['w'] *= width
+            image_detections['yc'] *= height
+            image_detections['h'] *= height
+            detections.append(image_detections)
+        return detections
+
+    def max_confidences(self, outputs: RemoteOutputs) -> np.ndarray:
+        return outputs.confidences
+
+    def _supervise(self) -> None:
+        """Restart broken workers, retrying after the backoff until the worker loads the model again."""
+        while True:
+            worker = self._broken.get()
+            if worker is None or self._closed:
+                return
+            worker.stop()
+            try:
+                worker.start()
+                worker.wait_ready(self.start_timeout)
+            except Exception as e:
+                print(f"Failed to restart inference worker {worker.index}, retrying in {self.restart_backoff:g} seconds - {e}")
+                time.sleep(self.restart_backoff)
+                self._broken.put(worker)
+                continue
+            self.restarts += 1
+            self._idle.put(worker)
+
+    def _release_segment(self, segment: shared_memory.SharedMemory) -> None:
+        """Free a segment that no queued or running input names."""
+        with self._segments_lock:
+            self._segments.pop(segment.name, None)
+        segment.close()
+        segment.unlink()
+
+    def close(self) -> None:
+        """Stop the workers and free the shared memory."""
+        self._closed = True
+        self._broken.put(None)
+        for worker in self.workers:
+            worker.stop()
+        with self._segments_lock:
+            segments, self._segments, self._free = list(self._segments.values()), {}, []
+        for segment in segments:
+            segment.close()
+            segment.unlink()
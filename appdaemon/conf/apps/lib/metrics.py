@@ -0,0 +1,192 @@
+'''
+The code is used to record how long each stage of the detection takes and how often cycles are skipped or fail,
+and to expose the figures as Home Assistant sensors and in the Prometheus text format.
+'''
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+import bisect
+import threading
+
+# upper bounds of the latency buckets in seconds, from a millisecond to ten seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """
+    A histogram with fixed buckets, allocated once. Recording a value only increments a bucket count, so it is cheap enough
+    for the hot path, and percentiles are estimated from the buckets.
+    """
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1) # the last bucket holds values above the largest bound
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        """A consistent copy of the bucket counts, sum and count."""
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile by interpolating within the bucket it falls in, as Prometheus does.
+
+        Args:
+            q (float): The quantile, 0-1.
+
+        Returns:
+            float: The estimated value, or 0 if nothing has been recorded.
+        """
+        counts, _, count = self.snapshot()
+        if count == 0:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count > 0:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                return lower + (self.bounds[index] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.bounds[-1]
+
+class Metrics:
+    """
+    The metrics of one app: a latency histogram per stage, counters incremented as events happen,
+    and gauges and counters read from a callback when published.
+    """
+
+    STAGES = ('fetch', 'decode', 'preprocess', 'inference', 'postprocess', 'notification', 'cycle')
+
+    def __init__(self, namespace: str = 'print_detect'):
+        self.namespace = namespace
+        self.stages: Dict[str, Histogram] = {stage: Histogram() for stage in Metrics.STAGES}
+        self.counters: Dict[str, int] = {}
+        self.help: Dict[str, str] = {}
+        self.callbacks: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record how long a stage took."""
+        self.stages[stage].observe(seconds)
+
+    def counter(self, name: str, help: str) -> None:
+        """Declare a counter, so it is published as 0 before it is first incremented."""
+        self.counters.setdefault(name, 0)
+        self.help[name] = help
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def register(self, name: str, kind: str, help: str, read: Callable[[], float]) -> None:
+        """
+        Register a metric read from a callback when published.
+
+        Args:
+            name (str): The metric name, without the namespace.
+            kind (str): The Prometheus type, gauge or counter.
+            help (str): A description of the metric.
+            read (Callable[[], float]): Reads the current value.
+        """
+        self.callbacks[name] = (kind, read)
+        self.help[name] = help
+
+    def values(self) -> Iterator[Tuple[str, str, float]]:
+        """The current counters and callback metrics as (name, kind, value)."""
+        with self._lock:
+            counters = dict(self.counters)
+        for name, value in counters.items():
+            yield name, 'counter', value
+        for name, (kind, read) in self.callbacks.items():
+            yield name, kind, read()
+
+    def sensor_states(self) -> Iterator[Tuple[str, float, dict]]:
+        """
+        The metrics as Home Assistant sensor states: the median time of each stage that has run in milliseconds,
+        with other percentiles as attributes, followed by the counters and gauges.
+
+        Returns:
+            Iterator[Tuple[str, float, dict]]: The object id suffix, state and attributes of each sensor.
+        """
+        for stage, histogram in self.stages.items():
+            _, total, count = histogram.snapshot()
+            if count == 0:
+                continue
+            yield f"{stage}_time", round(histogram.quantile(0.5) * 1000, 1), {
+                "unit_of_measurement": "ms",
+                "friendly_name": f"Print Detect {stage} time",
+                "p95": round(histogram.quantile(0.95) * 1000, 1),
+                "p99": round(histogram.quantile(0.99) * 1000, 1),
+                "mean": round(total / count * 1000, 1),
+                "count": count,
+            }
+        for name, kind, value in self.values():
+            yield name, value, {
+                "friendly_name": f"Print Detect {name.replace('_', ' ')}",
+                "state_class": "total_increasing" if kind == 'counter' else "measurement",
+            }
+
+    def render_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        name = f"{self.namespace}_stage_duration_seconds"
+        lines = [f"# HELP {name} Time taken by each stage of the detection.", f"# TYPE {name} histogram"]
+        for stage, histogram in self.stages.items():
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.bounds + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+        for metric, kind, value in self.values():
+            full_name = f"{self.namespace}_{metric}" + ("_total" if kind == 'counter' else "")
+            lines.append(f"# HELP {full_name} {self.help.get(metric, metric)}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            lines.append(f"{full_name} {value}")
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Serves the metrics in the Prometheus text format at /metrics from a background thread."""
+
+    def __init__(self, metrics: Metrics, host: str, port: int):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # scrapes are not worth a log line each
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="print-detect-metrics", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,142 @@
+'''
+The code is used to load the machine learning model only while it is needed: in the background when a printer starts printing or warming up,
+releasing it again once the printers have been idle for a while. Loaded models are shared between all apps in the AppDaemon process.
+'''
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Optional
+import threading
+import time
+
+@dataclass
+class _CachedModel:
+    lock: threading.Lock = field(default_factory=threading.Lock) # held while the model loads, so it is only loaded once
+    net: Any = None
+    references: int = 0
+
+class SharedModelCache:
+    """
+    Reference counted models, keyed by the files and settings they were loaded with.
+    Apps asking for a model that is already loaded share the loaded copy, and the model is dropped once every app has released it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[Hashable, _CachedModel] = {}
+
+    def acquire(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Get a model, loading it if no app holds it yet. Each call must be matched by a call to release.
+
+        Args:
+            key (Hashable): Identifies the model.
+            loader (Callable[[], Any]): Loads the model if it is not loaded.
+
+        Returns:
+            Any: The model.
+        """
+        with self._lock:
+            model = self._models.setdefault(key, _CachedModel())
+            model.references += 1
+        try:
+            with model.lock:
+                if model.net is None:
+                    model.net = loader()
+                return model.net
+        except Exception:
+            self.release(key)
+            raise
+
+    def release(self, key: Hashable) -> None:
+        """Release a model acquired with acquire, dropping it once it has no references left (closing it if it can be closed)."""
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                return
+            model.references -= 1
+            if model.references > 0:
+                return
+            del self._models[key]
+        close = getattr(model.net, 'close', None)
+        if close is not None:
+            close()
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+shared_models = SharedModelCache() # shared by every app, as AppDaemon runs them in one process
+
+class LazyModel:
+    """
+    A model of one app that is loaded on a background thread the first time it is requested, until the app releases it.
+    A failed load is retried on a request at least `retry_after` seconds later.
+    """
+
+    def __init__(self, key: Hashable, loader: Callable[[], Any], retry_after: float = 60.0,
+                 cache: SharedModelCache = shared_models, log: Callable[[str], None] = print):
+        self.key = key
+        self.loader = loader
+        self.retry_after = retry_after
+        self.cache = cache
+        self.log = log
+        self.net: Any = None
+        self._lock = threading.Lock()
+        self._loading: Optional[threading.Thread] = None
+        self._failed_at: Optional[float] = None
+        self._wanted = False # cleared by release, so a load that finishes afterwards is released straight away
+
+    def load(self) -> Any:
+        """Load the model on the calling thread, waiting for it."""
+        with self._lock:
+            self._wanted = True
+        self._load()
+        return self.net
+
+    def request(self) -> Optional[Any]:
+        """
+        Get the model if it is loaded, starting to load it in the background if it is not.
+
+        Returns:
+            Optional[Any]: The model, or None while it is loading.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._wanted = True
+            if self.net is not None or self._loading is not None:
+                return self.net
+            if self._failed_at is not None and now - self._failed_at < self.retry_after:
+                return None
+            self._loading = threading.Thread(target=self._load, name="print-detect-model-loader", daemon=True)
+            self._loading.start()
+        return None
+
+    def _load(self) -> None:
+        try:
+            started = time.monotonic()
+            net = self.cache.acquire(self.key, self.loader)
+        except Exception as e:
+            with self._lock:
+                self._loading = None
+                self._failed_at = time.monotonic()
+            self.log(f"Failed to load the model, retrying in {self.retry_after:g} seconds: {e}")
+            return
+        with self._lock:
+            self._loading = None
+            self._failed_at = None
+            if not self._wanted or self.net is not None:
+                self.cache.release(self.key)
+                return
+            self.net = net
+        self.log(f"Loaded the model in {time.monotonic() - started:.1f} seconds")
+
+    @property
+    def loaded(self) -> bool:
+        return self.net is not None
+
+    def release(self) -> None:
+        """Release the model. Work already holding a reference to it can finish with it."""
+        with self._lock:
+            self._wanted = False
+            net, self.net = self.net, None
+        if net is not None:
+            self.cache.release(self.key)
@@ -2,82 +2,200 @@
 This file is adapted from the opico-server project (formally known as Spaghetti Detective).
 Link: https://github.com/TheSpaghettiDetective/obico-server/tree/release
 
-The code is used to run the machine learning model onnx file and detect print issues in an image.
+The code is used to run the machine learning model onnx file and detect print issues in an image,
+on the inference backend picked for the host (see backends.py).
 '''
 
-from typing import List, Tuple
-import onnxruntime
+from typing import List, Optional, Tuple
+import copy
 import numpy as np
-import cv2
 
+from lib.backends import REFERENCE_BACKEND, InferenceBackend, OnnxRuntimeBackend, select_backend
 from lib.meta import Meta
+from lib.preprocess import Preprocessor
+from lib.runtime import RuntimeConfig
+
+# a detection as held in the arrays returned by post_processing, the box is (x centre, y centre, width, height) in image pixels
+DETECTION_DTYPE = np.dtype([('xc', np.float32), ('yc', np.float32), ('w', np.float32), ('h', np.float32),
+                            ('confidence', np.float32), ('class_id', np.int32)])
 
 class OnnxNet:
-    session: onnxruntime.InferenceSession
+    backend: InferenceBackend
     meta: Meta
+    preprocessor: Preprocessor
 
-    def __init__(self, onnx_path: str, meta_path: str, use_gpu: bool):
-        providers = ['CPUExecutionProvider']
-        self.session = onnxruntime.InferenceSession(onnx_path, providers=providers)
-        self.meta = Meta(meta_path)
-
-    def detect(self, meta, image, alt_names, thresh=.5, hier_thresh=.5, nms=.45, debug=False) -> List[Tuple[str, float, Tuple[float, float, float, float]]]:
-        input_h = self.session.get_inputs()[0].shape[2]
-        input_w = self.session.get_inputs()[0].shape[3]
-        width = image.shape[1]
-        height = image.shape[0]
+    # released input batches kept for reuse: enough for one being prepared, one waiting for inference and one being inferred
+    input_buffers = 3
 
-        # Input
-        resized = cv2.resize(image, (input_w, input_h), interpolation=cv2.INTER_LINEAR)
-        img_in = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-        img_in = np.transpose(img_in, (2, 0, 1)).astype(np.float32)
-        img_in = np.expand_dims(img_in, axis=0)
-        img_in /= 255.0
-
-        input_name = self.session.get_inputs()[0].name
-        outputs = self.session.run(None, {input_name: img_in})
+    def __init__(self, onnx_path: str, meta_path: str, use_gpu: bool, runtime: Optional[RuntimeConfig] = None,
+                 input_size: Optional[Tuple[int, int]] = None):
+        runtime = runtime or RuntimeConfig()
+        # onnxruntime on the CPU reads the model's input shape and is the reference the other backends are checked against
+        reference = OnnxRuntimeBackend(REFERENCE_BACKEND, onnx_path, runtime)
+        self.meta = Meta(meta_path)
 
-        detections = post_processing(outputs, width, height, thresh, nms, meta.names)
-        return detections[0]
+        input_shape = reference.input_shape
+        self.input_name = reference.input_name
+        self.input_h = input_shape[2]
+        self.input_w = input_shape[3]
+        # models exported with a dynamic input size are run at the given (width, height), by default 416x416
+        self.dynamic_size = not isinstance(self.input_h, int) or not isinstance(self.input_w, int)
+        if self.dynamic_size:
+            self.input_w, self.input_h = input_size or (416, 416)
+        # models exported with a fixed batch dimension are run in chunks of that size
+        self.max_batch = input_shape[0] if isinstance(input_shape[0], int) else None
+        self.preprocessor = Preprocessor(self.input_w, self.input_h, buffers=OnnxNet.input_buffers)
+        channels = input_shape[1] if isinstance(input_shape[1], int) else 3
+        img_in = np.random.default_rng(0).random((self.max_batch or 1, channels, self.input_h, self.input_w), dtype=np.float32)
+        self.backend = select_backend(onnx_path, runtime, reference, img_in, use_gpu)
+        if runtime.quantized:
+            if isinstance(self.backend, OnnxRuntimeBackend):
+                self.backend.load_quantized(onnx_path, runtime)
+            else:
+                print(f'The int8 quantized model is only run with onnxruntime, using the original model on the {self.backend.name} backend')
+
+    def resized(self, input_w: int, input_h: int) -> 'OnnxNet':
+        """
+        Get a copy of the net that runs the same session at another input size, for models exported with a dynamic input size.
+
+        Raises:
+            ValueError: Raised if the model has a fixed input size.
+        """
+        if not self.dynamic_size:
+            raise ValueError(f"The model has a fixed input size of {self.input_w}x{self.input_h}")
+        net = copy.copy(self)
+        net.input_w, net.input_h = input_w, input_h
+        net.preprocessor = Preprocessor(input_w, input_h, buffers=OnnxNet.input_buffers)
+        return net
 
+    def detect(self, meta, image, alt_names, thresh=.5, hier_thresh=.5, nms=.45, debug=False) -> List[Tuple[str, float, Tuple[float, float, float, float]]]:
+        return self.detect_batch(meta, [image], alt_names, thresh, hier_thresh, nms, debug)[0]
+
+    def detect_batch(self, meta, images, alt_names, thresh=.5, hier_thresh=.5, nms=.45, debug=False) -> List[List[Tuple[str, float, Tuple[float, float, float, float]]]]:
+        """
+        Run the model on several images with as few forward passes as the model allows.
+        Images may differ in size, detections are scaled back to the size of the image they came from.
+        """
+        if len(images) == 0:
+            return []
+        img_in = self.preprocess(images)
+        try:
+            outputs = self.infer(img_in)
+        finally:
+            self.release_input(img_in)
+        detections = self.postprocess(outputs, [image.shape[:2] for image in images], thresh, nms)
+        return [detections_to_tuples(image_detections, meta.names) for image_detections in detections]
+
+    def preprocess(self, images) -> np.ndarray:
+        """Resize and normalise images into a single model input batch, held in a reused buffer until it is released."""
+        return self.preprocessor(images)
+
+    def release_input(self, img_in: np.ndarray) -> None:
+        """Hand back an input batch from preprocess once it has been inferred or dropped, so its buffer can be reused."""
+        self.preprocessor.release(img_in)
+
+    def infer(self, img_in: np.ndarray) -> List[np.ndarray]:
+        """
+        Run the model on an input batch.
+        Models exported with a fixed batch dimension are run in chunks of that size and the outputs joined back together.
+        """
+        max_batch = self.max_batch or len(img_in)
+        if len(img_in) <= max_batch:
+            return self.backend.run(img_in)
+        chunks = [self.backend.run(img_in[start:start + max_batch]) for start in range(0, len(img_in), max_batch)]
+        return [np.concatenate(output, axis=0) for output in zip(*chunks)]
+
+    @staticmethod
+    def postprocess(outputs, image_sizes, thresh, nms) -> List[np.ndarray]:
+        """
+        Turn the outputs for an input batch into detection arrays of DETECTION_DTYPE,
+        scaled to the (height, width) of the image each came from.
+        """
+        heights = [size[0] for size in image_sizes]
+        widths = [size[1] for size in image_sizes]
+        return post_processing(outputs, widths, heights, thresh, nms)
+
+    @staticmethod
+    def max_confidences(outputs) -> np.ndarray:
+        """The highest confidence of any box and class in each image of the outputs, including below the detection threshold."""
+        confs = outputs[1]
+        return confs.reshape(len(confs), -1).max(axis=1)
+
+
+# candidates suppressed against each other at once in nms_cpu, bounding its pairwise matrices to NMS_BLOCK x candidates
+NMS_BLOCK = 64
+
+def suppression_matrix(x1, y1, x2, y2, areas, rows, cols, nms_thresh, min_mode=False) -> np.ndarray:
+    """Whether each box in rows overlaps each box in cols by more than nms_thresh, as a len(rows) x len(cols) matrix."""
+    inter = np.minimum(x2[rows, None], x2[cols])
+    inter -= np.maximum(x1[rows, None], x1[cols])
+    np.maximum(inter, 0.0, out=inter)
+    h = np.minimum(y2[rows, None], y2[cols])
+    h -= np.maximum(y1[rows, None], y1[cols])
+    np.maximum(h, 0.0, out=h)
+    inter *= h
+
+    # inter / denominator > nms_thresh, rearranged to avoid the division
+    if min_mode:
+        denominator = np.minimum(areas[rows, None], areas[cols])
+    else:
+        denominator = areas[rows, None] + areas[cols]
+        inter *= 1.0 + nms_thresh
+    denominator *= nms_thresh
+    return inter > denominator
 
 def nms_cpu(boxes, confs, nms_thresh=0.5, min_mode=False):
-    # print(boxes.shape)
-    x1 = boxes[:, 0]
-    y1 = boxes[:, 1]
-    x2 = boxes[:, 2]
-    y2 = boxes[:, 3]
-
-    areas = (x2 - x1) * (y2 - y1)
+    """
+    Greedy non-maximum suppression of (x1, y1, x2, y2) boxes, returning the indices of the kept boxes by descending confidence.
+    The candidates are taken in blocks of NMS_BLOCK by confidence: the block is suppressed greedily using the overlaps
+    within it, then the boxes it keeps suppress all the later candidates at once, and those suppressed are dropped.
+    Overlapping candidates are mostly dropped by the first block, and memory stays bounded however many candidates there are.
+    """
     order = confs.argsort()[::-1]
+    boxes = boxes[order]
+    x1 = np.ascontiguousarray(boxes[:, 0])
+    y1 = np.ascontiguousarray(boxes[:, 1])
+    x2 = np.ascontiguousarray(boxes[:, 2])
+    y2 = np.ascontiguousarray(boxes[:, 3])
+    areas = (x2 - x1) * (y2 - y1)
 
-    keep = []
-    while order.size > 0:
-        idx_self = order[0]
-        idx_other = order[1:]
-
-        keep.append(idx_self)
-
-        xx1 = np.maximum(x1[idx_self], x1[idx_other])
-        yy1 = np.maximum(y1[idx_self], y1[idx_other])
-        xx2 = np.minimum(x2[idx_self], x2[idx_other])
-        yy2 = np.minimum(y2[idx_self], y2[idx_other])
-
-        w = np.maximum(0.0, xx2 - xx1)
-        h = np.maximum(0.0, yy2 - yy1)
-        inter = w * h
-
-        if min_mode:
-            over = inter / np.minimum(areas[order[0]], areas[order[1:]])
-        else:
-            over = inter / (areas[order[0]] + areas[order[1:]] - inter)
-
-        inds = np.where(over <= nms_thresh)[0]
-        order = order[inds + 1]
-
-    return np.array(keep)
-
-def post_processing(output, width, height, conf_thresh, nms_thresh, names):
+    remaining = np.arange(len(order))
+    kept = [remaining[:0]]
+    while len(remaining):
+        block, remaining = remaining[:NMS_BLOCK], remaining[NMS_BLOCK:]
+        suppresses = suppression_matrix(x1, y1, x2, y2, areas, block, block, nms_thresh, min_mode)
+        keep = np.ones(len(block), dtype=bool)
+        for i in range(len(block)):
+            if keep[i]:
+                keep[i + 1:] &= ~suppresses[i, i + 1:]
+        block = block[keep]
+        kept.append(block)
+        if len(remaining):
+            remaining = remaining[~suppression_matrix(x1, y1, x2, y2, areas, block, remaining, nms_thresh, min_mode).any(axis=0)]
+
+    return order[np.concatenate(kept)]
+
+def batched_nms(boxes, confs, class_ids, nms_thresh=0.5):
+    """
+    Non-maximum suppression of (x1, y1, x2, y2) boxes within each class in a single pass.
+    Boxes of each class are offset so boxes of different classes never overlap.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = class_ids.astype(boxes.dtype) * (boxes.max() - boxes.min() + 1)
+    return nms_cpu(boxes + offsets[:, None], confs, nms_thresh)
+
+def detections_to_tuples(detections, names) -> List[Tuple[str, float, Tuple[float, float, float, float]]]:
+    """Convert a detection array into (name, confidence, (xc, yc, w, h)) tuples."""
+    boxes = np.stack([detections['xc'], detections['yc'], detections['w'], detections['h']], axis=1).tolist()
+    return [(names[class_id], confidence, tuple(box)) 
+            for class_id, confidence, box in zip(detections['class_id'].tolist(), detections['confidence'].tolist(), boxes)]
+
+def post_processing(output, width, height, conf_thresh, nms_thresh):
+    """
+    Turn the model outputs into an array of DETECTION_DTYPE detections for each image in the batch.
+    The width and height may be a single size for the whole batch or a size for each image.
+    """
     box_array = output[0]
     confs = output[1]
 
@@ -85,8 +203,6 @@ def post_processing(output, width, height, conf_thresh, nms_thresh, names):
         box_array = box_array.cpu().detach().numpy()
         confs = confs.cpu().detach().numpy()
 
-    num_classes = confs.shape[2]
-
     # [batch, num, 4]
     box_array = box_array[:, :, 0]
 
@@ -94,13 +210,9 @@ def post_processing(output, width, height, conf_thresh, nms_thresh, names):
     max_conf = np.max(confs, axis=2)
     max_id = np.argmax(confs, axis=2)
 
-    box_x1x1x2y2_to_xcycwh_scaled = lambda b: \
-        (
-            float(0.5 * width * (b[0] + b[2])),
-            float(0.5 * height * (b[1] + b[3])),
-            float(width * (b[2] - b[0])),
-            float(width * (b[3] - b[1]))
-         )
+    widths = np.broadcast_to(np.asarray(width, dtype=np.float32), (box_array.shape[0],))
+    heights = np.broadcast_to(np.asarray(height, dtype=np.float32), (box_array.shape[0],))
+
     dets_batch = []
     for i in range(box_array.shape[0]):
 
@@ -109,29 +221,16 @@ def post_processing(output, width, height, conf_thresh, nms_thresh, names):
         l_max_conf = max_conf[i, argwhere]
         l_max_id = max_id[i, argwhere]
 
-        bboxes = []
-        # nms for each class
-        for j in range(num_classes):
-
-            cls_argwhere = l_max_id == j
-            ll_box_array = l_box_array[cls_argwhere, :]
-            ll_max_conf = l_max_conf[cls_argwhere]
-            ll_max_id = l_max_id[cls_argwhere]
+        keep = batched_nms(l_box_array, l_max_conf, l_max_id, nms_thresh)
+        b = l_box_array[keep]
 
-            keep = nms_cpu(ll_box_array, ll_max_conf, nms_thresh)
-
-            if (keep.size > 0):
-                ll_box_array = ll_box_array[keep, :]
-                ll_max_conf = ll_max_conf[keep]
-                ll_max_id = ll_max_id[keep]
-
-                for k in range(ll_box_array.shape[0]):
-                    bboxes.append([ll_box_array[k, 0], ll_box_array[k, 1], ll_box_array[k, 2], ll_box_array[k, 3], ll_max_conf[k], ll_max_conf[k], ll_max_id[k]])
-
-        detections = [(names[b[6]], float(b[4]), box_x1x1x2y2_to_xcycwh_scaled((b[0], b[1], b[2], b[3]))) for b in bboxes]
+        detections = np.empty(len(keep), dtype=DETECTION_DTYPE)
+        detections['xc'] = 0.5 * widths[i] * (b[:, 0] + b[:, 2])
+        detections['yc'] = 0.5 * heights[i] * (b[:, 1] + b[:, 3])
+        detections['w'] = widths[i] * (b[:, 2] - b[:, 0])
+        detections['h'] = heights[i] * (b[:, 3] - b[:, 1])
+        detections['confidence'] = l_max_conf[keep]
+        detections['class_id'] = l_max_id[keep]
         dets_batch.append(detections)
 
-
     return dets_batch
-
-
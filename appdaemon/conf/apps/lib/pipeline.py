@@ -0,0 +1,227 @@
+'''
+The code is used to run the detection off the AppDaemon worker thread as a pipeline of stages.
+Each stage runs on its own worker threads and hands its result to the next stage through a single item slot,
+so when a stage falls behind the stale item waiting for it is replaced by the newest one instead of queueing up.
+The printers of a replaced cycle are carried into the next one, so only older frames of the same printer are dropped.
+'''
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+import threading
+import time
+
+@dataclass
+class DetectionCycle:
+    """
+    The work passed through the detection pipeline for one tick: the printers being checked and what each stage produced for them.
+    The lists are kept aligned with the printers, which are dropped from the cycle when a stage fails for them.
+    The cycle owns its input batch until it is released, once inferred or when the cycle is dropped.
+    """
+    printers: List[Any]
+    net: Any = None # the model the cycle is run with, held for the whole cycle even if the app releases it meanwhile
+    reused: List[Any] = field(default_factory=list) # printers whose frame barely changed, reusing their last detections
+    reused_frames: List[bytes] = field(default_factory=list) # the frames of the reused printers
+    submitted_at: float = field(default_factory=time.monotonic)
+    frames: List[bytes] = field(default_factory=list)
+    tiles: List[List[Any]] = field(default_factory=list) # the tiles of each printer's frame run through the model
+    image_sizes: List[tuple] = field(default_factory=list) # the (height, width) of each tile in full frame pixels
+    images: List[Any] = field(default_factory=list) # the image of each tile, kept to prepare the input batch again if merged
+    input_tensor: Any = None
+    outputs: Any = None
+    detections: List[Any] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict) # the seconds each stage took for the cycle
+
+    def release_input(self) -> None:
+        """Hand the input batch back to the net, so its buffer can be reused for a later cycle."""
+        if self.input_tensor is not None:
+            self.net.release_input(self.input_tensor)
+            self.input_tensor = None
+        self.images = []
+
+    def merged(self, cycle: 'DetectionCycle') -> 'DetectionCycle':
+        """
+        Merge this cycle, waiting for a stage, into a newer cycle that has reached the same stage. The newer cycle also checks
+        the printers of this one it does not already check, with what the earlier stages produced for them, so only the older
+        frames of its own printers are dropped. The input batch is prepared again if both cycles had one.
+        A cycle for a different net (the model was reloaded meanwhile) is dropped instead.
+
+        Returns:
+            DetectionCycle: The newer cycle.
+        """
+        if self.net is not cycle.net:
+            self.release_input()
+            return cycle
+        # printers are compared by identity, as the printer dataclass compares its fields
+        checked = {id(printer) for printer in cycle.printers + cycle.reused}
+        kept = [i for i, printer in enumerate(self.printers) if id(printer) not in checked]
+        reused = [i for i, printer in enumerate(self.reused) if id(printer) not in checked]
+        cycle.reused = cycle.reused + [self.reused[i] for i in reused]
+        cycle.reused_frames = cycle.reused_frames + [self.reused_frames[i] for i in reused]
+        if kept:
+            first_tiles = [sum(len(tiles) for tiles in self.tiles[:i]) for i in range(len(self.tiles))]
+            tile_indices = [first_tiles[i] + j for i in kept if i < len(self.tiles) for j in range(len(self.tiles[i]))]
+            cycle.printers = cycle.printers + [self.printers[i] for i in kept]
+            cycle.frames = cycle.frames + [self.frames[i] for i in kept if i < len(self.frames)]
+            cycle.tiles = cycle.tiles + [self.tiles[i] for i in kept if i < len(self.tiles)]
+            cycle.image_sizes = cycle.image_sizes + [self.image_sizes[i] for i in tile_indices]
+            images = cycle.images + [self.images[i] for i in tile_indices]
+            if self.input_tensor is not None:
+                cycle.release_input()
+                cycle.images = images
+                cycle.input_tensor = cycle.net.preprocess(images)
+        cycle.submitted_at = min(cycle.submitted_at, self.submitted_at)
+        self.release_input()
+        return cycle
+
+class LatestSlot:
+    """
+    A single item hand-off between stages. Putting an item replaces any item that has not been taken yet.
+    If merge is given, the waiting item is combined into the new one with merge(waiting, new), which returns the item to keep.
+    Otherwise the waiting item is passed to on_drop (if given) once it is out of the slot.
+    """
+
+    def __init__(self, on_drop: Optional[Callable[[Any], None]] = None, merge: Optional[Callable[[Any, Any], Any]] = None):
+        self._condition = threading.Condition()
+        self._item = None
+        self._has_item = False
+        self._closed = False
+        self.on_drop = on_drop
+        self.merge = merge
+        self.dropped = 0
+
+    def put(self, item) -> bool:
+        """
+        Put an item in the slot, replacing the item waiting in it.
+
+        Returns:
+            bool: True if a waiting item was dropped or merged to make room.
+        """
+        with self._condition:
+            dropped = self._has_item
+            stale = self._item
+            if dropped:
+                self.dropped += 1
+                if self.merge is not None:
+                    item, stale = self.merge(stale, item), None
+            self._item = item
+            self._has_item = True
+            self._condition.notify()
+        if stale is not None and self.on_drop is not None:
+            self.on_drop(stale)
+        return dropped
+
+    def take(self):
+        """
+        Wait for an item and take it out of the slot.
+
+        Returns:
+            The item, or None once the slot has been closed.
+        """
+        with self._condition:
+            while not self._has_item and not self._closed:
+                self._condition.wait()
+            if not self._has_item:
+                return None
+            item = self._item
+            self._item = None
+            self._has_item = False
+            return item
+
+    @property
+    def pending(self) -> int:
+        """The number of items waiting in the slot (0 or 1)."""
+        return 1 if self._has_item else 0
+
+    def close(self) -> None:
+        """Close the slot, waking any worker waiting on it. Waiting items are discarded, passing them to on_drop."""
+        with self._condition:
+            self._closed = True
+            stale = self._item if self._has_item else None
+            self._item = None
+            self._has_item = False
+            self._condition.notify_all()
+        if stale is not None and self.on_drop is not None:
+            self.on_drop(stale)
+
+
+class PipelineStage:
+    """
+    A pipeline stage run by a bounded number of worker threads.
+    Each worker takes an item from the inbox, processes it and puts the result in the outbox.
+    Items the stage returns None for go no further.
+    """
+
+    def __init__(self, name: str, process: Callable[[Any], Any], inbox: LatestSlot, outbox: Optional[LatestSlot],
+                 on_error: Callable[[str, Exception], None], workers: int = 1):
+        self.name = name
+        self.process = process
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_error = on_error
+        self.threads = [threading.Thread(target=self._run, name=f"print-detect-{name}-{i}", daemon=True) for i in range(max(workers, 1))]
+
+    def start(self) -> None:
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self.inbox.take()
+            if item is None:
+                return
+            try:
+                result = self.process(item)
+                if result is not None and self.outbox is not None:
+                    self.outbox.put(result) # may merge it with the item waiting in the outbox
+            except Exception as e:
+                self.on_error(self.name, e)
+
+
+class DetectionPipeline:
+    """
+    The detection pipeline: frame fetch, then preprocess, then inference, then decision.
+    Submitting only hands the cycle to the fetch stage, so it never blocks the caller.
+    A cycle still waiting for the fetch, preprocess or inference stage when a newer one reaches it is merged into the newer one,
+    so each stage runs once for the printers of both. Only a cycle waiting for the decision stage is dropped, releasing its input.
+    """
+
+    STAGES = ('fetch', 'preprocess', 'inference', 'decision')
+
+    def __init__(self, fetch: Callable, preprocess: Callable, inference: Callable, decision: Callable,
+                 on_error: Callable[[str, Exception], None]):
+        self.slots = {name: LatestSlot(on_drop=DetectionCycle.release_input,
+                                       merge=None if name == 'decision' else DetectionCycle.merged)
+                      for name in DetectionPipeline.STAGES}
+        processes = dict(fetch=fetch, preprocess=preprocess, inference=inference, decision=decision)
+        self.stages = []
+        for i, name in enumerate(DetectionPipeline.STAGES):
+            outbox = self.slots[DetectionPipeline.STAGES[i + 1]] if i + 1 < len(DetectionPipeline.STAGES) else None
+            self.stages.append(PipelineStage(name, processes[name], self.slots[name], outbox, on_error))
+
+    def start(self) -> None:
+        for stage in self.stages:
+            stage.start()
+
+    def submit(self, cycle: DetectionCycle) -> bool:
+        """
+        Hand a cycle to the fetch stage.
+
+        Returns:
+            bool: True if a cycle was still waiting to be fetched, in which case it was merged into this one.
+        """
+        return self.slots['fetch'].put(cycle)
+
+    @property
+    def dropped(self) -> int:
+        """The number of cycles merged into a newer one or dropped at any stage, because the stage fell behind."""
+        return sum(slot.dropped for slot in self.slots.values())
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of cycles waiting between stages."""
+        return sum(slot.pending for slot in self.slots.values())
+
+    def stop(self) -> None:
+        """Stop the pipeline. Cycles still waiting are discarded and the workers exit after their current item."""
+        for slot in self.slots.values():
+            slot.close()
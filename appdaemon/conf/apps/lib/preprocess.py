@@ -0,0 +1,74 @@
+'''
+The code is used to prepare camera images as input for the machine learning model without allocating new arrays on each call.
+'''
+
+from typing import List
+import threading
+import numpy as np
+import cv2
+
+class Preprocessor:
+    """
+    Resizes images and writes them into a preallocated float32 model input batch in a single pass,
+    converting BGR to RGB, HWC to CHW and scaling to 0-1 on the way.
+    The input batches are allocated once and reused. A batch belongs to its caller until it is handed back with release,
+    so a batch that has been handed on (e.g. waiting for or going through inference) is never overwritten.
+    Up to `buffers` released batches are kept for reuse, and batches that are never released are left to the garbage collector.
+    The batches are shared between threads, so a net shared by several apps can be used by each app's preprocessing thread.
+    """
+    scale = np.float32(1.0 / 255.0)
+
+    def __init__(self, input_w: int, input_h: int, buffers: int = 1):
+        self.input_w = input_w
+        self.input_h = input_h
+        self.buffers = max(buffers, 1)
+        self._free: List[np.ndarray] = [] # released batches, ready to be reused
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _thread_buffers(self) -> threading.local:
+        local = self._local
+        if not hasattr(local, 'resized'):
+            local.resized = np.empty((self.input_h, self.input_w, 3), dtype=np.uint8)
+        return local
+
+    def _take_buffer(self, batch_size: int) -> np.ndarray:
+        """Take a released input batch, or allocate one if none is free or large enough for the batch."""
+        with self._lock:
+            index = next((i for i, free in enumerate(self._free) if free.shape[0] >= batch_size), None)
+            batch = self._free.pop(index) if index is not None else None
+            if batch is None and self._free:
+                self._free.pop() # too small for the batch, replaced by a larger one
+        if batch is None:
+            batch = np.empty((batch_size, 3, self.input_h, self.input_w), dtype=np.float32)
+        return batch[:batch_size]
+
+    def release(self, img_in: np.ndarray) -> None:
+        """Hand back an input batch returned by a call once it is no longer read, so later calls can reuse it."""
+        batch = img_in if img_in.base is None else img_in.base
+        if batch.shape[1:] != (3, self.input_h, self.input_w):
+            return
+        with self._lock:
+            if len(self._free) < self.buffers and not any(free is batch for free in self._free):
+                self._free.append(batch)
+
+    def __call__(self, images: List[np.ndarray]) -> np.ndarray:
+        """
+        Prepare images as one model input batch.
+
+        Args:
+            images (List[np.ndarray]): The BGR images, of any size.
+
+        Returns:
+            np.ndarray: The (batch, 3, height, width) input, a view into a reused buffer to hand back with release.
+        """
+        local = self._thread_buffers()
+        img_in = self._take_buffer(len(images))
+        for i, image in enumerate(images):
+            if image.shape[0] == self.input_h and image.shape[1] == self.input_w:
+                resized = image
+            else:
+                resized = cv2.resize(image, (self.input_w, self.input_h), dst=local.resized, interpolation=cv2.INTER_LINEAR)
+            # HWC -> CHW with the channel axis reversed for BGR -> RGB, scaled straight into the input batch
+            np.multiply(resized.transpose(2, 0, 1)[::-1], Preprocessor.scale, out=img_in[i], dtype=np.float32)
+        return img_in
@@ -0,0 +1,97 @@
+'''
+The code is used to describe a single 3D printer monitored by the PrintDetect app and hold its runtime state.
+'''
+
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+
+def parse_float(state: Any) -> Optional[float]:
+    """Parse a numeric entity state, returning None for states such as unavailable or unknown."""
+    try:
+        return float(state)
+    except (TypeError, ValueError):
+        return None
+
+@dataclass
+class Printer:
+    """
+    A monitored printer, made up of the Home Assistant entities configured for it in the config file
+    and the state the app keeps for it between detection cycles.
+    """
+    name: str
+    status_entity: str
+    printing_state: str
+    camera_entity: str
+    stop_button_entity: str
+    extruder_temp_sensor_entity: str
+    extruder_target_temp_sensor_entity: str
+    region: Tuple[float, float, float, float] = (0.0, 0.0, 1.0, 1.0) # the region of interest, as fractions of the frame (left, top, width, height)
+    stream_url: str = "" # the camera's own MJPEG or RTSP stream, used instead of Home Assistant's stream in stream mode
+
+    # the last known states of the Home Assistant entities, kept up to date by state listeners
+    printing: bool = False
+    extruder_temp: Optional[float] = None
+    extruder_target_temp: Optional[float] = None
+
+    # Home Assistant entity handles, populated by the app once it is initialised
+    printer_status: Any = None
+    print_camera: Any = None
+    stop_print_button: Any = None
+    extruder_temp_sensor: Any = None
+    extruder_target_temp_sensor: Any = None
+
+    cancel_handle: Optional[str] = None # handle for the cancel function
+    warmup_complete: bool = False # flag to check if the printer has warmed up
+    change_detector: Any = None # decides whether a frame has changed enough to run the model on
+    last_detections: Any = None # the detections from the last frame the model was run on
+    schedule: Any = None # decides how long to wait between detections
+    tracker: Any = None # follows detections across frames and scores them
+    next_due: float = 0.0 # the monotonic time the next detection is due
+    frames: Any = None # the last frames and their detections, kept in memory for the evidence of an issue
+    timelapse: Any = None # records a timelapse of the print, if enabled
+    print_id: Optional[int] = None # the id of the current print job in the detection history
+
+    @property
+    def watched_entities(self) -> List[str]:
+        """The entities whose state the app caches for this printer."""
+        entities = [self.status_entity, self.extruder_temp_sensor_entity, self.extruder_target_temp_sensor_entity]
+        return [entity for entity in entities if entity]
+
+    def update_state(self, entity: str, state: Any) -> None:
+        """
+        Update the cached state of one of the printer's entities.
+
+        Args:
+            entity (str): The entity id.
+            state (Any): The new state, as reported by Home Assistant.
+        """
+        if entity == self.status_entity:
+            self.printing = state == self.printing_state
+        elif entity == self.extruder_temp_sensor_entity:
+            self.extruder_temp = parse_float(state)
+        elif entity == self.extruder_target_temp_sensor_entity:
+            self.extruder_target_temp = parse_float(state)
+
+    @property
+    def warming(self) -> bool:
+        """Whether the extruder is still heating up, below 96% of its target temperature."""
+        if self.extruder_temp is None or self.extruder_target_temp is None:
+            return False
+        return self.extruder_temp < 0.96 * self.extruder_target_temp
+
+    @property
+    def snapshot_filename(self) -> str:
+        """The file name of the camera snapshot for this printer within the Home Assistant media directory."""
+        return f"snapshot_{self.name}.jpg"
+
+    def action(self, action: str) -> str:
+        """
+        Get the notification action identifier for this printer.
+
+        Args:
+            action (str): The action name (e.g. STOP_PRINT_JOB).
+
+        Returns:
+            str: The action identifier, routed back to this printer when received.
+        """
+        return f"{action}:{self.name}"
@@ -0,0 +1,130 @@
+'''
+The code is used to crop camera frames to the region of interest of a printer, and to split large regions into overlapping tiles
+so the model sees the print at closer to its native resolution, mapping the detections of each tile back onto the full frame.
+'''
+
+from dataclasses import dataclass
+from typing import List, Tuple
+import math
+import numpy as np
+
+from lib.onnx import DETECTION_DTYPE, batched_nms
+
+FULL_FRAME = (0.0, 0.0, 1.0, 1.0)
+
+@dataclass(frozen=True)
+class Tile:
+    """A rectangle of a camera frame run through the model as its own image, in full frame pixels."""
+    x: int
+    y: int
+    w: int
+    h: int
+
+def parse_region(text: str) -> Tuple[float, float, float, float]:
+    """
+    Parse a region of interest given as the fractions of the frame 'left, top, width, height', e.g. '0.25, 0.1, 0.5, 0.8'.
+
+    Raises:
+        ValueError: Raised if the region is malformed or does not lie within the frame.
+
+    Returns:
+        Tuple[float, float, float, float]: The region as fractions of the frame width and height.
+    """
+    parts = [float(part) for part in text.split(',')]
+    if len(parts) != 4:
+        raise ValueError(f"RegionOfInterest must be 'left, top, width, height', got '{text}'")
+    x, y, w, h = parts
+    if x < 0 or y < 0 or w <= 0 or h <= 0 or x + w > 1.0 + 1e-6 or y + h > 1.0 + 1e-6:
+        raise ValueError(f"RegionOfInterest must lie within the frame (fractions 0-1), got '{text}'")
+    return x, y, w, h
+
+def plan_tiles(frame_size: Tuple[int, int], region: Tuple[float, float, float, float], input_size: Tuple[int, int],
+               max_columns: int = 1, max_rows: int = 1, overlap: float = 0.2) -> List[Tile]:
+    """
+    Cover the region of interest of a frame with a grid of overlapping tiles.
+    A region is only split along an axis while each tile stays at least about the model input size, so tiles are never upscaled.
+
+    Args:
+        frame_size (Tuple[int, int]): The (width, height) of the full frame.
+        region (Tuple[float, float, float, float]): The region of interest, as fractions of the frame.
+        input_size (Tuple[int, int]): The (width, height) of the model input.
+        max_columns (int): The most tiles across the region.
+        max_rows (int): The most tiles down the region.
+        overlap (float): The fraction of a tile shared with its neighbour, so issues on a tile edge are seen whole by one tile.
+
+    Returns:
+        List[Tile]: The tiles, row by row.
+    """
+    frame_w, frame_h = frame_size
+    left, top = region[0] * frame_w, region[1] * frame_h
+    width, height = region[2] * frame_w, region[3] * frame_h
+
+    def split(length: float, input_length: int, max_tiles: int) -> List[Tuple[int, int]]:
+        count = 1
+        while count < max_tiles and length / (count + 1 - count * overlap) >= input_length:
+            count += 1
+        tile_length = length / (count - (count - 1) * overlap)
+        step = tile_length * (1.0 - overlap)
+        return [(int(round(i * step)), int(round(tile_length))) for i in range(count)]
+
+    tiles = []
+    for row_offset, h in split(height, input_size[1], max_rows):
+        for column_offset, w in split(width, input_size[0], max_columns):
+            x = min(int(round(left)) + column_offset, frame_w - 1)
+            y = min(int(round(top)) + row_offset, frame_h - 1)
+            tiles.append(Tile(x, y, max(1, min(w, frame_w - x)), max(1, min(h, frame_h - y))))
+    return tiles
+
+def min_decode_size(frame_size: Tuple[int, int], tiles: List[Tile], input_size: Tuple[int, int]) -> Tuple[int, int]:
+    """
+    The smallest (width, height) the full frame can be decoded at while every tile is still at least the model input size.
+    """
+    smallest_w = min(tile.w for tile in tiles)
+    smallest_h = min(tile.h for tile in tiles)
+    return (min(frame_size[0], math.ceil(frame_size[0] * input_size[0] / smallest_w)),
+            min(frame_size[1], math.ceil(frame_size[1] * input_size[1] / smallest_h)))
+
+def crop(image: np.ndarray, tile: Tile, frame_size: Tuple[int, int]) -> np.ndarray:
+    """
+    Crop a tile out of a decoded frame, which may have been decoded at a reduced size.
+
+    Returns:
+        np.ndarray: The tile, a view into the image.
+    """
+    scale_x = image.shape[1] / frame_size[0]
+    scale_y = image.shape[0] / frame_size[1]
+    x0, y0 = int(tile.x * scale_x), int(tile.y * scale_y)
+    x1 = max(x0 + 1, min(image.shape[1], int(round((tile.x + tile.w) * scale_x))))
+    y1 = max(y0 + 1, min(image.shape[0], int(round((tile.y + tile.h) * scale_y))))
+    return image[y0:y1, x0:x1]
+
+def region_tile(frame_size: Tuple[int, int], region: Tuple[float, float, float, float]) -> Tile:
+    """The whole region of interest as a single tile."""
+    return Tile(int(round(region[0] * frame_size[0])), int(round(region[1] * frame_size[1])),
+                max(1, int(round(region[2] * frame_size[0]))), max(1, int(round(region[3] * frame_size[1]))))
+
+def merge_tile_detections(tile_detections: List[np.ndarray], tiles: List[Tile], nms_thresh: float) -> np.ndarray:
+    """
+    Move the detections of each tile into full frame coordinates and join them,
+    suppressing duplicates of an issue seen by more than one overlapping tile.
+
+    Args:
+        tile_detections (List[np.ndarray]): The DETECTION_DTYPE detections of each tile, in that tile's pixels.
+        tiles (List[Tile]): The tiles.
+        nms_thresh (float): The intersection over union above which overlapping boxes of the same class are duplicates.
+
+    Returns:
+        np.ndarray: The DETECTION_DTYPE detections in full frame pixels.
+    """
+    if len(tiles) == 1:
+        detections = tile_detections[0].copy()
+        detections['xc'] += tiles[0].x
+        detections['yc'] += tiles[0].y
+        return detections
+    detections = np.concatenate(tile_detections) if tile_detections else np.empty(0, dtype=DETECTION_DTYPE)
+    detections['xc'] += np.repeat(np.array([tile.x for tile in tiles], dtype=np.float32), [len(d) for d in tile_detections])
+    detections['yc'] += np.repeat(np.array([tile.y for tile in tiles], dtype=np.float32), [len(d) for d in tile_detections])
+    boxes = np.stack([detections['xc'] - detections['w'] / 2, detections['yc'] - detections['h'] / 2,
+                      detections['xc'] + detections['w'] / 2, detections['yc'] + detections['h'] / 2], axis=1)
+    keep = batched_nms(boxes, detections['confidence'], detections['class_id'], nms_thresh)
+    return detections[keep]
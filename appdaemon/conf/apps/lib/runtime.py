@@ -0,0 +1,213 @@
+'''
+The code is used to create the onnxruntime session for the machine learning model: tuning its threading and graph optimisations,
+caching the optimised model on disk so later starts skip optimisation, and optionally swapping in an int8 quantized model
+once it has been checked to give the same results as the original.
+'''
+
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+import os
+import platform
+import tempfile
+import numpy as np
+import onnxruntime
+
+EXECUTION_MODES = {
+    'sequential': onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+@dataclass(frozen=True)
+class RuntimeConfig:
+    """How the inference backend for the model is picked and how its onnxruntime session is created."""
+    intra_op_threads: int = 0 # 0 lets onnxruntime decide
+    inter_op_threads: int = 0 # 0 lets onnxruntime decide
+    execution_mode: str = 'sequential'
+    graph_optimization_level: str = 'all'
+    cache_dir: Optional[str] = None # where optimised and quantized models are kept, None to disable caching
+    quantized: bool = False # use an int8 quantized model if it passes the self-check
+    quantized_weights: Optional[str] = None # a quantized model to use, generated from the original if it does not exist
+    quantized_tolerance: float = 0.05 # the largest difference in confidence from the original model the self-check allows
+    backends: Tuple[str, ...] = () # the inference backends to pick from, empty for every backend available on the host
+    use_gpu: bool = False # whether backends that run on a GPU may be picked
+    backend_tolerance: float = 0.001 # the largest difference in outputs from onnxruntime on the CPU a backend may have
+    backend_benchmark_runs: int = 10 # how many runs each backend is timed over when picking the fastest
+
+    def __post_init__(self):
+        if self.execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode {self.execution_mode}, expected one of {', '.join(EXECUTION_MODES)}")
+        if self.graph_optimization_level not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Unknown graph optimization level {self.graph_optimization_level}, expected one of {', '.join(GRAPH_OPTIMIZATION_LEVELS)}")
+
+    def session_options(self) -> onnxruntime.SessionOptions:
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.execution_mode = EXECUTION_MODES[self.execution_mode]
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization_level]
+        return options
+
+def cached_model_path(onnx_path: str, providers: List[str], config: RuntimeConfig) -> str:
+    """
+    Get the path of the cached optimised model for a model file.
+    Optimised models can contain hardware specific operators, so the path is specific to the model file, the onnxruntime version,
+    the optimisation level, the providers and the machine.
+    """
+    stat = os.stat(onnx_path)
+    name = os.path.splitext(os.path.basename(onnx_path))[0]
+    key = '-'.join([name, f'{stat.st_size:x}', f'{int(stat.st_mtime):x}', onnxruntime.__version__, config.graph_optimization_level,
+                    platform.machine(), '+'.join(provider.replace('ExecutionProvider', '') for provider in providers)])
+    return os.path.join(config.cache_dir, f'{key}.optimized.onnx')
+
+def create_session(onnx_path: str, providers: List[str], config: RuntimeConfig) -> onnxruntime.InferenceSession:
+    """
+    Create an onnxruntime session for a model. If a cache directory is configured, the optimised model is saved there
+    the first time and loaded as is on later starts, skipping graph optimisation.
+
+    Args:
+        onnx_path (str): The model file.
+        providers (List[str]): The onnxruntime execution providers, in order of preference.
+        config (RuntimeConfig): How to create the session.
+
+    Returns:
+        onnxruntime.InferenceSession: The session.
+    """
+    options = config.session_options()
+    if not config.cache_dir or config.graph_optimization_level == 'disable':
+        return onnxruntime.InferenceSession(onnx_path, sess_options=options, providers=providers)
+
+    cached_path = cached_model_path(onnx_path, providers, config)
+    if os.path.exists(cached_path):
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            session = onnxruntime.InferenceSession(cached_path, sess_options=options, providers=providers)
+            print(f'Loaded cached optimized model: {cached_path}')
+            return session
+        except Exception as e:
+            print(f'Failed to load cached optimized model {cached_path}, optimizing again - {e}')
+            remove_quietly(cached_path)
+            options = config.session_options()
+
+    os.makedirs(config.cache_dir, exist_ok=True)
+    # each writer saves to its own file, so worker processes and apps starting at once never write the same file
+    partial_path = temporary_path(cached_path)
+    options.optimized_model_filepath = partial_path
+    try:
+        session = onnxruntime.InferenceSession(onnx_path, sess_options=options, providers=providers)
+        if promote(partial_path, cached_path):
+            print(f'Saved optimized model: {cached_path}')
+    finally:
+        remove_quietly(partial_path)
+    return session
+
+def temporary_path(path: str) -> str:
+    """Create an empty file next to a path with a name unique to the caller, to write to before moving it into place."""
+    directory, name = os.path.split(path)
+    fd, partial_path = tempfile.mkstemp(prefix=f'{name}.', suffix='.partial', dir=directory or '.')
+    os.close(fd)
+    return partial_path
+
+def promote(partial_path: str, path: str) -> bool:
+    """
+    Move a fully written file into place. The move is atomic, so readers only ever see a whole file,
+    and if several writers race the last one wins.
+
+    Returns:
+        bool: Whether the file was moved, False if nothing was written to it or the move failed.
+    """
+    try:
+        if os.path.getsize(partial_path) == 0:
+            return False
+        os.replace(partial_path, path)
+        return True
+    except OSError as e:
+        print(f'Failed to save {path}, it will be generated again next time - {e}')
+        return False
+
+def remove_quietly(path: str) -> None:
+    """Remove a file if it still exists, as another process may already have removed or replaced it."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def quantized_model_path(onnx_path: str, config: RuntimeConfig) -> str:
+    """
+    Get the int8 quantized model for a model file, generating it with dynamic quantization if it does not exist.
+    Generating the model requires the onnx package.
+
+    Returns:
+        str: The path of the quantized model.
+    """
+    if config.quantized_weights:
+        path = config.quantized_weights
+    else:
+        name = os.path.splitext(os.path.basename(onnx_path))[0]
+        path = os.path.join(config.cache_dir or os.path.dirname(onnx_path), f'{name}.int8.onnx')
+    if os.path.exists(path):
+        return path
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    print(f'Generating int8 quantized model: {path}')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    partial_path = temporary_path(path)
+    try:
+        quantize_dynamic(onnx_path, partial_path, weight_type=QuantType.QUInt8)
+        promote(partial_path, path)
+    finally:
+        remove_quietly(partial_path)
+    return path
+
+# the confidence the original model must give a box for a frame to be used for the int8 self-check,
+# as a detector gives near zero confidence everywhere on a frame with nothing in it and any model would pass on it
+QUANTIZED_CHECK_CONFIDENCE = 0.1
+
+def create_quantized_session(onnx_path: str, providers: List[str], config: RuntimeConfig) -> Optional[onnxruntime.InferenceSession]:
+    """
+    Create a session for the int8 quantized variant of a model, to be checked with quantized_difference before it is used.
+
+    Args:
+        onnx_path (str): The original model file.
+        providers (List[str]): The onnxruntime execution providers, in order of preference.
+        config (RuntimeConfig): How to create the session.
+
+    Returns:
+        Optional[onnxruntime.InferenceSession]: The quantized session, or None if it could not be created.
+    """
+    try:
+        return create_session(quantized_model_path(onnx_path, config), providers, config)
+    except Exception as e:
+        print(f'Failed to load int8 quantized model, using the original model - {e}')
+        return None
+
+def check_candidates(confs: np.ndarray, check_confidence: float = QUANTIZED_CHECK_CONFIDENCE) -> np.ndarray:
+    """Which boxes the original model gives at least the check confidence, the ones whose coordinates the int8 self-check compares."""
+    return confs.max(axis=-1) >= check_confidence
+
+def quantized_difference(expected: List[np.ndarray], actual: List[np.ndarray],
+                         check_confidence: float = QUANTIZED_CHECK_CONFIDENCE) -> Optional[float]:
+    """
+    Compare the outputs of the original and the quantized model for the same camera frames: the confidences of every box,
+    and the coordinates of the boxes the original model gives at least the check confidence.
+
+    Args:
+        expected (List[np.ndarray]): The original model's boxes and confidences.
+        actual (List[np.ndarray]): The quantized model's boxes and confidences.
+        check_confidence (float): The confidence a box needs for its coordinates to be compared.
+
+    Returns:
+        Optional[float]: The largest absolute difference, or None if no box reaches the check confidence so the frames cannot tell.
+    """
+    expected_boxes, expected_confs = expected[0], expected[1]
+    actual_boxes, actual_confs = actual[0], actual[1]
+    candidates = check_candidates(expected_confs, check_confidence)
+    if not candidates.any():
+        return None
+    return max(float(np.max(np.abs(expected_confs - actual_confs))),
+               float(np.max(np.abs(expected_boxes[candidates] - actual_boxes[candidates]))))
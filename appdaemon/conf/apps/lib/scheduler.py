@@ -0,0 +1,64 @@
+'''
+The code is used to decide how often to run the detection on a printer, from how risky its recent frames look and the phase of the print.
+'''
+
+from typing import Optional
+
+class AdaptiveInterval:
+    """
+    The interval between detections of one printer.
+    It drops to the floor while the print is starting up (heating or the first minutes of printing) and whenever the model's
+    highest confidence reaches the risk confidence, shortens while the confidence keeps rising,
+    and backs off towards the ceiling while frames stay clean.
+    """
+
+    def __init__(self, floor: float, ceiling: float, startup_period: float, risk_confidence: float, backoff: float):
+        self.floor = floor
+        self.ceiling = max(ceiling, floor)
+        self.startup_period = startup_period
+        self.risk_confidence = risk_confidence
+        self.backoff = max(backoff, 1.0)
+        self.interval = floor
+        self.started_at: Optional[float] = None
+        self.last_confidence = 0.0
+
+    def start(self, now: float) -> None:
+        """Mark the start of a print, sampling at the floor until the startup period has passed."""
+        self.started_at = now
+        self.interval = self.floor
+        self.last_confidence = 0.0
+
+    def stop(self) -> None:
+        """Mark the end of a print."""
+        self.started_at = None
+
+    @property
+    def printing(self) -> bool:
+        return self.started_at is not None
+
+    def record(self, max_confidence: float) -> None:
+        """
+        Adjust the interval with the model's highest confidence on the latest frame, including confidences below the detection threshold.
+        """
+        if max_confidence >= self.risk_confidence:
+            self.interval = self.floor
+        elif max_confidence > self.last_confidence and max_confidence >= 0.5 * self.risk_confidence:
+            self.interval = max(self.floor, self.interval / self.backoff)
+        else:
+            self.interval = min(self.ceiling, self.interval * self.backoff)
+        self.last_confidence = max_confidence
+
+    def next_interval(self, now: float, warming: bool = False) -> float:
+        """
+        Get the time to wait before the next detection.
+
+        Args:
+            now (float): The current time in seconds.
+            warming (bool): Whether the printer is still heating up for the print.
+
+        Returns:
+            float: The interval in seconds.
+        """
+        if warming or (self.started_at is not None and now - self.started_at < self.startup_period):
+            return self.floor
+        return self.interval
@@ -0,0 +1,111 @@
+'''
+The code is used to follow detections of a printer across frames and turn them into a failure score,
+so a notification is only sent for issues that persist or grow rather than a single noisy frame.
+'''
+
+import numpy as np
+
+from lib.geometry import iou_matrix
+
+class DetectionTracker:
+    """
+    Tracks the detections of one printer across frames, matching each frame's boxes to the tracks by intersection over union.
+    Tracks are held in fixed size arrays rather than per box objects. Each track keeps a bitmask of which of the last
+    `window` frames it was matched in, and is confirmed once matched in at least `min_hits` of them.
+    Each frame scores the confidence of the confirmed tracks, weighted up by how much their box has grown since they were first seen,
+    and the failure score is an exponentially weighted average of the frame scores.
+    """
+
+    def __init__(self, window: int = 8, min_hits: int = 2, iou_threshold: float = 0.3, decay: float = 0.5,
+                 growth_weight: float = 1.0, max_tracks: int = 64):
+        self.window = min(window, 32)
+        self.min_hits = min_hits
+        self.iou_threshold = iou_threshold
+        self.decay = decay
+        self.growth_weight = growth_weight
+        self.window_mask = np.uint32((1 << self.window) - 1)
+
+        self.boxes = np.zeros((max_tracks, 4), dtype=np.float32) # (xc, yc, w, h) of the last match
+        self.confidences = np.zeros(max_tracks, dtype=np.float32) # confidence of the last match
+        self.first_areas = np.zeros(max_tracks, dtype=np.float32) # box area when first seen
+        self.history = np.zeros(max_tracks, dtype=np.uint32) # bit i set if matched i frames ago
+        self.active = np.zeros(max_tracks, dtype=bool)
+        self.score = 0.0
+
+    def reset(self) -> None:
+        """Forget all tracks and the failure score, e.g. when a new print starts."""
+        self.active[:] = False
+        self.history[:] = 0
+        self.score = 0.0
+
+    @property
+    def hits(self) -> np.ndarray:
+        """The number of frames in the window each track was matched in."""
+        history = self.history & self.window_mask
+        return np.unpackbits(history.view(np.uint8).reshape(-1, 4), axis=1).sum(axis=1)
+
+    def match(self, boxes: np.ndarray) -> np.ndarray:
+        """
+        Match boxes to the active tracks, greedily by highest intersection over union first.
+
+        Args:
+            boxes (np.ndarray): An (n, 4) array of (xc, yc, w, h) boxes.
+
+        Returns:
+            np.ndarray: The index of the track each box was matched to, or -1 if it was not matched.
+        """
+        matches = np.full(len(boxes), -1, dtype=np.int64)
+        tracks = np.flatnonzero(self.active)
+        if len(tracks) == 0 or len(boxes) == 0:
+            return matches
+        ious = iou_matrix(self.boxes[tracks], boxes)
+        track_used = np.zeros(len(tracks), dtype=bool)
+        candidates = np.argwhere(ious >= self.iou_threshold)
+        order = np.argsort(-ious[candidates[:, 0], candidates[:, 1]], kind='stable')
+        for t, b in candidates[order]:
+            if not track_used[t] and matches[b] < 0:
+                track_used[t] = True
+                matches[b] = tracks[t]
+        return matches
+
+    def update(self, detections: np.ndarray) -> float:
+        """
+        Update the tracks with the detections of a new frame.
+
+        Args:
+            detections (np.ndarray): The frame's detections, a structured array with xc, yc, w, h and confidence fields.
+
+        Returns:
+            float: The updated failure score.
+        """
+        boxes = np.stack([detections['xc'], detections['yc'], detections['w'], detections['h']], axis=1).astype(np.float32)
+        confidences = detections['confidence'].astype(np.float32)
+        matches = self.match(boxes)
+
+        self.history <<= 1
+        matched = matches >= 0
+        tracks = matches[matched]
+        self.boxes[tracks] = boxes[matched]
+        self.confidences[tracks] = confidences[matched]
+        self.history[tracks] |= 1
+
+        # start new tracks for unmatched boxes, most confident first, while there is room
+        free = np.flatnonzero(~self.active)
+        new = np.flatnonzero(~matched)
+        new = new[np.argsort(-confidences[new], kind='stable')][:len(free)]
+        slots = free[:len(new)]
+        self.boxes[slots] = boxes[new]
+        self.confidences[slots] = confidences[new]
+        self.first_areas[slots] = boxes[new, 2] * boxes[new, 3]
+        self.history[slots] = 1
+        self.active[slots] = True
+
+        # tracks not matched in the whole window are dropped
+        self.active &= (self.history & self.window_mask) != 0
+
+        confirmed = self.active & (self.hits >= self.min_hits) & ((self.history & 1) == 1)
+        areas = self.boxes[confirmed, 2] * self.boxes[confirmed, 3]
+        growth = np.clip(np.divide(areas, self.first_areas[confirmed], out=np.ones_like(areas), where=self.first_areas[confirmed] > 0) - 1.0, 0.0, 3.0)
+        frame_score = float(np.sum(self.confidences[confirmed] * (1.0 + self.growth_weight * growth)))
+        self.score = self.decay * frame_score + (1.0 - self.decay) * self.score
+        return self.score
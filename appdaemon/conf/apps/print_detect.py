@@ -1,22 +1,48 @@
 import adbase as ad
 from lib.detection_model import *
-import cv2
+from lib.printer import Printer
+from lib.frame_source import CameraProxyFrameSource, StreamingFrameSource, jpeg_size
+from lib.pipeline import DetectionCycle, DetectionPipeline
+from lib.change_detector import FrameChangeDetector
+from lib.scheduler import AdaptiveInterval
+from lib.tracker import DetectionTracker
+from lib.runtime import RuntimeConfig
+from lib.backends import parse_backends
+from lib.model_cache import LazyModel
+from lib.metrics import Metrics, MetricsServer
+from lib.inference_worker import InferenceWorkerPool
+from lib.frame_buffer import FrameRingBuffer
+from lib.evidence import Timelapse, evidence_name, write_clip, write_evidence_image
+from lib.history import DetectionHistory
+from lib.regions import Tile, crop, merge_tile_detections, min_decode_size, parse_region, plan_tiles, region_tile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 from configparser import ConfigParser
+import functools
 import requests
 import yaml
-import os
 import numpy as np
+import time
+import os
 
 class PrintDetect(ad.ADBase):
     '''
     This class is used to detect issues with a 3D print job using the machine learning model. 
-    It takes a snapshot of the print job every x seconds (5 by default) and runs the detection model on the image.
-    If an issue is detected, a notification is sent to the user with the option to stop the print job.
+    It fetches a frame of the print job from the camera every few seconds and runs the detection model on the image,
+    sampling faster while the print starts up or looks risky and backing off while it stays clean.
+    Detections are tracked across frames into a failure score, and if it passes the configured score
+    a notification is sent to the user with the option to stop the print job.
     When an error is detected, the print job will be stopped in x minutes (2 by default) if not dismissed via the notification.
+    Several printers can be monitored by one instance (fleet mode), sharing one model and running their frames as one batch.
+    The model is loaded in the background when a printer starts printing or warming up, and released after the printers have been idle for a while.
+    The printer entities are watched with state listeners, so the detection only runs while a printer is printing.
+    The last frames of each printer are kept in memory, so the frame that triggered a notification and a clip leading up to it are saved as evidence.
+    The result of every detection can be recorded in a history database, for tuning the detection settings and reviewing prints.
+    Stage timings and skipped cycles are recorded and published as Home Assistant sensors, and optionally at a Prometheus /metrics endpoint.
+    The detection runs as a pipeline of stages on its own threads so the AppDaemon worker thread is never blocked by it.
     '''
     
     def initialize(self):
-        self.cancel_handle = None # handle for the cancel function
         self.adapi = self.get_ad_api() # get the AppDaemon API
         
         # paths to the model files
@@ -24,25 +50,118 @@ class PrintDetect(ad.ADBase):
         self.model_meta = "/conf/model/model.meta"
         self.model_weights = "/conf/model/model-weights-5a6b1be1fa.onnx"
         
-        self.warmup_complete = False # flag to check if the printer has warmed up
-        
         # load all configuration file variables
         self.load_config()
         self.load_secret_values()
         
-        self.printer_status = self.adapi.get_entity(self.printer_status_entity) # get the printer status
-        self.print_camera = self.adapi.get_entity(self.printer_camera_entity) # get the camera
-        self.stop_print_button = self.adapi.get_entity(self.printer_stop_button_entity) # get the stop print button
-        self.extruder_temp_sensor = self.adapi.get_entity(self.extruder_temp_sensor_entity) # get the extruder temperature sensor
-        self.extruder_target_temp_sensor = self.adapi.get_entity(self.extruder_target_temp_sensor_entity) # get the extruder target temperature sensor
-        self.net_main_1 = load_net(self.model_cfg, self.model_meta, self.model_weights) # load the ml model
+        for printer in self.printers:
+            printer.printer_status = self.adapi.get_entity(printer.status_entity) # get the printer status
+            printer.print_camera = self.adapi.get_entity(printer.camera_entity) # get the camera
+            printer.stop_print_button = self.adapi.get_entity(printer.stop_button_entity) # get the stop print button
+            printer.extruder_temp_sensor = self.adapi.get_entity(printer.extruder_temp_sensor_entity) # get the extruder temperature sensor
+            printer.extruder_target_temp_sensor = self.adapi.get_entity(printer.extruder_target_temp_sensor_entity) # get the extruder target temperature sensor
+            printer.change_detector = FrameChangeDetector(self.change_threshold, self.force_inference_every)
+            printer.schedule = AdaptiveInterval(self.min_detection_interval, self.max_detection_interval, self.startup_period,
+                                                self.risk_confidence, self.interval_backoff)
+            printer.tracker = DetectionTracker(window=self.tracking_window, min_hits=self.tracking_min_hits, iou_threshold=self.tracking_iou,
+                                               decay=self.tracking_decay, growth_weight=self.tracking_growth_weight)
+            printer.frames = FrameRingBuffer(capacity=self.buffer_frames, max_frame_bytes=self.max_frame_size * 1024)
+            if self.evidence_directory and self.timelapse_interval > 0:
+                printer.timelapse = Timelapse(self.evidence_directory, printer.name, self.timelapse_interval)
+            if self.notification_on_warp_up and (printer.extruder_temp_sensor is None or printer.extruder_target_temp_sensor is None):
+                raise RuntimeError(f"Invalid Config File. ExtruderTempSensor and ExtruderTargetTempSensor must be defined for {printer.name} if NotifyOnWarmup is True.")
+        self.metrics = Metrics()
+        self.metrics.counter("fetch_failures", "Camera frames that could not be fetched.")
+        self.metrics.counter("cycles_skipped", "Detection cycles skipped because no frame could be fetched or the model was still loading.")
+        self.metrics.counter("cycles_failed", "Detection cycles that failed in a pipeline stage.")
+        self.metrics.counter("frames_reused", "Frames that barely changed and reused the last detections.")
+        self.metrics.counter("frames_inferred", "Frames the model was run on.")
+        if self.cascade:
+            self.metrics.counter("cascade_prescreened", "Images run through the cascade pre-screen.")
+            self.metrics.counter("cascade_escalated", "Images the cascade pre-screen escalated to the full model.")
+            self.metrics.register("cascade_escalation_rate", "gauge", "The fraction of pre-screened images escalated to the full model.",
+                                  lambda: self.metrics.counters["cascade_escalated"] / max(self.metrics.counters["cascade_prescreened"], 1))
         
-        if self.notification_on_warp_up and (self.extruder_temp_sensor is None or self.extruder_target_temp_sensor is None):
-            raise RuntimeError("Invalid Config File. ExtruderTempSensor and ExtruderTargetTempSensor must be defined if NotifyOnWarmup is True.")
+        # the ml model, shared by all printers and with any other app loading the same model
+        loader = functools.partial(load_detection_net, self.model_cfg, self.model_meta, self.model_weights, self.runtime_config,
+                                   self.cascade, self.prescreen_weights or None, self.prescreen_size, self.escalation_score)
+        if self.inference_workers > 0: # run the model in worker processes instead, each loading it with the same loader
+            loader = functools.partial(InferenceWorkerPool, loader, workers=self.inference_workers, thresh=self.detection_threshold,
+                                       nms=self.detection_nms, timeout=self.inference_timeout)
+        self.model = LazyModel(key=(self.model_weights, self.model_meta, self.runtime_config, 
+                                    self.cascade, self.prescreen_weights, self.prescreen_size, self.escalation_score,
+                                    self.inference_workers, self.detection_threshold, self.detection_nms),
+                               loader=loader, log=self.adapi.log)
+        if not self.lazy_load_model:
+            self.model.load()
+        if self.camera_mode == 'stream':
+            self.frame_source = StreamingFrameSource(self.hass_hostname, self.hass_token, connect_timeout=self.camera_connect_timeout, 
+                                                     read_timeout=self.camera_read_timeout, log=self.adapi.log,
+                                                     stream_urls={printer.camera_entity: printer.stream_url for printer in self.printers})
+        else:
+            self.frame_source = CameraProxyFrameSource(self.hass_hostname, self.hass_token, pool_size=self.fetch_workers,
+                                                       connect_timeout=self.camera_connect_timeout, read_timeout=self.camera_read_timeout)
+        self.fetch_pool = ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix="print-detect-fetch-pool")
+        self.export_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="print-detect-export") # writes evidence clips
+        self.history = None
+        if self.history_database:
+            self.history = DetectionHistory(self.history_database, batch_size=self.history_batch_size,
+                                            flush_interval=self.history_flush_interval, retention_days=self.history_retention_days)
+        self.pipeline = DetectionPipeline(fetch=self.fetch_frames, preprocess=self.preprocess_frames, 
+                                          inference=self.run_inference, decision=self.decide_detections, 
+                                          on_error=self.pipeline_error_c)
+        self.pipeline.start()
+        self.metrics.register("cycles_dropped", "counter", "Detection cycles merged into or replaced by a newer cycle while waiting for a stage.", 
+                              lambda: self.pipeline.dropped)
+        self.metrics.register("queue_depth", "gauge", "Detection cycles waiting between pipeline stages.", lambda: self.pipeline.queue_depth)
+        if self.camera_mode == 'stream':
+            self.metrics.register("stream_reconnects", "counter", "Camera streams reconnected after failing or ending.",
+                                  lambda: self.frame_source.total_reconnects)
+        if self.history is not None:
+            self.metrics.register("history_failed_writes", "counter", "Detection results that could not be written to the history database.",
+                                  lambda: self.history.failed_writes)
+        self.metrics.register("frames_oversized", "counter", "Frames not kept in the frame buffer as they were larger than MaxFrameSize.",
+                              lambda: sum(printer.frames.oversized for printer in self.printers))
+        if self.inference_workers > 0:
+            self.metrics.register("inference_worker_restarts", "counter", "Inference worker processes restarted after crashing or hanging.",
+                                  lambda: getattr(self.model.net, 'restarts', 0))
+        self.metrics_server = None
+        if self.metrics_port > 0:
+            self.metrics_server = MetricsServer(self.metrics, self.metrics_host, self.metrics_port)
+            self.metrics_server.start()
+        if self.metrics_publish_interval > 0:
+            self.adapi.run_every(self.publish_metrics_c, "now", self.metrics_publish_interval) # publish the metrics as sensors
         
-        self.adapi.run_every(self.run_every_c, "now", self.detection_interval) # run the detection every x seconds
+        self.tick_handle = None # the pending detection tick, None while no printer is printing
+        self.idle_handle = None # the pending release of the model once the printers are idle
+        for printer in self.printers:
+            # cache the printer entity states and keep them up to date as they change
+            for entity in printer.watched_entities:
+                printer.update_state(entity, self.adapi.get_state(entity))
+                self.adapi.listen_state(self.entity_state_c, entity, printer=printer.name)
+            if printer.printing:
+                self.print_started(printer)
+        self.update_model_demand()
         self.adapi.listen_event(self.handle_action, "mobile_app_notification_action") # listen for mobile app notification actions (e.g. stop print or dismiss)
         
+    def terminate(self):
+        """
+        Called by AppDaemon when the app is stopped. Stops the detection pipeline, closes the pooled camera connections and any open timelapses,
+        and writes the queued detection history.
+        """
+        self.pipeline.stop()
+        self.model.release()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        self.fetch_pool.shutdown(wait=False)
+        self.export_pool.shutdown(wait=False)
+        self.frame_source.close()
+        for printer in self.printers:
+            if printer.timelapse is not None:
+                printer.timelapse.close()
+        if self.history is not None:
+            self.history.close()
+        
     @staticmethod
     def get_config_value(config: ConfigParser, group: str, id: str, type: type) -> any:
         """
@@ -77,130 +196,643 @@ class PrintDetect(ad.ADBase):
         self.hass_token = secrets.get('HASS_TOKEN')
         self.hass_hostname = secrets.get('HASS_HOSTNAME')
     
-    def load_config(self):
+    def read_config(self) -> ConfigParser:
         """
-        Loads the variables from the config file.
+        Read the config file next to the app.
+
+        Returns:
+            ConfigParser: The parsed config file.
         """
         config = ConfigParser()
         config.read(os.path.join(os.path.dirname(__file__), 'config.ini'))
-        self.printer_status_entity: str = PrintDetect.get_config_value(config=config, group='printer.entities', 
-                                                                id='BinaryIsPrintingSensor', type=str)
-        self.printer_printing_state: str = PrintDetect.get_config_value(config=config, group='printer.entities', 
-                                                                id='PrintingOnState', type=str)
-        self.printer_camera_entity: str = PrintDetect.get_config_value(config=config, group='printer.entities', 
-                                                                id='PrinterCamera', type=str)
-        self.printer_stop_button_entity: str = PrintDetect.get_config_value(config=config, group='printer.entities', 
-                                                                id='PrinterStopButton', type=str)
+        return config
+    
+    def load_config(self):
+        """
+        Loads the variables from the config file.
+        """
+        config = self.read_config()
+        self.printers: List[Printer] = PrintDetect.load_printers(config)
         self.detection_interval: int = PrintDetect.get_config_value(config=config, group='program.timings', 
                                                                 id='RunModelInterval', type=int)
+        self.min_detection_interval: float = PrintDetect.get_config_value(config=config, group='program.scheduler', 
+                                                                id='MinInterval', type=float)
+        self.max_detection_interval: float = PrintDetect.get_config_value(config=config, group='program.scheduler', 
+                                                                id='MaxInterval', type=float)
+        self.startup_period: float = PrintDetect.get_config_value(config=config, group='program.scheduler', 
+                                                                id='StartupPeriod', type=float)
+        self.risk_confidence: float = PrintDetect.get_config_value(config=config, group='program.scheduler', 
+                                                                id='RiskConfidence', type=float)
+        self.interval_backoff: float = PrintDetect.get_config_value(config=config, group='program.scheduler', 
+                                                                id='Backoff', type=float)
         self.print_termination_time: int = PrintDetect.get_config_value(config=config, group='program.timings', 
                                                                 id='TerminationTime', type=int)
         self.detection_threshold: float = PrintDetect.get_config_value(config=config, group='model.detection', 
                                                                 id='Threshold', type=float)
         self.detection_nms: float = PrintDetect.get_config_value(config=config, group='model.detection', 
                                                                 id='NMS', type=float)
-        self.extruder_temp_sensor_entity: str = PrintDetect.get_config_value(config=config, group='notifications.entities', 
-                                                                id='ExtruderTempSensor', type=str)
-        self.extruder_target_temp_sensor_entity: str = PrintDetect.get_config_value(config=config, group='notifications.entities', 
-                                                                id='ExtruderTargetTempSensor', type=str)
+        try:
+            self.runtime_config = RuntimeConfig(
+                intra_op_threads=PrintDetect.get_config_value(config=config, group='model.runtime', id='IntraOpThreads', type=int),
+                inter_op_threads=PrintDetect.get_config_value(config=config, group='model.runtime', id='InterOpThreads', type=int),
+                execution_mode=PrintDetect.get_config_value(config=config, group='model.runtime', id='ExecutionMode', type=str).lower(),
+                graph_optimization_level=PrintDetect.get_config_value(config=config, group='model.runtime', 
+                                                                      id='GraphOptimizationLevel', type=str).lower(),
+                cache_dir=PrintDetect.get_config_value(config=config, group='model.runtime', id='OptimizedModelCache', type=str) or None,
+                quantized=PrintDetect.get_config_value(config=config, group='model.runtime', id='Quantized', type=str) == 'True',
+                quantized_weights=PrintDetect.get_config_value(config=config, group='model.runtime', id='QuantizedWeights', type=str) or None,
+                quantized_tolerance=PrintDetect.get_config_value(config=config, group='model.runtime', id='QuantizedTolerance', type=float),
+                backends=parse_backends(PrintDetect.get_config_value(config=config, group='model.backend', id='Backends', type=str)),
+                use_gpu=PrintDetect.get_config_value(config=config, group='model.backend', id='UseGpu', type=str) == 'True',
+                backend_tolerance=PrintDetect.get_config_value(config=config, group='model.backend', id='Tolerance', type=float),
+                backend_benchmark_runs=PrintDetect.get_config_value(config=config, group='model.backend', id='BenchmarkRuns', type=int))
+        except ValueError as e:
+            raise RuntimeError(f"Invalid Config File. {e}")
+        self.tracking_iou: float = PrintDetect.get_config_value(config=config, group='model.tracking', 
+                                                                id='IouThreshold', type=float)
+        self.tracking_window: int = PrintDetect.get_config_value(config=config, group='model.tracking', 
+                                                                id='Window', type=int)
+        self.tracking_min_hits: int = PrintDetect.get_config_value(config=config, group='model.tracking', 
+                                                                id='MinHits', type=int)
+        self.tracking_decay: float = PrintDetect.get_config_value(config=config, group='model.tracking', 
+                                                                id='ScoreDecay', type=float)
+        self.tracking_growth_weight: float = PrintDetect.get_config_value(config=config, group='model.tracking', 
+                                                                id='GrowthWeight', type=float)
+        self.failure_score: float = PrintDetect.get_config_value(config=config, group='model.tracking', 
+                                                                id='FailureScore', type=float)
+        self.change_threshold: float = PrintDetect.get_config_value(config=config, group='model.gating', 
+                                                                id='ChangeThreshold', type=float)
+        self.force_inference_every: int = PrintDetect.get_config_value(config=config, group='model.gating', 
+                                                                id='ForceInferenceEvery', type=int)
+        self.lazy_load_model: bool = True if PrintDetect.get_config_value(config=config, group='model.loading',
+                                                                id='LazyLoad', type=str) == 'True' else False
+        self.model_idle_unload_time: float = PrintDetect.get_config_value(config=config, group='model.loading', 
+                                                                id='IdleUnloadTime', type=float)
+        self.cascade: bool = True if PrintDetect.get_config_value(config=config, group='model.cascade',
+                                                                id='Cascade', type=str) == 'True' else False
+        self.prescreen_weights: str = PrintDetect.get_config_value(config=config, group='model.cascade', 
+                                                                id='PrescreenWeights', type=str)
+        self.prescreen_size: int = PrintDetect.get_config_value(config=config, group='model.cascade', 
+                                                                id='PrescreenSize', type=int)
+        self.escalation_score: float = PrintDetect.get_config_value(config=config, group='model.cascade', 
+                                                                id='EscalationScore', type=float)
+        self.inference_workers: int = PrintDetect.get_config_value(config=config, group='model.workers', 
+                                                                id='Workers', type=int)
+        self.inference_timeout: float = PrintDetect.get_config_value(config=config, group='model.workers', 
+                                                                id='InferenceTimeout', type=float)
+        self.buffer_frames: int = PrintDetect.get_config_value(config=config, group='evidence', 
+                                                                id='BufferFrames', type=int)
+        self.max_frame_size: int = PrintDetect.get_config_value(config=config, group='evidence', 
+                                                                id='MaxFrameSize', type=int)
+        self.evidence_directory: str = PrintDetect.get_config_value(config=config, group='evidence', 
+                                                                id='Directory', type=str)
+        self.evidence_media_path: str = PrintDetect.get_config_value(config=config, group='evidence', 
+                                                                id='MediaPath', type=str)
+        self.clip_frames: int = PrintDetect.get_config_value(config=config, group='evidence', 
+                                                                id='ClipFrames', type=int)
+        self.clip_fps: float = PrintDetect.get_config_value(config=config, group='evidence', 
+                                                                id='ClipFps', type=float)
+        self.timelapse_interval: float = PrintDetect.get_config_value(config=config, group='evidence', 
+                                                                id='TimelapseInterval', type=float)
+        self.history_database: str = PrintDetect.get_config_value(config=config, group='history', 
+                                                                id='Database', type=str)
+        self.history_batch_size: int = PrintDetect.get_config_value(config=config, group='history', 
+                                                                id='BatchSize', type=int)
+        self.history_flush_interval: float = PrintDetect.get_config_value(config=config, group='history', 
+                                                                id='FlushInterval', type=float)
+        self.history_retention_days: float = PrintDetect.get_config_value(config=config, group='history', 
+                                                                id='RetentionDays', type=float)
+        self.max_tile_columns: int = PrintDetect.get_config_value(config=config, group='model.tiling', 
+                                                                id='MaxTileColumns', type=int)
+        self.max_tile_rows: int = PrintDetect.get_config_value(config=config, group='model.tiling', 
+                                                                id='MaxTileRows', type=int)
+        self.tile_overlap: float = PrintDetect.get_config_value(config=config, group='model.tiling', 
+                                                                id='TileOverlap', type=float)
+        self.reduced_decode: bool = True if PrintDetect.get_config_value(config=config, group='model.preprocess',
+                                                                id='ReducedDecode', type=str) == 'True' else False
+        self.camera_connect_timeout: float = PrintDetect.get_config_value(config=config, group='camera.connection', 
+                                                                id='ConnectTimeout', type=float)
+        self.camera_read_timeout: float = PrintDetect.get_config_value(config=config, group='camera.connection', 
+                                                                id='ReadTimeout', type=float)
+        self.camera_mode: str = PrintDetect.get_config_value(config=config, group='camera.connection', 
+                                                                id='Mode', type=str)
+        if self.camera_mode not in ('snapshot', 'stream'):
+            raise RuntimeError(f"Invalid Config File. Mode in [camera.connection] must be snapshot or stream, got '{self.camera_mode}'.")
+        self.fetch_workers: int = PrintDetect.get_config_value(config=config, group='program.pipeline', 
+                                                                id='FetchWorkers', type=int)
+        self.metrics_publish_interval: int = PrintDetect.get_config_value(config=config, group='metrics', 
+                                                                id='PublishInterval', type=int)
+        self.metrics_entity_prefix: str = PrintDetect.get_config_value(config=config, group='metrics', 
+                                                                id='EntityPrefix', type=str)
+        self.metrics_host: str = PrintDetect.get_config_value(config=config, group='metrics', 
+                                                                id='PrometheusHost', type=str)
+        self.metrics_port: int = PrintDetect.get_config_value(config=config, group='metrics', 
+                                                                id='PrometheusPort', type=int)
         self.notification_on_warp_up: bool = True if PrintDetect.get_config_value(config=config, group='notifications.config',
                                                                 id='NotifyOnWarmup', type=str) == 'True' else False
         
-    def get_camera_snapshot(self):
+    @staticmethod
+    def load_printers(config: ConfigParser) -> List[Printer]:
+        """
+        Load the printers to monitor from the config file. 
+        If the fleet section lists printers, each is read from its own printer.<name> section. 
+        Otherwise a single printer is read from the printer.entities and notifications.entities sections.
+
+        Args:
+            config (ConfigParser): The configuration file parser
+
+        Raises:
+            RuntimeError: Raise error if a listed printer has no section in the config file.
+
+        Returns:
+            List[Printer]: The printers to monitor.
+        """
+        names = [name.strip() for name in PrintDetect.get_config_value(config=config, group='fleet', 
+                                                                id='Printers', type=str).split(',') if name.strip()]
+        if not names:
+            return [Printer(name='printer',
+                            status_entity=PrintDetect.get_config_value(config=config, group='printer.entities', 
+                                                                id='BinaryIsPrintingSensor', type=str),
+                            printing_state=PrintDetect.get_config_value(config=config, group='printer.entities', 
+                                                                id='PrintingOnState', type=str),
+                            camera_entity=PrintDetect.get_config_value(config=config, group='printer.entities', 
+                                                                id='PrinterCamera', type=str),
+                            stop_button_entity=PrintDetect.get_config_value(config=config, group='printer.entities', 
+                                                                id='PrinterStopButton', type=str),
+                            extruder_temp_sensor_entity=PrintDetect.get_config_value(config=config, group='notifications.entities', 
+                                                                id='ExtruderTempSensor', type=str),
+                            extruder_target_temp_sensor_entity=PrintDetect.get_config_value(config=config, group='notifications.entities', 
+                                                                id='ExtruderTargetTempSensor', type=str),
+                            region=PrintDetect.get_region(config=config, group='printer.entities'),
+                            stream_url=PrintDetect.get_config_value(config=config, group='printer.entities', 
+                                                                id='StreamUrl', type=str))]
+        printers = []
+        for name in names:
+            group = f"printer.{name}"
+            if not config.has_section(group):
+                raise RuntimeError(f"Invalid Config File. Printer {name} is listed in fleet Printers but has no [{group}] section.")
+            printers.append(Printer(name=name,
+                                    status_entity=PrintDetect.get_config_value(config=config, group=group, id='BinaryIsPrintingSensor', type=str),
+                                    printing_state=PrintDetect.get_config_value(config=config, group=group, id='PrintingOnState', type=str),
+                                    camera_entity=PrintDetect.get_config_value(config=config, group=group, id='PrinterCamera', type=str),
+                                    stop_button_entity=PrintDetect.get_config_value(config=config, group=group, id='PrinterStopButton', type=str),
+                                    extruder_temp_sensor_entity=PrintDetect.get_config_value(config=config, group=group, 
+                                                                                             id='ExtruderTempSensor', type=str),
+                                    extruder_target_temp_sensor_entity=PrintDetect.get_config_value(config=config, group=group, 
+                                                                                                    id='ExtruderTargetTempSensor', type=str),
+                                    region=PrintDetect.get_region(config=config, group=group),
+                                    stream_url=PrintDetect.get_config_value(config=config, group=group, id='StreamUrl', type=str)))
+        return printers
+        
+    @staticmethod
+    def get_region(config: ConfigParser, group: str) -> Tuple[float, float, float, float]:
+        """
+        Get the region of interest of a printer's camera from the config file.
+
+        Args:
+            config (ConfigParser): The configuration file parser
+            group (str): The section of the printer.
+
+        Raises:
+            RuntimeError: Raise error if the region is not valid.
+
+        Returns:
+            Tuple[float, float, float, float]: The region as fractions of the frame (left, top, width, height).
+        """
+        try:
+            return parse_region(PrintDetect.get_config_value(config=config, group=group, id='RegionOfInterest', type=str))
+        except ValueError as e:
+            raise RuntimeError(f"Invalid Config File. {e} in [{group}].")
+        
+    def get_printer(self, name: str) -> Printer:
+        """
+        Get a monitored printer by its name.
+
+        Args:
+            name (str): The name of the printer. An empty name refers to the only printer when not in fleet mode.
+
+        Returns:
+            Printer: The printer, or None if no printer has the name.
+        """
+        if not name and len(self.printers) == 1:
+            return self.printers[0]
+        return next((printer for printer in self.printers if printer.name == name), None)
+        
+    def notification_title(self, printer: Printer, title: str) -> str:
+        """
+        Get the title of a notification about a printer, naming the printer when more than one is monitored.
+        """
+        return title if len(self.printers) == 1 else f"{title} ({printer.name})"
+        
+    def fetch_camera_frame(self, printer: Printer) -> Optional[bytes]:
+        """
+        Fetch the latest encoded camera frame, as a snapshot from Home Assistant or from the camera's stream.
+
+        Args:
+            printer (Printer): The printer to get the frame of.
+
+        Returns:
+            Optional[bytes]: The encoded frame, or None if the frame could not be fetched.
+        """
+        start = time.perf_counter()
+        try:
+            frame = self.frame_source.fetch_jpeg(printer.camera_entity)
+        except requests.RequestException as e:
+            self.metrics.increment("fetch_failures")
+            self.adapi.log(f"Error getting camera snapshot for {printer.name}: {e}")
+            return None
+        self.metrics.observe("fetch", time.perf_counter() - start)
+        return frame
+        
+    def save_camera_snapshot(self, printer: Printer):
+        """
+        Save a camera snapshot to the Home Assistant media directory so it can be attached to a notification.
+
+        Args:
+            printer (Printer): The printer to save the snapshot of.
+        """
+        printer.print_camera.call_service("snapshot", filename=f"/media/{printer.snapshot_filename}")
+    
+    def save_evidence(self, printer: Printer, sequence: Optional[int]) -> str:
         """
-        Get the camera snapshot and decode it into an image.
+        Save the frame an issue was detected on with its detections drawn on, and queue a clip of the frames leading up to it
+        to be written in the background. Falls back to a camera snapshot if no evidence directory is set or the frame is no longer buffered.
+
+        Args:
+            printer (Printer): The printer the issue was detected on.
+            sequence (Optional[int]): The sequence number of the frame in the printer's frame buffer.
+
+        Returns:
+            str: The path of the image to attach to the notification.
+        """
+        frame = printer.frames.get(sequence) if sequence is not None and self.evidence_directory else None
+        if frame is not None:
+            name = evidence_name(printer.name, frame)
+            if write_evidence_image(os.path.join(self.evidence_directory, name + ".jpg"), frame):
+                if self.clip_frames > 0:
+                    clip = printer.frames.last(self.clip_frames, until=sequence)
+                    self.export_pool.submit(write_clip, os.path.join(self.evidence_directory, name + ".mp4"), clip, self.clip_fps)
+                return f"{self.evidence_media_path.rstrip('/')}/{name}.jpg"
+            self.adapi.log(f"Failed to save the evidence of the issue on {printer.name}, taking a camera snapshot instead.", level="WARNING")
+        self.save_camera_snapshot(printer)
+        return f"/media/local/{printer.snapshot_filename}"
+
+    def fetch_frames(self, cycle: DetectionCycle) -> Optional[DetectionCycle]:
+        """
+        Pipeline fetch stage. Fetch a frame of each print job in the cycle at the same time.
+        Printers whose frame could not be fetched are dropped from the cycle.
+
+        Returns:
+            Optional[DetectionCycle]: The cycle, or None if no frames were fetched.
+        """
+        start = time.perf_counter()
+        frames = list(self.fetch_pool.map(self.fetch_camera_frame, cycle.printers))
+        cycle.timings["fetch"] = time.perf_counter() - start # each frame's fetch time is recorded in the metrics as it is fetched
+        for printer, frame in zip(cycle.printers, frames):
+            if frame is None:
+                self.adapi.log(f"Failed to get camera snapshot for {printer.name}, skipping detection for this cycle.")
+        cycle.printers = [printer for printer, frame in zip(cycle.printers, frames) if frame is not None]
+        cycle.frames = [frame for frame in frames if frame is not None]
+        if not cycle.printers:
+            self.metrics.increment("cycles_skipped")
+            return None
+        return cycle
+    
+    def preprocess_frames(self, cycle: DetectionCycle) -> Optional[DetectionCycle]:
+        """
+        Pipeline preprocess stage. Decode the frames, crop them to the region of interest of each printer and prepare them as one model input batch.
+        Regions much larger than the model input are split into overlapping tiles if MaxTileColumns or MaxTileRows allow,
+        each tile becoming its own image in the batch. Frames much larger than the tiles need are decoded at a reduced resolution
+        if ReducedDecode is enabled. Printers whose frame could not be decoded are dropped from the cycle, and printers whose region
+        has barely changed since the model was last run on it are moved to the reused printers of the cycle.
 
         Returns:
-            The decoded image.
-        """
-        url = f"{self.hass_hostname}/media/local/snapshot.jpg"
-        headers = {
-            'Authorization': f'Bearer {self.hass_token}'
-        }
-        response = requests.request("GET", url, headers=headers, data={}, stream=True)
-        if response.status_code != 200:
-            self.adapi.log(f"Error getting camera snapshot: {response.status_code}")
+            Optional[DetectionCycle]: The cycle, or None if no frames were decoded.
+        """
+        input_size = (cycle.net.input_w, cycle.net.input_h)
+        start = time.perf_counter()
+        decoded = [self.decode_frame(printer, frame, input_size) for printer, frame in zip(cycle.printers, cycle.frames)]
+        self.observe_stage(cycle, "decode", time.perf_counter() - start)
+        for printer, (image, _, _) in zip(cycle.printers, decoded):
+            if image is None:
+                self.adapi.log(f"Failed to decode camera snapshot for {printer.name}, skipping detection for this cycle.")
+        cycle.printers = [printer for printer, (image, _, _) in zip(cycle.printers, decoded) if image is not None]
+        cycle.frames = [frame for frame, (image, _, _) in zip(cycle.frames, decoded) if image is not None]
+        decoded = [frame for frame in decoded if frame[0] is not None]
+        if not decoded:
             return None
-        arr = np.asarray(bytearray(response.raw.read()), dtype=np.uint8)
-        cv2_img = cv2.imdecode(arr, -1)
-        return cv2_img
+        start = time.perf_counter()
+        infer = [printer.change_detector.should_infer(crop(image, region_tile(frame_size, printer.region), frame_size), 
+                                                      force=printer.last_detections is None) 
+                 for printer, (image, frame_size, _) in zip(cycle.printers, decoded)]
+        cycle.reused = [printer for printer, run in zip(cycle.printers, infer) if not run]
+        cycle.reused_frames = [frame for frame, run in zip(cycle.frames, infer) if not run]
+        cycle.printers = [printer for printer, run in zip(cycle.printers, infer) if run]
+        cycle.frames = [frame for frame, run in zip(cycle.frames, infer) if run]
+        decoded = [frame for frame, run in zip(decoded, infer) if run]
+        self.metrics.increment("frames_reused", len(cycle.reused))
+        self.metrics.increment("frames_inferred", len(decoded))
+        if not decoded:
+            return cycle
+        # detections are scaled to the size of each tile in the full frame, even when the frame was decoded at a reduced resolution
+        cycle.tiles = [tiles for _, _, tiles in decoded]
+        cycle.image_sizes = [(tile.h, tile.w) for tiles in cycle.tiles for tile in tiles]
+        cycle.images = [crop(image, tile, frame_size) for image, frame_size, tiles in decoded for tile in tiles]
+        cycle.input_tensor = cycle.net.preprocess(cycle.images)
+        self.observe_stage(cycle, "preprocess", time.perf_counter() - start)
+        return cycle
     
-    def perform_detection(self) -> int:
+    def decode_frame(self, printer: Printer, frame: bytes, input_size: Tuple[int, int]) -> Tuple[Optional[np.ndarray], Tuple[int, int], List[Tile]]:
         """
-        Take a snapshot of the print job and run the detection model on the image.
+        Decode a frame and plan the tiles covering the region of interest of the printer.
+
+        Args:
+            printer (Printer): The printer the frame is of.
+            frame (bytes): The encoded frame.
+            input_size (Tuple[int, int]): The (width, height) of the model input.
 
         Returns:
-            int: The number of issues detected. 0 if a snapshot could not be taken.
-        """
-        self.print_camera.call_service("snapshot", filename="/media/snapshot.jpg")
-        custom_image_bgr = self.get_camera_snapshot()
-        if custom_image_bgr is None:
-            self.adapi.log("Failed to get camera snapshot, skipping detection for this cycle.")
-            return 0
-        detections = detect(self.net_main_1, custom_image_bgr, thresh=self.detection_threshold, nms=self.detection_nms)
-        detection_count = len(detections)
-        self.adapi.log(f"Detected {detection_count} issues")
-        return detection_count
+            Tuple[Optional[np.ndarray], Tuple[int, int], List[Tile]]: The decoded image (None if it could not be decoded),
+                the (width, height) of the full frame and the tiles in full frame pixels.
+        """
+        frame_size = jpeg_size(frame)
+        tiles = self.plan_tiles(printer, frame_size, input_size) if frame_size is not None else None
+        min_size = min_decode_size(frame_size, tiles, input_size) if self.reduced_decode and tiles else None
+        image = CameraProxyFrameSource.decode(frame, min_size)
+        if image is not None and frame_size is None:
+            frame_size = (image.shape[1], image.shape[0])
+            tiles = self.plan_tiles(printer, frame_size, input_size)
+        return image, frame_size, tiles
+    
+    def plan_tiles(self, printer: Printer, frame_size: Tuple[int, int], input_size: Tuple[int, int]) -> List[Tile]:
+        """Plan the tiles covering the region of interest of a printer's frame."""
+        return plan_tiles(frame_size, printer.region, input_size, max_columns=self.max_tile_columns, 
+                          max_rows=self.max_tile_rows, overlap=self.tile_overlap)
+    
+    def run_inference(self, cycle: DetectionCycle) -> DetectionCycle:
+        """
+        Pipeline inference stage. Run the model on the input batch of the cycle, if any frames need it,
+        then release the batch so the net can reuse its buffer.
+        """
+        try:
+            if cycle.input_tensor is not None:
+                start = time.perf_counter()
+                cycle.outputs = cycle.net.infer(cycle.input_tensor)
+                self.observe_stage(cycle, "inference", time.perf_counter() - start)
+        finally:
+            cycle.release_input()
+        return cycle
     
-    def send_detection_notification_and_countdown(self):
+    def observe_stage(self, cycle: DetectionCycle, stage: str, seconds: float) -> None:
+        """Record how long a stage of a cycle took, in the metrics and on the cycle for the detection history."""
+        self.metrics.observe(stage, seconds)
+        cycle.timings[stage] = seconds
+    
+    def decide_detections(self, cycle: DetectionCycle) -> None:
+        """
+        Pipeline decision stage. Turn the model outputs into detections for each printer, joining the detections of its tiles
+        in full frame coordinates, update its tracker with them and
+        hand the printers whose failure score passed FailureScore back to the AppDaemon worker thread to be notified.
+        Printers reused in the cycle are decided on their last detections.
+        The highest confidence of each frame, including below the detection threshold, adjusts how soon the printer is checked again.
+        """
+        if cycle.outputs is not None:
+            start = time.perf_counter()
+            tile_detections = cycle.net.postprocess(cycle.outputs, cycle.image_sizes, self.detection_threshold, self.detection_nms)
+            tile_confidences = cycle.net.max_confidences(cycle.outputs)
+            escalated = getattr(cycle.outputs, 'escalated', None) # set if the model runs as a cascade
+            if escalated is not None:
+                self.metrics.increment("cascade_prescreened", len(escalated))
+                self.metrics.increment("cascade_escalated", int(escalated.sum()))
+            first = 0
+            for printer, tiles in zip(cycle.printers, cycle.tiles):
+                last = first + len(tiles)
+                cycle.detections.append(merge_tile_detections(tile_detections[first:last], tiles, self.detection_nms))
+                printer.schedule.record(float(tile_confidences[first:last].max()))
+                first = last
+            self.observe_stage(cycle, "postprocess", time.perf_counter() - start)
+        for printer in cycle.reused:
+            printer.schedule.record(printer.schedule.last_confidence)
+        for printer, detections in zip(cycle.printers, cycle.detections):
+            printer.last_detections = detections
+        # keep each frame with its detections in memory, so the evidence of an issue can be saved if it is notified
+        sequences = {}
+        for printer, frame in zip(cycle.printers + cycle.reused, cycle.frames + cycle.reused_frames):
+            sequences[printer.name] = printer.frames.append(frame, printer.last_detections)
+            if printer.timelapse is not None:
+                printer.timelapse.add(frame)
+        issue_printers = []
+        failure_scores = {}
+        for printer in cycle.printers + cycle.reused:
+            detection_count = len(printer.last_detections)
+            failure_score = failure_scores[printer.name] = printer.tracker.update(printer.last_detections)
+            gate = printer.change_detector
+            self.adapi.log(f"Detected {detection_count} issues on {printer.name}, failure score {failure_score:.3f}" + 
+                           (" (frame unchanged, reused last result)" if printer in cycle.reused else "") +
+                           f" - frame change {gate.last_change:.4f}, reused {gate.hits} / inferred {gate.misses}")
+            # if the issues have persisted or grown enough, send a notification
+            if failure_score >= self.failure_score:
+                issue_printers.append(printer.name)
+        if issue_printers:
+            self.adapi.run_in(self.detection_issue_c, 0, printers=issue_printers, 
+                              frames={name: sequences.get(name) for name in issue_printers})
+        self.observe_stage(cycle, "cycle", time.monotonic() - cycle.submitted_at)
+        if self.history is not None:
+            for printer, frame in zip(cycle.printers + cycle.reused, cycle.frames + cycle.reused_frames):
+                self.history.record_frame(printer.name, printer.print_id, frame, printer.last_detections, failure_scores[printer.name],
+                                          reused=printer in cycle.reused, timings=cycle.timings)
+    
+    def pipeline_error_c(self, stage: str, error: Exception):
+        '''
+        A callback function for when a stage of the detection pipeline fails. The cycle is skipped.
+        '''
+        self.metrics.increment("cycles_failed")
+        self.adapi.log(f"Detection pipeline {stage} stage failed, skipping detection for this cycle: {error}", level="WARNING")
+        
+    def publish_metrics_c(self, cb_args):
+        '''
+        A callback function called every PublishInterval seconds to publish the metrics as Home Assistant sensors.
+        '''
+        for name, state, attributes in self.metrics.sensor_states():
+            self.adapi.set_state(f"sensor.{self.metrics_entity_prefix}_{name}", state=state, attributes=attributes)
+    
+    def detection_issue_c(self, cb_args):
+        '''
+        A callback function for when the detection pipeline finds an issue with one or more print jobs.
+        It will send a notification for each print job that is still running and has not already had one sent.
+        '''
+        for printer in [self.get_printer(name) for name in cb_args["printers"]]:
+            if printer.printing and printer.cancel_handle == None:
+                self.send_detection_notification_and_countdown(printer, cb_args.get("frames", {}).get(printer.name))
+        
+    def send_detection_notification_and_countdown(self, printer: Printer, sequence: Optional[int] = None):
         """
         Send a notification to the user that an issue has been detected and start the countdown to stop the print job.
+
+        Args:
+            printer (Printer): The printer the issue was detected on.
+            sequence (Optional[int]): The sequence number of the frame in the printer's frame buffer that the issue was detected on.
         """
+        start = time.perf_counter()
+        image = self.save_evidence(printer, sequence)
         self.adapi.call_service("notify/notify", message=f"An issue with your 3D print has been detected. The print will be stopped in {self.print_termination_time} seconds if not dismissed.", 
-                                title="3D Print Issue Detected",
+                                title=self.notification_title(printer, "3D Print Issue Detected"),
                                 data={
-                                    "image": "/media/local/snapshot.jpg",
+                                    "image": image,
                                     "actions": [
                                         {
-                                            "action": "STOP_PRINT_JOB",
+                                            "action": printer.action("STOP_PRINT_JOB"),
                                             "title": "Stop Print"
                                         },
                                         {
-                                            "action": "DISMISS_NOTIFICATION",
+                                            "action": printer.action("DISMISS_NOTIFICATION"),
                                             "title": "Dismiss"
                                         }
                                     ],
                                     "push": {
                                         "interruption-level": "critical"
                                     }})
-        self.cancel_handle = self.adapi.run_in(self.cancel_print_callback, self.print_termination_time)
+        printer.cancel_handle = self.adapi.run_in(self.cancel_print_callback, self.print_termination_time, printer=printer.name)
+        self.metrics.observe("notification", time.perf_counter() - start)
         
-    def notify_on_warmup(self):
+    def notify_on_warmup(self, printer: Printer):
         """
         Notify the user when the printer is almost warmed up
+
+        Args:
+            printer (Printer): The printer to check.
         """
-        if float(self.extruder_temp_sensor.state) > (0.9 * float(self.extruder_target_temp_sensor.state)) and float(self.extruder_temp_sensor.state) < (0.96 * float(self.extruder_target_temp_sensor.state)) and self.warmup_complete == False:
-            self.warmup_complete = True
+        temp, target_temp = printer.extruder_temp, printer.extruder_target_temp
+        if temp is None or target_temp is None:
+            return
+        if temp > (0.9 * target_temp) and temp < (0.96 * target_temp) and printer.warmup_complete == False:
+            printer.warmup_complete = True
+            self.save_camera_snapshot(printer)
             self.adapi.call_service("notify/notify", 
                                     message="The 3D printer has almost warmed up. Remove any excess filament before your print starts.", 
-                                    title="3D Printer Warming Up",
+                                    title=self.notification_title(printer, "3D Printer Warming Up"),
                                     data={
-                                        "image": "/media/local/snapshot.jpg"
+                                        "image": f"/media/local/{printer.snapshot_filename}"
                                     })
-        if float(self.extruder_temp_sensor.state) > (0.96 * float(self.extruder_target_temp_sensor.state)):
-            self.warmup_complete = False
+        if temp > (0.96 * target_temp):
+            printer.warmup_complete = False
         
-    def extra_notifications_router(self):
+    def extra_notifications_router(self, printer: Printer):
         """
         Check if extra notifications are needed.
+
+        Args:
+            printer (Printer): The printer to check.
         """
         if self.notification_on_warp_up:
-            self.notify_on_warmup()
+            self.notify_on_warmup(printer)
         
-    def run_every_c(self, cb_args):
+    def entity_state_c(self, entity, attribute, old, new, kwargs):
         '''
-        This function is called every x seconds to take a snapshot of the print job and run the detection model.
-        It will send a notification if an issue is detected.
+        A callback function for when the state of one of a printer's entities changes. It updates the printer's cached state,
+        starts the detection loop when the printer starts printing and checks whether extra notifications are needed while it prints.
         '''
-        # check if the printer is on and a notification has not already been sent
-        if self.printer_status.is_state(self.printer_printing_state) and self.cancel_handle == None:
+        printer = self.get_printer(kwargs["printer"])
+        was_printing = printer.printing
+        printer.update_state(entity, new)
+        if printer.printing and not was_printing:
+            self.print_started(printer)
+        elif was_printing and not printer.printing:
+            printer.schedule.stop()
+            if printer.timelapse is not None:
+                printer.timelapse.close()
+            if self.history is not None and printer.print_id is not None:
+                self.history.end_print(printer.print_id)
+                printer.print_id = None
+            if not any(other.printing and other.camera_entity == printer.camera_entity for other in self.printers):
+                self.frame_source.release(printer.camera_entity) # close the camera stream until the next print
+            self.adapi.log(f"{printer.name} stopped printing.")
+        elif printer.printing and entity != printer.status_entity:
             # call the extra notifications router to check if any extra notifications are needed
-            self.extra_notifications_router()
-            # if the printer is on, take a snapshot and run the detection model
-            detection_count = self.perform_detection()
-            # if an issue is detected, send a notification
-            if detection_count > 1:
-                self.send_detection_notification_and_countdown()
+            self.extra_notifications_router(printer)
+        self.update_model_demand()
+        
+    def print_started(self, printer: Printer):
+        """
+        Start monitoring a print job, checking it straight away.
+
+        Args:
+            printer (Printer): The printer that started printing.
+        """
+        now = time.monotonic()
+        printer.schedule.start(now)
+        printer.tracker.reset()
+        printer.next_due = now
+        if self.history is not None:
+            printer.print_id = self.history.start_print(printer.name)
+        self.adapi.log(f"{printer.name} started printing.")
+        if self.tick_handle is not None:
+            self.adapi.cancel_timer(self.tick_handle)
+        self.tick_handle = self.adapi.run_in(self.detection_tick_c, 0)
+        
+    def update_model_demand(self):
+        """
+        Request the model while any printer is printing or warming up, so it is loaded by the time it is needed,
+        and schedule its release for when the printers have all been idle for IdleUnloadTime.
+
+        Returns:
+            The model, or None if no printer needs it or it is still loading.
+        """
+        if any(printer.printing or printer.warming for printer in self.printers):
+            if self.idle_handle is not None:
+                self.adapi.cancel_timer(self.idle_handle)
+                self.idle_handle = None
+            return self.model.request()
+        if self.idle_handle is None and self.model_idle_unload_time > 0:
+            self.idle_handle = self.adapi.run_in(self.model_idle_c, self.model_idle_unload_time)
+        return None
+        
+    def model_idle_c(self, cb_args):
+        '''
+        A callback function for when the printers have been idle for IdleUnloadTime. It releases the model until it is next needed.
+        '''
+        self.idle_handle = None
+        if self.model.loaded:
+            self.adapi.log(f"Releasing the model after {self.model_idle_unload_time:g} seconds idle.")
+        self.model.release()
+        
+    def schedule_detection_tick(self, now: float):
+        """
+        Schedule the next detection tick for when the next printer is due, or after RunModelInterval if none are.
+        No tick is scheduled while no printer is printing, the loop is started again when one starts.
+
+        Args:
+            now (float): The current monotonic time.
+        """
+        if not any(printer.printing for printer in self.printers):
+            return
+        next_due = [printer.next_due - now for printer in self.printers if printer.printing and printer.cancel_handle == None]
+        self.tick_handle = self.adapi.run_in(self.detection_tick_c, max(min([self.detection_interval] + next_due), 0))
+        
+    def detection_tick_c(self, cb_args):
+        '''
+        This function is called whenever a printing printer is due a detection, or at least every x seconds while any printer is printing.
+        It queues a detection cycle for each print job that is due on the detection pipeline, then schedules the next tick.
+        The detection itself runs on the pipeline, which will send a notification for each printer an issue is detected on.
+        '''
+        self.tick_handle = None
+        now = time.monotonic()
+        try:
+            # check which printers are due and have not already had a notification sent
+            printers = [printer for printer in self.printers if printer.printing and printer.cancel_handle == None and printer.next_due <= now]
+            for printer in printers:
+                printer.next_due = now + printer.schedule.next_interval(now, warming=printer.warming)
+            net = self.update_model_demand()
+            if printers:
+                if net is None:
+                    self.metrics.increment("cycles_skipped")
+                    self.adapi.log("The model is still loading, skipping detection for this cycle.")
+                    return
+                # queue a cycle to fetch a frame of each printer that is due and run the detection model on them together
+                if self.pipeline.submit(DetectionCycle(printers=printers, net=net)):
+                    self.adapi.log("Detection pipeline is behind, merged the detection cycle still waiting into this one.")
+        finally:
+            self.schedule_detection_tick(now)
 
     def handle_action(self, event_name, data, kwargs):
         '''
@@ -208,32 +840,38 @@ class PrintDetect(ad.ADBase):
         It will run the appropriate function based on the action received.
         '''
         self.adapi.log(f"Received action: {data}")
-        if data["action"] == "STOP_PRINT_JOB":
-            self.stop_print_job()
-        elif data["action"] == "DISMISS_NOTIFICATION":
-            self.dismiss_print_cancel()
+        action, _, printer_name = data["action"].partition(":")
+        printer = self.get_printer(printer_name)
+        if printer is None:
+            return
+        if action == "STOP_PRINT_JOB":
+            self.stop_print_job(printer)
+        elif action == "DISMISS_NOTIFICATION":
+            self.dismiss_print_cancel(printer)
             
     def cancel_print_callback(self, cb_args):
         '''
         A callback function for when the timer to stop the print job is called.
         '''
-        self.stop_print_job()
+        self.stop_print_job(self.get_printer(cb_args["printer"]))
             
-    def stop_print_job(self):
+    def stop_print_job(self, printer: Printer):
         '''
         This function is called to stop the print job. 
         It will send a notification to the user and call the stop print button.
         '''
-        self.dismiss_print_cancel()
-        self.stop_print_button.call_service("press")
-        self.adapi.call_service("notify/notify", message="The 3D print has been stopped due to an issue.", title="3D Print Stopped")
+        self.dismiss_print_cancel(printer)
+        printer.stop_print_button.call_service("press")
+        self.adapi.call_service("notify/notify", message="The 3D print has been stopped due to an issue.", 
+                                title=self.notification_title(printer, "3D Print Stopped"))
         
-    def dismiss_print_cancel(self):
+    def dismiss_print_cancel(self, printer: Printer):
         '''
         This function is called to dismiss the print issue notification.
         It will cancel the timer to stop the print job and send a notification to the user that the issue has been dismissed.
         '''
-        if self.cancel_handle is not None:
-            self.adapi.cancel_timer(self.cancel_handle)
-            self.cancel_handle = None
-        self.adapi.call_service("notify/notify", message="The 3D print issue has been dismissed.", title="3D Print Issue Dismissed")
\ No newline at end of file
+        if printer.cancel_handle is not None:
+            self.adapi.cancel_timer(printer.cancel_handle)
+            printer.cancel_handle = None
+        self.adapi.call_service("notify/notify", message="The 3D print issue has been dismissed.", 
+                                title=self.notification_title(printer, "3D Print Issue Dismissed"))
\ No newline at end of file
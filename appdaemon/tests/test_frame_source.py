@@ -0,0 +1,143 @@
+'''
+Tests for reading camera frames from an MJPEG stream.
+
+Example:
+    python -m pytest appdaemon/tests
+'''
+
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+APPS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'conf', 'apps')
+sys.path.insert(0, APPS_DIR)
+
+from lib.frame_source import CameraProxyFrameSource, MjpegStreamReader
+
+BOUNDARY = 'frame'
+
+def make_frames(count: int, width: int = 64, height: int = 48):
+    """JPEG frames with a different grey level each, so the frame can be told from its decoded image."""
+    return [cv2.imencode('.jpg', np.full((height, width, 3), 40 + index * 40, dtype=np.uint8))[1].tobytes() for index in range(count)]
+
+class MjpegServer:
+    """
+    A loopback MJPEG server. Each frame is written in pieces cut inside its start and end markers,
+    and the connection is dropped after `frames_per_connection` frames. The oversized frame is sent first on the first connection.
+    """
+
+    def __init__(self, frames, frames_per_connection: int, oversized: bytes = b''):
+        self.frames = frames
+        self.frames_per_connection = frames_per_connection
+        self.oversized = oversized
+        self.connections = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.connections += 1
+                self.send_response(200)
+                self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+                self.end_headers()
+                try:
+                    if server.oversized and server.connections == 1:
+                        self.write_part(server.oversized)
+                    for index in range(server.frames_per_connection):
+                        self.write_part(server.frames[index % len(server.frames)])
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                self.close_connection = True
+
+            def write_part(self, frame: bytes):
+                header = f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n\r\n'.encode()
+                end = len(frame) - 1
+                for piece in (header + frame[:1], frame[1:end // 2], frame[end // 2:end], frame[end:] + b'\r\n'):
+                    self.wfile.write(piece)
+                    self.wfile.flush()
+                    time.sleep(0.005)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}/stream'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class MjpegStreamReaderTest(unittest.TestCase):
+
+    def read_stream(self, server: MjpegServer, seconds: float, chunk_size: int, max_frame_bytes: int = None):
+        """Read the server's stream for a while, returning the distinct frames latest() gave, the reader and its log."""
+        logs = []
+        reader = MjpegStreamReader(server.url, connect_timeout=1, read_timeout=1, min_backoff=0.05, max_backoff=0.1, log=logs.append)
+        reader.chunk_size = chunk_size
+        if max_frame_bytes is not None:
+            reader.max_frame_bytes = max_frame_bytes
+        reader.start()
+        frames = []
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                frame = reader.latest()
+                if not frames or frame != frames[-1]:
+                    frames.append(frame)
+                time.sleep(0.01)
+        finally:
+            reader.stop()
+        return frames, reader, logs
+
+    def assert_frames_decode(self, frames, sent):
+        self.assertGreater(len(frames), 1)
+        for frame in frames:
+            self.assertIn(frame, sent)
+            image = CameraProxyFrameSource.decode(frame)
+            self.assertIsNotNone(image)
+            self.assertEqual(image.shape, (48, 64, 3))
+
+    def test_markers_split_between_chunks(self):
+        sent = make_frames(4)
+        server = MjpegServer(sent, frames_per_connection=1000)
+        try:
+            for chunk_size in (1, 3, 64 * 1024):
+                frames, reader, _ = self.read_stream(server, seconds=0.5, chunk_size=chunk_size)
+                self.assert_frames_decode(frames, sent)
+                self.assertEqual(reader.reconnects, 0)
+        finally:
+            server.close()
+
+    def test_reconnects_after_the_connection_drops(self):
+        sent = make_frames(4)
+        server = MjpegServer(sent, frames_per_connection=3)
+        try:
+            frames, reader, logs = self.read_stream(server, seconds=1.5, chunk_size=7)
+        finally:
+            server.close()
+        self.assert_frames_decode(frames, sent)
+        self.assertGreaterEqual(reader.reconnects, 2)
+        self.assertGreaterEqual(server.connections, reader.reconnects)
+        self.assertIn('stream ended', logs[0])
+
+    def test_oversized_frame_is_skipped(self):
+        sent = make_frames(4)
+        oversized = b'\xff\xd8' + bytes(4096) # a frame start with no end within the maximum frame size
+        server = MjpegServer(sent, frames_per_connection=1000, oversized=oversized)
+        try:
+            frames, reader, logs = self.read_stream(server, seconds=1.0, chunk_size=512, max_frame_bytes=2048)
+        finally:
+            server.close()
+        self.assert_frames_decode(frames, sent)
+        self.assertEqual(reader.reconnects, 1)
+        self.assertTrue(any('no frame end within 2048 bytes' in log for log in logs))
+
+if __name__ == '__main__':
+    unittest.main()
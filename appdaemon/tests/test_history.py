@@ -0,0 +1,64 @@
+'''
+Tests for the detection history database.
+
+Example:
+    python -m pytest appdaemon/tests
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+APPS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'conf', 'apps')
+sys.path.insert(0, APPS_DIR)
+
+from lib.history import DetectionHistory
+from lib.onnx import DETECTION_DTYPE
+
+class SharedDatabaseTest(unittest.TestCase):
+    """Two apps recording into the same database file."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'history.db')
+        self.first = DetectionHistory(self.path, batch_size=1000, flush_interval=60)
+        self.second = DetectionHistory(self.path, batch_size=1000, flush_interval=60)
+
+    def tearDown(self):
+        self.first.close()
+        self.second.close()
+        self.directory.cleanup()
+
+    def test_print_ids_are_unique(self):
+        ids = [self.first.start_print('ender'), self.second.start_print('prusa'),
+               self.first.start_print('ender'), self.second.start_print('prusa')]
+        self.assertNotIn(None, ids)
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_frames_are_kept_with_their_print(self):
+        detections = np.zeros(1, dtype=DETECTION_DTYPE)
+        detections['confidence'] = 0.5
+        ender = self.first.start_print('ender')
+        prusa = self.second.start_print('prusa')
+        for index in range(3):
+            self.first.record_frame('ender', ender, f'ender {index}'.encode(), detections, failure_score=0.1)
+            self.second.record_frame('prusa', prusa, f'prusa {index}'.encode(), detections, failure_score=0.2)
+        self.first.end_print(ender)
+        self.second.end_print(prusa)
+        self.assertTrue(self.first.flush(timeout=10))
+        self.assertTrue(self.second.flush(timeout=10))
+        self.assertEqual(self.first.failed_writes + self.second.failed_writes, 0)
+
+        self.assertEqual({frame.printer for frame in self.first.frames(print_id=ender)}, {'ender'})
+        self.assertEqual({frame.printer for frame in self.first.frames(print_id=prusa)}, {'prusa'})
+        summaries = {summary.print_id: summary for summary in self.second.max_failure_scores()}
+        self.assertEqual((summaries[ender].printer, summaries[ender].frames), ('ender', 3))
+        self.assertEqual((summaries[prusa].printer, summaries[prusa].frames), ('prusa', 3))
+        self.assertIsNotNone(summaries[ender].ended_at)
+        self.assertAlmostEqual(summaries[prusa].max_failure_score, 0.2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+'''
+Tests for running the model in inference worker processes.
+
+Example:
+    python -m pytest appdaemon/tests
+'''
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+APPS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'conf', 'apps')
+sys.path.insert(0, APPS_DIR)
+
+from lib.inference_worker import InferenceWorkerPool, RemoteInput
+from lib.onnx import DETECTION_DTYPE
+
+class MeanNet:
+    """A net that detects one box per image, with the mean pixel value of the image as its confidence."""
+    input_w = 8
+    input_h = 8
+
+    def preprocess(self, images):
+        return [float(image.mean()) / 255 for image in images]
+
+    def release_input(self, img_in):
+        pass
+
+    def infer(self, img_in):
+        return np.array(img_in, dtype=np.float32)
+
+    def postprocess(self, outputs, image_sizes, thresh, nms):
+        detections = []
+        for confidence in outputs:
+            image_detections = np.zeros(1, dtype=DETECTION_DTYPE)
+            image_detections['confidence'] = confidence
+            detections.append(image_detections)
+        return detections
+
+    def max_confidences(self, outputs):
+        return outputs
+
+def load_mean_net():
+    return MeanNet()
+
+def frame(value: int, size: int = 16) -> np.ndarray:
+    return np.full((size, size, 3), value, dtype=np.uint8)
+
+class InferenceWorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        # a pool for each test, as a worker that has already opened a segment can still read it after it is freed
+        self.pool = InferenceWorkerPool(load_mean_net, workers=1, timeout=30, start_timeout=120)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def confidence(self, remote_input: RemoteInput) -> float:
+        return float(self.pool.infer(remote_input).confidences[0])
+
+    def test_waiting_input_survives_larger_batches(self):
+        waiting = self.pool.preprocess([frame(10)])
+        for size in (16, 64, 128, 256, 512):
+            other = self.pool.preprocess([frame(200, size)])
+            self.assertNotEqual(other.segment, waiting.segment)
+            self.assertAlmostEqual(self.confidence(other), 200 / 255, places=5)
+            self.pool.release_input(other)
+        self.assertAlmostEqual(self.confidence(waiting), 10 / 255, places=5)
+        self.pool.release_input(waiting)
+
+    def test_released_segments_are_reused(self):
+        first = self.pool.preprocess([frame(1)])
+        self.pool.release_input(first)
+        second = self.pool.preprocess([frame(2)])
+        self.assertEqual(second.segment, first.segment)
+        self.pool.release_input(second)
+
+    def test_missing_segment_fails_the_batch_only(self):
+        with self.assertRaises(RuntimeError):
+            self.pool.infer(RemoteInput('print-detect-missing-segment', [(0, 16, 16)]))
+        remote_input = self.pool.preprocess([frame(50)])
+        self.assertAlmostEqual(self.confidence(remote_input), 50 / 255, places=5)
+        self.pool.release_input(remote_input)
+        self.assertEqual(self.pool.restarts, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+'''
+Tests for the detection pipeline.
+
+Example:
+    python -m pytest appdaemon/tests
+'''
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+import numpy as np
+
+APPS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'conf', 'apps')
+sys.path.insert(0, APPS_DIR)
+
+from lib.pipeline import DetectionCycle, DetectionPipeline
+from lib.preprocess import Preprocessor
+
+class TaggedNet:
+    """A net whose preprocess fills the input with the cycle's tag, and whose inference is slow."""
+
+    def __init__(self, infer_seconds: float):
+        self.preprocessor = Preprocessor(8, 8, buffers=3)
+        self.infer_seconds = infer_seconds
+
+    def preprocess(self, images):
+        return self.preprocessor(images)
+
+    def release_input(self, img_in):
+        self.preprocessor.release(img_in)
+
+class PipelineTest(unittest.TestCase):
+
+    def run_pipeline(self, net, fetch, submit, cycles: int, interval: float):
+        """Submit cycles at an interval and collect what the inference stage saw for each."""
+        lock = threading.Lock()
+        seen = []
+        errors = []
+
+        def preprocess(cycle):
+            cycle.tiles = [[printer] for printer in cycle.printers]
+            cycle.image_sizes = [(8, 8) for _ in cycle.printers]
+            cycle.images = [np.full((8, 8, 3), frame, dtype=np.uint8) for frame in cycle.frames]
+            cycle.input_tensor = cycle.net.preprocess(cycle.images)
+            return cycle
+
+        def inference(cycle):
+            try:
+                expected = [frame / 255 for frame in cycle.frames]
+                time.sleep(net.infer_seconds / 2)
+                first = cycle.input_tensor.mean(axis=(1, 2, 3)).tolist()
+                time.sleep(net.infer_seconds / 2)
+                with lock:
+                    seen.append((expected, first, cycle.input_tensor.mean(axis=(1, 2, 3)).tolist()))
+            finally:
+                cycle.release_input()
+            return cycle
+
+        def decision(cycle):
+            with lock:
+                seen.append(cycle)
+
+        pipeline = DetectionPipeline(fetch=fetch, preprocess=preprocess, inference=inference, decision=decision,
+                                     on_error=lambda stage, error: errors.append((stage, error)))
+        pipeline.start()
+        try:
+            for index in range(cycles):
+                submit(pipeline, index)
+                time.sleep(interval)
+            time.sleep(net.infer_seconds * 3)
+        finally:
+            pipeline.stop()
+        self.assertEqual(errors, [])
+        return seen
+
+    def test_input_is_not_overwritten_while_inferred(self):
+        net = TaggedNet(infer_seconds=0.3)
+
+        def fetch(cycle):
+            cycle.frames = [printer + 1 for printer in cycle.printers]
+            return cycle
+
+        def submit(pipeline, index):
+            pipeline.submit(DetectionCycle(printers=[index], net=net))
+
+        seen = self.run_pipeline(net, fetch, submit, cycles=30, interval=0.05)
+        inputs = [item for item in seen if isinstance(item, tuple)]
+        self.assertGreater(len(inputs), 2)
+        for expected, first, last in inputs:
+            np.testing.assert_allclose(first, expected, atol=1e-5)
+            np.testing.assert_allclose(last, expected, atol=1e-5)
+
+    def count_checks(self, fetch_seconds: float, infer_seconds: float, rounds: int, period: float):
+        """Submit a cycle for printer A then one for printer B each period, and count the checks of each at the decision stage."""
+        net = TaggedNet(infer_seconds=0)
+        checks = {'A': 0, 'B': 0}
+        lock = threading.Lock()
+        errors = []
+
+        def fetch(cycle):
+            time.sleep(fetch_seconds)
+            cycle.frames = [1] * len(cycle.printers)
+            return cycle
+
+        def preprocess(cycle):
+            cycle.tiles = [[printer] for printer in cycle.printers]
+            cycle.image_sizes = [(8, 8) for _ in cycle.printers]
+            cycle.images = [np.zeros((8, 8, 3), dtype=np.uint8) for _ in cycle.printers]
+            cycle.input_tensor = cycle.net.preprocess(cycle.images)
+            return cycle
+
+        def inference(cycle):
+            try:
+                self.assertEqual(len(cycle.input_tensor), len(cycle.printers))
+                time.sleep(infer_seconds)
+            finally:
+                cycle.release_input()
+            return cycle
+
+        def decision(cycle):
+            with lock:
+                for printer in cycle.printers:
+                    checks[printer] += 1
+
+        pipeline = DetectionPipeline(fetch=fetch, preprocess=preprocess, inference=inference, decision=decision,
+                                     on_error=lambda stage, error: errors.append((stage, error)))
+        pipeline.start()
+        try:
+            for _ in range(rounds):
+                pipeline.submit(DetectionCycle(printers=['A'], net=net))
+                time.sleep(period / 20)
+                pipeline.submit(DetectionCycle(printers=['B'], net=net))
+                time.sleep(period - period / 20)
+            time.sleep((fetch_seconds + infer_seconds) * 4)
+        finally:
+            pipeline.stop()
+        self.assertEqual(errors, [])
+        return checks
+
+    def test_slow_fetch_checks_every_printer(self):
+        checks = self.count_checks(fetch_seconds=0.3, infer_seconds=0, rounds=6, period=0.4)
+        self.assertEqual(checks, {'A': 6, 'B': 6})
+
+    def test_slow_inference_checks_every_printer(self):
+        checks = self.count_checks(fetch_seconds=0, infer_seconds=0.3, rounds=6, period=0.4)
+        self.assertGreaterEqual(min(checks.values()), 5)
+
+if __name__ == '__main__':
+    unittest.main()